@@ -0,0 +1,355 @@
+# -*- coding: utf-8 -*-
+
+"""Actor-Critic helpers, include the parallel asynchronous actors mode (A3C-style).
+
+In the parallel mode:
+    Several worker processes train their own classifier copies with a (local copy of the) shared actor,
+    and push (state, action, immediate reward, new state) transitions to the learner.
+    The learner (the main process) owns the actor and the critic, updates them with the transitions,
+    and broadcasts the actor parameters to the workers through shared memory periodically.
+"""
+
+from __future__ import print_function
+
+import multiprocessing as mp
+import traceback
+from collections import namedtuple, OrderedDict
+
+import numpy as np
+
+from .async_evaluator import ProbeSets, create_evaluator
+from .critic_network import CriticNetwork
+from .policy_network import PolicyNetworkBase
+from .utility import metrics
+from .utility.config import Config, PolicyConfig
+from .utility.my_logging import message
+from .utility.resource_monitor import monitor_phase
+from .utility.utils import floatX
+
+# Messages sent from the workers to the learner.
+Transition = namedtuple('Transition', ['worker_id', 'state', 'action', 'imm_reward', 'state_new', 'terminal'])
+EpisodeEnd = namedtuple('EpisodeEnd', ['worker_id', 'episode'])
+
+
+@monitor_phase('policy_update')
+def actor_critic_update(actor, critic, state, action, imm_reward, state_new, terminal):
+    """Update the critic and the actor with one transition.
+
+    Parameters
+    ----------
+    actor: PolicyNetworkBase
+    critic: CriticNetwork
+    state: the policy input of the batch before training.
+    action: the actions taken on the batch.
+    imm_reward: the immediate reward after training.
+    state_new: the policy input of the batch after training.
+    terminal: bool, is it the last epoch of the episode?
+
+    Returns
+    -------
+    The critic loss and the actor loss.
+    """
+
+    if critic.replay_memory is None:
+        # Get new actions, and compute new Q value
+        actions_new = actor.take_action(state_new, log_replay=False)
+
+        Q_value_new = critic.Q_function(state=state_new, action=actions_new)
+        if terminal:
+            label = imm_reward
+        else:
+            label = PolicyConfig['actor_gamma'] * Q_value_new + imm_reward
+
+        # Update the critic Q network
+        Q_loss = critic.update(state, action, floatX(label))
+    else:
+        # Sample a minibatch of transitions (include this one) from the replay memory,
+        # then evaluate and update the critic Q network on all of them at once.
+        critic.replay_memory.add(state, action, imm_reward, state_new, terminal)
+        states, actions, rewards, new_states, terminals, masks = critic.replay_memory.sample(
+            PolicyConfig['critic_replay_batch_size'])
+
+        sample_size, batch_size, feature_size = new_states.shape
+        actions_new = actor.take_action(
+            new_states.reshape((sample_size * batch_size, feature_size)), log_replay=False,
+        ).reshape((sample_size, batch_size))
+
+        # [NOTE] The actions sampled on the padded (zero) rows are not zero, and the Q value sums the actions over
+        # the batch, so mask them. The stored actions are masked too (they are zero-padded in the replay memory).
+        actions_new = actions_new * masks
+        actions = actions * masks
+
+        Q_values_new = critic.Q_batch_function_np(new_states, actions_new)
+        labels = floatX(rewards + PolicyConfig['actor_gamma'] * Q_values_new * (1. - terminals))
+
+        Q_loss = critic.update_batch(states, actions, labels)
+
+        # The first one is this transition.
+        label = labels[0]
+
+    # Update actor network
+    actor_loss = actor.update_raw(state, action, np.full(action.shape, label, dtype=state.dtype))
+
+    return Q_loss, actor_loss
+
+
+def display_AC_losses(updated, epoch, part_train_cost, display_freq):
+    """Display the losses of the transitions updated by `DelayedTransitions.update`."""
+
+    for key, imm_reward, losses in updated:
+        if losses is not None and (PolicyConfig['AC_update_freq'] >= display_freq or key % display_freq == 0):
+            Q_loss, actor_loss = losses
+            message('E {} TB {} Cost {} Critic loss {:.6f} Actor loss {:.6f}'
+                    .format(epoch, key, part_train_cost, float(Q_loss), float(actor_loss)))
+
+
+class DelayedTransitions(object):
+    """The transitions of the AC update points, waiting for their immediate rewards and new states.
+
+    The immediate reward is the accuracy on a (rotating) validation probe set,
+    evaluated by the evaluator on the parameter snapshot at the AC update point.
+    The completed transitions are sent into `update_AC` in order.
+
+    If "AC_async_reward" is set, the reward is evaluated in the background, and the new state is the policy input
+    of the next batch (already computed by the updater). Else the reward is evaluated inline, and the new state is
+    the policy input of the same batch after training (by `new_state_function`), so the transition is completed
+    at once (same as the synchronous AC update).
+    """
+
+    def __init__(self, model, update_AC, model_factory, x_validate, y_validate, use_async=True):
+        self.model = model
+        self.update_AC = update_AC
+
+        self.probe_sets = ProbeSets(len(y_validate), PolicyConfig['immediate_reward_sample_size'],
+                                    PolicyConfig['immediate_reward_probe_sets'])
+        self.delayed = use_async and PolicyConfig['AC_async_reward']
+        self.evaluator = create_evaluator(model_factory, {'validate': (x_validate, y_validate)}, self.delayed)
+
+        # key -> transition dict
+        self.transitions = OrderedDict()
+
+        # The key of the transition waiting for the new state.
+        self.waiting_state = None
+
+    def add(self, key, state, action, terminal, new_state_function):
+        """Add a transition at the AC update point.
+
+        Parameters
+        ----------
+        key: the key of the transition, usually the number of total train batches.
+        state, action, terminal: see `actor_critic_update`.
+        new_state_function: function
+            Compute the new state (the policy input of the same batch after training),
+            used at once if the transitions are not delayed, else if the episode is ended before the next batch.
+        """
+
+        # [NOTE] The transition still waiting for the new state (no batch of the same size came after it, such as
+        # the AC update point at the short last batch of an epoch) would block all later transitions forever,
+        # so complete it with its own new state function.
+        self._resolve_waiting_state()
+
+        self.evaluator.submit(key, self.model, 'validate', self.probe_sets.next_indices())
+
+        self.transitions[key] = {
+            'state': state,
+            'action': action,
+            'terminal': terminal,
+            'imm_reward': None,
+            'state_new': None,
+            'new_state_function': new_state_function,
+        }
+        self.waiting_state = key
+
+        if not self.delayed:
+            self._resolve_waiting_state()
+
+    def _resolve_waiting_state(self):
+        """Compute the new state of the transition waiting for it (if any)."""
+
+        if self.waiting_state is None:
+            return
+
+        transition = self.transitions[self.waiting_state]
+        transition['state_new'] = transition['new_state_function']()
+        self.waiting_state = None
+
+    def add_new_state(self, state_new):
+        """Give the policy input of a new batch to the transition waiting for the new state.
+
+        [NOTE] Batches of different size (the last batch of an epoch) are skipped,
+        the transition keeps waiting until the next batch or the next `add`.
+        """
+
+        if self.waiting_state is None or state_new is None:
+            return
+
+        transition = self.transitions[self.waiting_state]
+        if state_new.shape == transition['state'].shape:
+            transition['state_new'] = state_new
+            self.waiting_state = None
+
+    def update(self, flush=False):
+        """Update the actor and the critic with the completed transitions.
+
+        Parameters
+        ----------
+        flush: bool
+            Wait for all immediate rewards and compute the missing new states (at the end of the episode).
+
+        Returns
+        -------
+        List of (key, immediate reward, losses returned by `update_AC`).
+        """
+
+        for key, (_, acc, batches) in (self.evaluator.drain() if flush else self.evaluator.poll()):
+            self.transitions[key]['imm_reward'] = acc / batches
+
+        if flush:
+            self._resolve_waiting_state()
+
+        updated = []
+        while self.transitions:
+            key = next(iter(self.transitions))
+            transition = self.transitions[key]
+            if transition['imm_reward'] is None or transition['state_new'] is None:
+                break
+            del self.transitions[key]
+
+            losses = self.update_AC(transition['state'], transition['action'], transition['imm_reward'],
+                                    transition['state_new'], transition['terminal'])
+            updated.append((key, transition['imm_reward'], losses))
+
+        return updated
+
+    def close(self):
+        self.evaluator.close()
+
+
+class SharedParameters(object):
+    """The actor parameters in shared memory.
+
+    The learner pushes new values into it, and the workers pull them into their local actors.
+    [NOTE] Must be created before the workers are forked.
+    """
+
+    def __init__(self, parameters):
+        values = [parameter.get_value() for parameter in parameters]
+
+        self.shapes = [value.shape for value in values]
+        self.dtypes = [value.dtype for value in values]
+        self.buffers = [mp.RawArray('b', max(value.nbytes, 1)) for value in values]
+
+        # The version of the parameters, increased at each push.
+        self.version = mp.Value('l', 0)
+
+        self.push(parameters)
+
+    def _views(self):
+        return [np.frombuffer(buf, dtype=dtype, count=int(np.prod(shape))).reshape(shape)
+                for buf, dtype, shape in zip(self.buffers, self.dtypes, self.shapes)]
+
+    def push(self, parameters):
+        with self.version.get_lock():
+            for view, parameter in zip(self._views(), parameters):
+                view[...] = parameter.get_value()
+            self.version.value += 1
+
+    def pull(self, parameters, version=-1):
+        """Pull the parameters if they are newer than the given version.
+
+        Returns
+        -------
+        The version of the pulled parameters.
+        """
+
+        if self.version.value == version:
+            return version
+
+        with self.version.get_lock():
+            for view, parameter in zip(self._views(), parameters):
+                parameter.set_value(view.copy())
+            return self.version.value
+
+
+def _worker_entry(worker_main, worker_id, transition_queue, shared_actor):
+    # Different random seeds for different workers.
+    np.random.seed(Config['seed'] + worker_id + 1)
+
+    try:
+        worker_main(worker_id, transition_queue, shared_actor)
+    except:
+        message(traceback.format_exc())
+    finally:
+        # [NOTE] The process exits by `os._exit`, flush the buffered metrics of this worker before it.
+        metrics.close()
+
+        # Tell the learner that this worker is finished.
+        transition_queue.put(None)
+
+
+def run_parallel_actor_critic(worker_main, input_size, batch_size, display_freq=1):
+    """Run the learner and start the workers.
+
+    Parameters
+    ----------
+    worker_main: function
+        The main function of the workers, called as `worker_main(worker_id, transition_queue, shared_actor)`.
+        It must put `Transition` and `EpisodeEnd` into the queue.
+    input_size: int
+        The input size of the actor.
+    batch_size: int
+        The train batch size of the classifier.
+    display_freq: int
+        Display the losses per ? updates.
+    """
+
+    actor = PolicyNetworkBase.get_by_name(PolicyConfig['policy_model_type'])(input_size=input_size)
+    critic = CriticNetwork(feature_size=input_size, batch_size=batch_size)
+
+    actor.check_load()
+
+    shared_actor = SharedParameters(actor.parameters)
+    transition_queue = mp.Queue()
+
+    num_workers = PolicyConfig['AC_workers']
+    message('Start {} actor workers'.format(num_workers))
+
+    workers = [mp.Process(target=_worker_entry, args=(worker_main, worker_id, transition_queue, shared_actor))
+               for worker_id in range(num_workers)]
+    for worker in workers:
+        worker.daemon = True
+        worker.start()
+
+    running_workers = num_workers
+    total_updates = 0
+
+    while running_workers > 0:
+        item = transition_queue.get()
+
+        if item is None:
+            running_workers -= 1
+            continue
+
+        if isinstance(item, EpisodeEnd):
+            # [NOTE] The episodes of the learner follow the worker 0.
+            if item.worker_id == 0:
+                if PolicyConfig['policy_save_freq'] > 0 and item.episode % PolicyConfig['policy_save_freq'] == 0:
+                    actor.save_policy(PolicyConfig['policy_save_file'], item.episode)
+                actor.start_new_episode(item.episode + 1)
+            continue
+
+        Q_loss, actor_loss = actor_critic_update(
+            actor, critic, item.state, item.action, item.imm_reward, item.state_new, item.terminal)
+        total_updates += 1
+
+        if total_updates % PolicyConfig['AC_broadcast_freq'] == 0:
+            shared_actor.push(actor.parameters)
+
+        if total_updates % display_freq == 0:
+            message('Learner U {} W {} Reward {:.6f} Critic loss {:.6f} Actor loss {:.6f}'
+                    .format(total_updates, item.worker_id, float(item.imm_reward), float(Q_loss), float(actor_loss)))
+
+    for worker in workers:
+        worker.join()
+
+    message('Learner done, total updates: {}'.format(total_updates))
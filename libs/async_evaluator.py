@@ -0,0 +1,356 @@
+# -*- coding: utf-8 -*-
+
+"""Evaluate the classifier on parameter snapshots, in a background process (or inline).
+
+The background evaluator process builds its own classifier with the model factory,
+and the datasets are shared with it by fork (so they are not copied).
+The main process sends (key, parameter snapshot, data name, indices) jobs to it, and polls the results
+without blocking, so the training of the classifier is never stalled.
+"""
+
+from __future__ import print_function
+
+import multiprocessing as mp
+import traceback
+from multiprocessing.queues import Empty
+
+from collections import OrderedDict
+
+import numpy as np
+import theano
+
+from .utility import metrics
+from .utility.config import Config, PolicyConfig
+from .utility.my_logging import message
+from .utility.utils import vp_result_message, is_new_best_validation
+
+
+class ProbeSets(object):
+    """Precomputed random probe subsets of a dataset, used in rotation.
+
+    The subsets are stored as sorted index arrays, so the data is never copied.
+    """
+
+    def __init__(self, data_size, sample_size, number):
+        sample_size = min(sample_size, data_size)
+
+        self.index_sets = [np.sort(np.random.choice(data_size, sample_size, replace=False))
+                           for _ in range(max(number, 1))]
+        self.position = 0
+
+    def __len__(self):
+        return len(self.index_sets)
+
+    def next_indices(self):
+        indices = self.index_sets[self.position]
+        self.position = (self.position + 1) % len(self.index_sets)
+        return indices
+
+
+class SyncEvaluator(object):
+    """Evaluate the current parameters of the model inline."""
+
+    def __init__(self, datasets):
+        self.datasets = datasets
+        self.results = []
+
+    def submit(self, key, model, data_name, indices=None, snapshot=None):
+        x, y = self.datasets[data_name]
+        self.results.append((key, model.validate_or_test(x, y, indices)))
+
+    def poll(self, block=False):
+        results, self.results = self.results, []
+        return results
+
+    def drain(self):
+        return self.poll()
+
+    def close(self):
+        pass
+
+
+def _evaluator_main(model_factory, datasets, job_queue, result_queue):
+    model = model_factory()
+
+    # The datasets are fixed, so the model can cache their evaluation batches (if it supports, such as IMDB).
+    if hasattr(model, 'register_eval_data'):
+        for x, y in datasets.values():
+            model.register_eval_data(x, y)
+
+    while True:
+        job = job_queue.get()
+        if job is None:
+            break
+
+        key, snapshot, data_name, indices = job
+        x, y = datasets[data_name]
+
+        model.set_parameter_snapshot(snapshot)
+        result_queue.put((key, model.validate_or_test(x, y, indices)))
+
+
+def _evaluator_entry(model_factory, datasets, job_queue, result_queue):
+    try:
+        _evaluator_main(model_factory, datasets, job_queue, result_queue)
+    except:
+        message(traceback.format_exc())
+    finally:
+        # [NOTE] The process exits by `os._exit`, flush the buffered metrics of this process before it.
+        metrics.close()
+
+
+class AsyncEvaluator(object):
+    """Evaluate the parameter snapshots of the model in a background process.
+
+    [NOTE] Must be created after the datasets are loaded (they are shared by fork).
+    """
+
+    def __init__(self, model_factory, datasets):
+        self.job_queue = mp.Queue()
+        self.result_queue = mp.Queue()
+
+        # Number of submitted jobs without results.
+        self.pending = 0
+
+        self.process = mp.Process(target=_evaluator_entry,
+                                  args=(model_factory, datasets, self.job_queue, self.result_queue))
+        self.process.daemon = True
+        self.process.start()
+
+    def submit(self, key, model, data_name, indices=None, snapshot=None):
+        """Submit a job.
+
+        Parameters
+        ----------
+        key: the key of the result.
+        model: the classifier in the main process.
+        data_name: the name of the dataset.
+        indices: array of int or None
+            The indices of the evaluated data (None means the whole dataset).
+        snapshot: the parameter snapshot of the model, take a new one if it is None.
+        """
+
+        if snapshot is None:
+            snapshot = model.get_parameter_snapshot()
+        self.job_queue.put((key, snapshot, data_name, indices))
+        self.pending += 1
+
+    def _get(self, block):
+        try:
+            result = self.result_queue.get(block=block, timeout=1.0 if block else None)
+        except Empty:
+            if block and not self.process.is_alive():
+                raise RuntimeError('The evaluator process exited unexpectedly')
+            return None
+        self.pending -= 1
+        return result
+
+    def poll(self, block=False):
+        """Get the finished results.
+
+        Parameters
+        ----------
+        block: bool
+            Wait until at least one result is finished (if there are pending jobs).
+        """
+
+        results = []
+        while self.pending > 0:
+            result = self._get(block and not results)
+            if result is None:
+                if block and not results:
+                    continue
+                break
+            results.append(result)
+        return results
+
+    def drain(self):
+        """Wait for the results of all submitted jobs."""
+
+        results = []
+        while self.pending > 0:
+            result = self._get(True)
+            if result is not None:
+                results.append(result)
+        return results
+
+    def close(self):
+        self.job_queue.put(None)
+        self.process.join()
+
+
+def create_evaluator(model_factory, datasets, use_async=True):
+    """Create the evaluator.
+
+    Parameters
+    ----------
+    model_factory: function
+        Build a new classifier in the evaluator process.
+    datasets: dict
+        The data name -> (x, y) map.
+    use_async: bool
+        Use the background process or not.
+        [NOTE] Only available on CPU (CUDA contexts can not be forked), and can not be used in daemonic processes.
+    """
+
+    if use_async and not theano.config.device.startswith('cpu'):
+        message('Asynchronous evaluator is only available on CPU, use synchronous evaluator instead')
+        use_async = False
+
+    if use_async and mp.current_process().daemon:
+        use_async = False
+
+    if use_async:
+        return AsyncEvaluator(model_factory, datasets)
+    return SyncEvaluator(datasets)
+
+
+class AsyncValidator(object):
+    """Run the validation (and test) of the validation points asynchronously on the parameter snapshots.
+
+    The results are delivered to the reward checker and `updater.history_accuracy` in order.
+    At most `lag` validation points can be waiting for their results,
+    so the features which need the history accuracy (such as `add_average_accuracy`) lag at most `lag` points.
+    """
+
+    def __init__(self, model_factory, x_validate, y_validate, x_test, y_test, lag=None):
+        self.evaluator = create_evaluator(model_factory, {
+            'validate': (x_validate, y_validate),
+            'test': (x_test, y_test),
+        })
+        self.lag = PolicyConfig['async_vp_lag'] if lag is None else lag
+
+        # vp_number -> validation point dict
+        self.validation_points = OrderedDict()
+
+        # (validate_acc, test_acc, vp_state) of the validation points delivered after the last submit (or wait)
+        self.unreported = []
+
+    def submit(self, model, updater, vp_state, reward_checker, train_loss, validate_indices, run_test,
+               train_loss_ci=None):
+        """Submit a validation point.
+
+        Returns
+        -------
+        List of (validate_acc, test_acc, vp_state) delivered after the last submit
+        (include the results delivered by `poll` between the validation points), in order.
+        """
+
+        key = vp_state.vp_number
+        snapshot = model.get_parameter_snapshot()
+
+        # In "test_on_improvement" mode, the test is deferred until the validation result is delivered.
+        defer_test = run_test and Config['test_on_improvement']
+
+        self.evaluator.submit(('validate', key), model, 'validate', validate_indices, snapshot)
+        if run_test and not defer_test:
+            self.evaluator.submit(('test', key), model, 'test', None, snapshot)
+
+        self.validation_points[key] = {
+            'model': model,
+            'updater': updater,
+            'vp_state': vp_state,
+            'reward_checker': reward_checker,
+            'train_loss': train_loss,
+            'train_loss_ci': train_loss_ci,
+            'run_test': run_test,
+            'snapshot': snapshot if defer_test else None,
+            'test_carried': False,
+            'validate': None,
+            'test': None,
+        }
+
+        self.poll()
+        while len(self.validation_points) > self.lag:
+            self.poll(block=True)
+
+        result, self.unreported = self.unreported, []
+        return result
+
+    def poll(self, block=False):
+        for (data_name, key), result in self.evaluator.poll(block):
+            self.validation_points[key][data_name] = result
+
+        while self.validation_points:
+            key = next(iter(self.validation_points))
+            validation_point = self.validation_points[key]
+            if validation_point['validate'] is None:
+                break
+
+            if validation_point['snapshot'] is not None:
+                # Test the snapshot only if the validation accuracy is a new best.
+                _, validate_acc, validate_batches = validation_point['validate']
+                if is_new_best_validation(validate_acc / validate_batches, validation_point['updater']):
+                    self.evaluator.submit(('test', key), validation_point['model'], 'test', None,
+                                          validation_point['snapshot'])
+                else:
+                    validation_point['test_carried'] = True
+                validation_point['snapshot'] = None
+
+            if validation_point['run_test'] and not validation_point['test_carried'] and \
+                    validation_point['test'] is None:
+                break
+            del self.validation_points[key]
+
+            self._deliver(validation_point)
+
+    def wait(self):
+        """Wait for all validation points.
+
+        Returns
+        -------
+        List of (validate_acc, test_acc, vp_state) delivered after the last submit.
+        """
+
+        while self.validation_points:
+            self.poll(block=True)
+
+        result, self.unreported = self.unreported, []
+        return result
+
+    def _deliver(self, validation_point):
+        validate_loss, validate_acc, validate_batches = validation_point['validate']
+        validate_loss /= validate_batches
+        validate_acc /= validate_batches
+
+        updater = validation_point['updater']
+
+        if validation_point['test_carried']:
+            test_loss = None
+            test_acc = updater.last_test_acc
+        elif validation_point['run_test']:
+            test_loss, test_acc, test_batches = validation_point['test']
+            test_loss /= test_batches
+            test_acc /= test_batches
+            updater.last_test_acc = test_acc
+        else:
+            test_loss = None
+            test_acc = None
+
+        vp_result_message(validation_point['vp_state'], validation_point['train_loss'],
+                          validate_loss, validate_acc, test_loss, test_acc, validation_point['test_carried'],
+                          train_loss_ci=validation_point['train_loss_ci'])
+
+        # Check speed rewards
+        if validation_point['reward_checker'] is not None:
+            validation_point['reward_checker'].check(validate_acc, validation_point['vp_state'])
+
+        updater.history_accuracy.append(validate_acc)
+
+        # The accuracy is paired with the position of its own validation point.
+        if updater.vp_scheduler is not None:
+            updater.vp_scheduler.add_result(validation_point['vp_state'].total_train_batches, validate_acc)
+
+        self.unreported.append((validate_acc, test_acc, validation_point['vp_state']))
+
+    def close(self):
+        self.evaluator.close()
+
+
+def get_async_validator(model_factory, x_validate, y_validate, x_test, y_test):
+    """Create the asynchronous validator if "async_vp" is set, else return None."""
+
+    if not PolicyConfig['async_vp']:
+        return None
+    return AsyncValidator(model_factory, np.asarray(x_validate), np.asarray(y_validate),
+                          np.asarray(x_test), np.asarray(y_test))
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+
+"""Benchmark the train function of the model with the current Theano settings (see `utility/theano_setup.py`).
+
+Run as `python -m libs.autotune` in a new process (the Theano settings are set by environment variables),
+read the job (a JSON dict of "dataset", "config" and "iterations") from stdin,
+and print the time (seconds) per train batch.
+"""
+
+from __future__ import print_function
+
+import json
+import sys
+import time
+
+import numpy as np
+
+from .utility.config import Config
+from .utility.utils import floatX
+
+
+def build_benchmark(dataset):
+    """Build the model of the dataset and a random train batch.
+
+    Returns
+    -------
+    The train function and its inputs.
+    """
+
+    if dataset == 'cifar10':
+        from .model_class.CIFAR10 import CIFARModelBase, ParamConfig
+
+        model = CIFARModelBase.get_by_name(ParamConfig['model_name'])()
+        batch_size = model.train_batch_size
+        inputs = [floatX(np.random.rand(batch_size, 3, 32, 32)),
+                  np.random.randint(0, model.output_size, batch_size).astype('int32')]
+    elif dataset == 'mnist':
+        from .model_class.MNIST import MNISTModel
+
+        model = MNISTModel()
+        batch_size = model.train_batch_size
+        inputs = [floatX(np.random.rand(batch_size, 784)),
+                  np.random.randint(0, model.output_size, batch_size).astype('int64')]
+    elif dataset == 'imdb':
+        from .model_class.IMDB import IMDBModelBase, IMDBModel, ParamConfig
+
+        # [NOTE] "ydim" is set by `preprocess_imdb_data` when the data is loaded, which is skipped here.
+        ParamConfig['ydim'] = IMDBModelBase.output_size
+
+        model = IMDBModel()
+        batch_size = model.train_batch_size
+        steps = min(ParamConfig['maxlen'] or 100, 100)
+        inputs = [np.random.randint(2, ParamConfig['n_words'], (steps, batch_size)).astype('int64'),
+                  floatX(np.ones((steps, batch_size))),
+                  np.random.randint(0, model.output_size, batch_size).astype('int64')]
+    else:
+        raise KeyError('Unknown dataset {}'.format(dataset))
+
+    return model.f_train, inputs
+
+
+def main():
+    job = json.loads(sys.stdin.read())
+
+    dataset = job['dataset']
+    Config[dataset].update(job['config'])
+
+    f_train, inputs = build_benchmark(dataset)
+
+    # Warm up (include the compilation)
+    for _ in range(2):
+        f_train(*inputs)
+
+    start_time = time.time()
+    for _ in range(job['iterations']):
+        f_train(*inputs)
+
+    print((time.time() - start_time) / job['iterations'])
+
+
+if __name__ == '__main__':
+    main()
@@ -5,32 +5,11 @@ from __future__ import print_function
 
 import heapq
 from collections import deque
-from itertools import izip
 
 import numpy as np
 
-from utility.extensions import PartLossChecker
-from utility.config import Config, PolicyConfig
-from utility.utils import message, get_rank
-
-# Some Magic Numbers.
-
-# Number of classes and size of each class.
-ClassSize = 5000
-ClassNumber = 10
-TotalSize = ClassSize * ClassNumber
-
-# Compute loss when needed in "log_data" (all updaters except SPL).
-# [NOTE] It will cause computation of loss on each data, and will slow down the training process.
-ComputeLoss = True
-
-# The target distribution of each corrupt levels.
-# [NOTE] This can be changed.
-TargetDistribution = np.array([0.20, 0.16, 0.12, 0.08, 0.04, 0.00, 0.04, 0.08, 0.12, 0.16])
-
-
-def _score(distribution):
-    return np.sum((TargetDistribution - distribution) ** 2)
+from diagnostics import Hooks, policy_input_losses
+from utility.phase_profiler import phase
 
 
 class BatchUpdater(object):
@@ -44,6 +23,10 @@ class BatchUpdater(object):
         kwargs :
             prepare_data: function, optional
                 The prepare data function.
+            async_validator: AsyncValidator, optional
+                Run the validation points asynchronously.
+            vp_scheduler: ValidationScheduler, optional
+                Schedule the validation points adaptively.
         """
 
         self.batch_size = model.train_batch_size
@@ -71,11 +54,8 @@ class BatchUpdater(object):
         self.total_train_batches = 0
         self.total_accepted_cases = 0
 
-        if Config['temp_job'] == 'check_selected_data_label':
-            self.epoch_label_count = np.zeros((self.model.output_size,), dtype='int64')
-            self.total_label_count = np.zeros((self.model.output_size,), dtype='int64')
-        elif Config['temp_job'] == 'check_part_loss':
-            self.part_loss_checker = PartLossChecker(self)
+        # The training losses of the batches after the last validation point (used by the "running" estimator)
+        self.vp_train_losses = []
 
         # A hook: the last update batch index.
         self.last_update_batch_index = None
@@ -85,19 +65,29 @@ class BatchUpdater(object):
 
         self.history_accuracy = []
 
-        if Config['temp_job'] == 'log_data':
-            # self.part_updated_indices = [0 for _ in range(ClassNumber)]
-            # self.updated_indices = [0 for _ in range(ClassNumber)]
+        # The test accuracy of the last tested validation point (used in "test_on_improvement" mode)
+        self.last_test_acc = None
 
-            self.part_avg_loss = [[] for _ in range(ClassNumber)]
-            self.avg_loss = [[] for _ in range(ClassNumber)]
-        elif Config['temp_job'] == 'dump_index':
-            self.train_index = []
+        # The asynchronous validator (None means run the validation points synchronously)
+        self.async_validator = kwargs.get('async_validator', None)
+
+        # The adaptive validation scheduler (None means validate per `valid_freq` batches)
+        self.vp_scheduler = kwargs.get('vp_scheduler', None)
+
+        # The event callbacks of the diagnostics (selected by "temp_job")
+        self.hooks = Hooks(self)
 
     @property
     def data_size(self):
         return len(self.all_data[0])
 
+    @property
+    def vp_position(self):
+        """The nominal validation point number of the adaptive validation scheduler (None if it is not used)."""
+        if self.vp_scheduler is None:
+            return None
+        return self.vp_scheduler.vp_position(self.total_train_batches)
+
     @property
     def total_seen_cases(self):
         return self.batch_size * self.iteration
@@ -129,30 +119,21 @@ class BatchUpdater(object):
         self.epoch_accepted_cases = 0
         self.epoch_history_train_loss = 0.0
 
-        if Config['temp_job'] == 'check_selected_data_label':
-            self.epoch_label_count.fill(0)
-        elif Config['temp_job'] == 'dump_index':
-            self.train_index.append([])
+        for hook in self.hooks.epoch_start:
+            hook()
 
     def train_batch_buffer(self):
         self.last_update_batch_index = [self.buffer.popleft() for _ in range(self.batch_size)]
 
-        if Config['temp_job'] == 'dump_index':
-            self.train_index[-1].append(self.last_update_batch_index)
-
         # Get x[], mask[], y[], ..., then prepare them
-        selected_batch_data = [data[self.last_update_batch_index] for data in self.all_data]
-
-        if Config['temp_job'] == 'check_selected_data_label':
-            selected_batch_label = selected_batch_data[-1]
-            for i in range(len(self.epoch_label_count)):
-                count_i = sum(selected_batch_label == i)
-                self.epoch_label_count[i] += count_i
-                self.total_label_count[i] += count_i
+        with phase('gather'):
+            selected_batch_data = [data[self.last_update_batch_index] for data in self.all_data]
 
         # [NOTE] Prepared data may swap the axis (in IMDB)!
-        p_selected_batch_data = self.prepare_data(*selected_batch_data)
-        part_train_cost = self.model.f_train(*p_selected_batch_data)
+        with phase('prepare_data'):
+            p_selected_batch_data = self.prepare_data(*selected_batch_data)
+        with phase('f_train'):
+            part_train_cost = self.model.f_train(*p_selected_batch_data)
 
         if np.isinf(part_train_cost) or np.isnan(part_train_cost):
             raise OverflowError('NaN detected at epoch {} case {}'.format(self.epoch, self.epoch_accepted_cases))
@@ -163,122 +144,53 @@ class BatchUpdater(object):
         self.total_accepted_cases += len(selected_batch_data[0])
         self.total_train_batches += 1
 
-        if Config['temp_job'] == 'check_part_loss':
-            self.part_loss_checker.check()
-        elif Config['temp_job'] == 'train_analysis':
-            probability = self.model.get_policy_input(*(selected_batch_data + [self, self.history_accuracy]))
-            message('Loss', part_train_cost)
-            for line in probability:
-                message(' '.join('{:.6f}'.format(e) for e in line))
+        for hook in self.hooks.batch_trained:
+            hook(self.last_update_batch_index, selected_batch_data, part_train_cost)
 
         self.epoch_history_train_loss += part_train_cost
+        self.vp_train_losses.append(float(part_train_cost))
 
         return part_train_cost
 
     def add_batch(self, batch_index, *args):
         self.iteration += 1
 
-        selected_index = self.filter_batch(batch_index, *args)
+        if self.async_validator is not None:
+            self.async_validator.poll()
+
+        with phase('filter'):
+            selected_index = self.filter_batch(batch_index, *args)
 
         self.buffer.extend(selected_index)
 
         if len(self.buffer) >= self.batch_size:
-            return self.train_batch_buffer()
+            with phase('train'):
+                return self.train_batch_buffer()
         else:
             return None
 
-    # Only for temp_job:"log_data"
-    def add_index(self, index, loss=0.0):
-        # [NOTE] cifar10 have mirrored data, so mod TotalSize.
-        clazz = (index % TotalSize) // ClassSize
-
-        # self.part_updated_indices[clazz] += 1
-        # self.updated_indices[clazz] += 1
-
-        self.part_avg_loss[clazz].append(loss)
-        self.avg_loss[clazz].append(loss)
-
-    # Only for temp_job:"log_data"
-    def add_index_list(self, indices):
-        if Config['temp_job'] == 'log_data':
-            if ComputeLoss:
-                selected_batch_data = [data[indices] for data in self.all_data]
-                selected_batch_data = self.prepare_data(*selected_batch_data)
-                cost_list = self.model.f_cost_list_without_decay(*selected_batch_data)
-            else:
-                cost_list = [0.0 for _ in indices]
-            for idx, loss in izip(indices, cost_list):
-                self.add_index(idx, loss)
-
-    # Only for temp_job:"log_data"
-    def log_data_message_at_vp(self, reset=True, test_margin=True):
-        updated_indices = [len(loss_list) for loss_list in self.avg_loss]
-        part_updated_indices = [len(loss_list) for loss_list in self.part_avg_loss]
-
-        total_indices = sum(updated_indices)
-        part_total_indices = sum(part_updated_indices)
-
-        part_ratios = [n / float(part_total_indices) for n in part_updated_indices]
-        total_ratios = [n / float(total_indices) for n in updated_indices]
-
-        message('[Log Data]')
-        message('Part  (total {:>8}): {}'.format(
-            part_total_indices,
-            '\t'.join(format(val, '.3f') for val in part_ratios)))
-        message('Whole (total {:>8}): {}'.format(
-            total_indices,
-            '\t'.join(format(val, '.3f') for val in total_ratios)))
-        message('Score                 :',
-                'Part =', format(_score(part_ratios), '.6f'),
-                'Total = ', format(_score(total_ratios), '.6f'))
-
-        message('Part Avg Loss         :', '\t'.join(format(np.mean(l_list), '.3f') for l_list in self.part_avg_loss))
-        message('Part Loss Std         :', '\t'.join(format(np.std(l_list), '.3f') for l_list in self.part_avg_loss))
-        message('Total Avg Loss        :', '\t'.join(format(np.mean(l_list), '.3f') for l_list in self.avg_loss))
-        message('Total Loss Std        :', '\t'.join(format(np.std(l_list), '.3f') for l_list in self.avg_loss))
+    def batch_selected(self, indices, losses=None, policy_input=None, action=None):
+        """Send the selected indices of a batch to the diagnostics.
 
-        if test_margin:
-            # Test to get the (average) margin and loss rank.
-            # Get 10 batches in each corrupt level.
-            SampleBatchNumber = 100
-
-            message('Test the margin for all {} corrupt levels:'.format(ClassNumber))
-
-            mean_feature_list = []
-            std_feature_list = []
-
-            for level in range(ClassNumber):
-                class_range = np.arange(level * ClassSize, (level + 1) * ClassSize)
-
-                to_be_stacked = []
-
-                for _ in range(SampleBatchNumber):
-                    sample_batch_idx = np.random.choice(class_range, self.batch_size)
-                    sample_batch_data = [data[sample_batch_idx] for data in self.all_data]
-                    p_sample_batch_data = self.prepare_data(*sample_batch_data)
-
-                    features = self.model.get_policy_input(*(p_sample_batch_data + (self, self.history_accuracy)))
-                    to_be_stacked.append(features)
-
-                all_features = np.hstack(to_be_stacked)
-
-                mean_features = all_features.mean(axis=0)
-                std_features = all_features.std(axis=0)
-
-                mean_feature_list.append(mean_features)
-                std_feature_list.append(std_features)
-
-            message('Margin Avg            :', '\t'.join(format(mf[-4], '.3f') for mf in mean_feature_list))
-            message('Margin Std            :', '\t'.join(format(sf[-4], '.3f') for sf in std_feature_list))
+        Parameters
+        ----------
+        indices: list of int
+        losses: array or None
+            The losses of the selected indices, if they are already computed.
+        policy_input, action: array or None
+            The policy inputs and actions of the whole batch, the losses are read from them if possible.
+        """
 
-        message('[Log Data End]')
+        if not self.hooks.batch_selected:
+            return
 
-        if reset:
-            # self.part_updated_indices = [0 for _ in range(ClassNumber)]
-            self.part_avg_loss = [[] for _ in range(ClassNumber)]
+        if losses is None and policy_input is not None:
+            losses = policy_input_losses(policy_input, self.model.output_size)
+            if losses is not None:
+                losses = losses[np.asarray(action, dtype=bool)]
 
-    def log_dropped_data_message_at_vp(self):
-        pass
+        for hook in self.hooks.batch_selected:
+            hook(indices, losses)
 
 
 class RawUpdater(BatchUpdater):
@@ -286,7 +198,7 @@ class RawUpdater(BatchUpdater):
         super(RawUpdater, self).__init__(model, all_data, **kwargs)
 
     def filter_batch(self, batch_index, *args):
-        self.add_index_list(batch_index)
+        self.batch_selected(batch_index)
         return list(batch_index)
 
 
@@ -312,15 +224,19 @@ class SPLUpdater(BatchUpdater):
     def filter_batch(self, batch_index, *args):
         selected_number = self.cost_threshold(self.iteration)
 
-        selected_batch_data = [data[batch_index] for data in self.all_data]
-        selected_batch_data = self.prepare_data(*selected_batch_data)
+        with phase('gather'):
+            selected_batch_data = [data[batch_index] for data in self.all_data]
+        with phase('prepare_data'):
+            selected_batch_data = self.prepare_data(*selected_batch_data)
 
         targets = selected_batch_data[-1]
 
-        cost_list = self.model.f_cost_list_without_decay(*selected_batch_data)
+        with phase('cost_list'):
+            cost_list = self.model.f_cost_list_without_decay(*selected_batch_data)
         label_cost_lists = [cost_list[targets == label] for label in range(self.model.output_size)]
 
         result = []
+        result_positions = []
 
         for i, label_cost_list in enumerate(label_cost_lists):
             if label_cost_list.size != 0:
@@ -328,8 +244,9 @@ class SPLUpdater(BatchUpdater):
                 for j in range(len(targets)):
                     if targets[j] == i and cost_list[j] <= threshold:
                         result.append(batch_index[j])
-                        if Config['temp_job'] == 'log_data':
-                            self.add_index(batch_index[j], cost_list[j])
+                        result_positions.append(j)
+
+        self.batch_selected(result, cost_list[result_positions])
 
         return result
 
@@ -344,15 +261,19 @@ class TrainPolicyUpdater(BatchUpdater):
         # self.policy.start_new_validation_point()
 
     def filter_batch(self, batch_index, *args):
-        selected_batch_data = [data[batch_index] for data in self.all_data]
-        selected_batch_data = self.prepare_data(*selected_batch_data)
+        with phase('gather'):
+            selected_batch_data = [data[batch_index] for data in self.all_data]
+        with phase('prepare_data'):
+            selected_batch_data = self.prepare_data(*selected_batch_data)
 
-        probability = self.model.get_policy_input(*(selected_batch_data + (self, self.history_accuracy) + args))
-        action = self.policy.take_action(probability, True)
+        with phase('policy_input'):
+            probability = self.model.get_policy_input(*(selected_batch_data + (self, self.history_accuracy) + args))
+        with phase('policy_action'):
+            action = self.policy.take_action(probability, True)
 
         result = [index for i, index in enumerate(batch_index) if action[i]]
 
-        self.add_index_list(result)
+        self.batch_selected(result, policy_input=probability, action=action)
 
         return result
 
@@ -370,15 +291,19 @@ class ACUpdater(BatchUpdater):
         self.policy.start_new_validation_point()
 
     def filter_batch(self, batch_index, *args):
-        selected_batch_data = [data[batch_index] for data in self.all_data]
-        selected_batch_data = self.prepare_data(*selected_batch_data)
+        with phase('gather'):
+            selected_batch_data = [data[batch_index] for data in self.all_data]
+        with phase('prepare_data'):
+            selected_batch_data = self.prepare_data(*selected_batch_data)
 
-        probability = self.model.get_policy_input(*(selected_batch_data + (self, self.history_accuracy) + args))
-        action = self.policy.take_action(probability, False)
+        with phase('policy_input'):
+            probability = self.model.get_policy_input(*(selected_batch_data + (self, self.history_accuracy) + args))
+        with phase('policy_action'):
+            action = self.policy.take_action(probability, False)
 
         result = [index for i, index in enumerate(batch_index) if action[i]]
 
-        self.add_index_list(result)
+        self.batch_selected(result, policy_input=probability, action=action)
 
         self.last_probability = probability
         self.last_action = action
@@ -391,62 +316,31 @@ class TestPolicyUpdater(BatchUpdater):
         super(TestPolicyUpdater, self).__init__(model, all_data, **kwargs)
         self.policy = policy
 
-        if Config['temp_job'] == 'log_dropped_data':
-            self.total_dropped_ranks = [0 for _ in range(self.batch_size)]
-            self.part_dropped_ranks = [0 for _ in range(self.batch_size)]
-
     def start_new_epoch(self):
         super(TestPolicyUpdater, self).start_new_epoch()
         self.policy.start_new_validation_point()
 
     def filter_batch(self, batch_index, *args):
-        selected_batch_data = [data[batch_index] for data in self.all_data]
-        p_selected_batch_data = self.prepare_data(*selected_batch_data)
+        with phase('gather'):
+            selected_batch_data = [data[batch_index] for data in self.all_data]
+        with phase('prepare_data'):
+            p_selected_batch_data = self.prepare_data(*selected_batch_data)
 
-        probability = self.model.get_policy_input(*(p_selected_batch_data + (self, self.history_accuracy) + args))
-        action = self.policy.take_action(probability, False)
+        with phase('policy_input'):
+            probability = self.model.get_policy_input(*(p_selected_batch_data + (self, self.history_accuracy) + args))
+        with phase('policy_action'):
+            action = self.policy.take_action(probability, False)
 
         result = [index for i, index in enumerate(batch_index) if action[i]]
 
         # todo: log features of dropped data here
-        if Config['temp_job'] == 'log_dropped_data':
-            # [NOTE] Just log rank now.
-            if PolicyConfig['add_loss_rank'] is True:
-                for a, p in izip(action, probability):
-                    if not a:
-                        rank = int(round(p[-2] * self.batch_size))
-
-                        self.total_dropped_ranks[rank] += 1
-                        self.part_dropped_ranks[rank] += 1
-            else:
-                # [NOTE] Compatibility for old IMDB version
-                # loss = -log(P(y)), output of PolicyConfig['add_label_input'] is log(P(y)).
-                losses = np.array([-prob[self.model.output_size] for prob in probability])
-
-                rank = get_rank(losses)
+        for hook in self.hooks.batch_filtered:
+            hook(action, probability)
 
-                for a, r in izip(action, rank):
-                    if not a:
-                        self.total_dropped_ranks[int(round(r))] += 1
-                        self.part_dropped_ranks[int(round(r))] += 1
-
-        self.add_index_list(result)
+        self.batch_selected(result, policy_input=probability, action=action)
 
         return result
 
-    def log_dropped_data_message_at_vp(self):
-        message('[Log Dropped Data]')
-        message('Rank distribution (0 -> batch_size) of dropped data')
-
-        message('Part  (total {:>8}):'.format(sum(self.part_dropped_ranks)),
-                '\t'.join(str(r) for r in self.part_dropped_ranks))
-        message('Total (total {:>8}):'.format(sum(self.total_dropped_ranks)),
-                '\t'.join(str(r) for r in self.total_dropped_ranks))
-
-        message('[Log Dropped Data End]')
-
-        self.part_dropped_ranks = [0 for _ in range(self.batch_size)]
-
 
 class RandomDropUpdater(BatchUpdater):
     def __init__(self, model, all_data, random_drop_number_file, **kwargs):
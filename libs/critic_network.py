@@ -9,15 +9,90 @@ import numpy as np
 import theano
 import theano.tensor as T
 
+from .utility.lazy_function import LazyFunction
 from .utility.optimizers import get_optimizer
 from .utility.utils import fX, floatX
 from .utility.config import PolicyConfig
 
 
+class ReplayMemory(object):
+    """The replay memory of the critic, with a fixed capacity. The oldest transition is evicted when it is full.
+
+    Transitions are stored in preallocated numpy arrays.
+    States and actions of batches smaller than `batch_size` are padded with zeros, and the real length of each
+    transition is stored. [NOTE] The Q value sums the actions over the whole batch axis, so the padded rows must
+    keep zero actions: the actions computed on them (such as the new actions of the new states) must be masked
+    by the row masks returned by `sample`.
+    """
+
+    def __init__(self, capacity, batch_size, feature_size):
+        self.capacity = capacity
+        self.batch_size = batch_size
+
+        self.states = np.zeros((capacity, batch_size, feature_size), dtype=fX)
+        self.actions = np.zeros((capacity, batch_size), dtype=fX)
+        self.rewards = np.zeros((capacity,), dtype=fX)
+        self.new_states = np.zeros((capacity, batch_size, feature_size), dtype=fX)
+        self.terminals = np.zeros((capacity,), dtype=fX)
+        self.lengths = np.zeros((capacity,), dtype='int64')
+
+        # The number of stored transitions, and the position of the next transition.
+        self.size = 0
+        self.position = 0
+
+    def __len__(self):
+        return self.size
+
+    def add(self, state, action, reward, new_state, terminal):
+        i = self.position
+
+        self.states[i].fill(0.)
+        self.states[i, :len(state)] = state
+        self.actions[i].fill(0.)
+        self.actions[i, :len(action)] = action
+        self.rewards[i] = reward
+        self.new_states[i].fill(0.)
+        self.new_states[i, :len(new_state)] = new_state
+        self.terminals[i] = terminal
+        self.lengths[i] = len(action)
+
+        self.position = (i + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    def sample(self, sample_size):
+        """Sample a minibatch of transitions. The newest transition is always the first one.
+
+        Returns
+        -------
+        states, actions, rewards, new_states, terminals, masks
+            `masks` (shape = [M, batch_size]) is 1 on the real rows and 0 on the padded rows.
+        """
+
+        newest = (self.position - 1) % self.capacity
+        sample_size = min(sample_size, self.size)
+
+        if sample_size > 1:
+            others = np.random.choice(self.size - 1, sample_size - 1, replace=False)
+            # Skip the newest one.
+            others += (others >= newest)
+        else:
+            others = np.zeros((0,), dtype='int64')
+        indices = np.concatenate([[newest], others]).astype('int64')
+
+        masks = (np.arange(self.batch_size) < self.lengths[indices][:, None]).astype(fX)
+
+        return self.states[indices], self.actions[indices], self.rewards[indices], \
+            self.new_states[indices], self.terminals[indices], masks
+
+
 class CriticNetwork(object):
-    def __init__(self, feature_size, batch_size):
+    def __init__(self, feature_size, batch_size, learning_rate=None, replay_capacity=None):
         self.feature_size = feature_size
         self.batch_size = batch_size
+        self.learning_rate = learning_rate or PolicyConfig['critic_learning_rate']
+
+        if replay_capacity is None:
+            replay_capacity = PolicyConfig['critic_replay_capacity']
 
         self.action_ph = T.vector(dtype=fX, name='action')      # Shape = [batch_size]
         self.state_ph = T.matrix(dtype=fX, name='state')        # Shape = [batch_size, n_features]
@@ -35,8 +110,9 @@ class CriticNetwork(object):
         self.bias = theano.shared(floatX(0.0), name='bias')
 
         # Make output function
+        # [NOTE] (state * inner_weights) * action == state * (inner_weights * action), the latter is much cheaper.
         self.output = T.nnet.relu(
-            T.dot(self.weights, T.dot(T.dot(self.state_ph, self.inner_weights), self.action_ph)) + self.bias
+            T.dot(self.weights, T.dot(self.state_ph, T.dot(self.inner_weights, self.action_ph))) + self.bias
         )
 
         self.parameters = [self.inner_weights, self.weights, self.bias]
@@ -45,18 +121,71 @@ class CriticNetwork(object):
         for parameter in self.parameters:
             self.theta[parameter.name] = parameter
 
-        self.Q_function = theano.function([self.state_ph, self.action_ph], self.output)
-
-        # Make update function
-        loss = T.square(self.output - self.label).sum()
-        grads = T.grad(loss, list(self.theta.values()))
+        self.Q_function = LazyFunction([self.state_ph, self.action_ph], self.output, name='Q_function')
 
         lr = T.scalar(dtype=fX)
-        self.f_grad_shared, self.f_update = get_optimizer(
-            PolicyConfig['critic_optimizer'], lr, self.theta, grads, [self.state_ph, self.action_ph, self.label], loss)
+
+        if replay_capacity > 0:
+            self.replay_memory = ReplayMemory(replay_capacity, batch_size, feature_size)
+
+            # Make batch output and update function (a minibatch of transitions)
+            self.batch_action_ph = T.matrix(dtype=fX, name='batch_action')     # Shape = [M, batch_size]
+            self.batch_state_ph = T.tensor3(dtype=fX, name='batch_state')      # Shape = [M, batch_size, n_features]
+            self.batch_label = T.vector(dtype=fX, name='batch_label')          # Shape = [M]
+
+            inner_actions = T.dot(self.batch_action_ph, self.inner_weights.T)   # Shape = [M, n_features]
+            hidden = (self.batch_state_ph * inner_actions.dimshuffle(0, 'x', 1)).sum(axis=2)
+            self.batch_output = T.nnet.relu(T.dot(hidden, self.weights) + self.bias)
+
+            loss = T.square(self.batch_output - self.batch_label).mean()
+            grads = T.grad(loss, list(self.theta.values()))
+
+            self.f_grad_shared, self.f_update = get_optimizer(
+                PolicyConfig['critic_optimizer'], lr, self.theta, grads,
+                [self.batch_state_ph, self.batch_action_ph, self.batch_label], loss)
+        else:
+            self.replay_memory = None
+
+            # Make update function
+            loss = T.square(self.output - self.label).sum()
+            grads = T.grad(loss, list(self.theta.values()))
+
+            self.f_grad_shared, self.f_update = get_optimizer(
+                PolicyConfig['critic_optimizer'], lr, self.theta, grads, [self.state_ph, self.action_ph, self.label],
+                loss)
+
+    def Q_function_np(self, state, action):
+        """The numpy inference path of `Q_function`."""
+
+        inner_action = self.inner_weights.get_value(borrow=True).dot(action)
+        return max(self.weights.get_value(borrow=True).dot(state.dot(inner_action)) +
+                   self.bias.get_value(borrow=True), 0.)
+
+    def Q_batch_function_np(self, states, actions):
+        """The Q values of a minibatch of transitions (numpy inference path of `batch_output`).
+
+        Parameters
+        ----------
+        states: array, shape = [M, batch_size, n_features]
+        actions: array, shape = [M, batch_size]
+
+        Returns
+        -------
+        array, shape = [M]
+        """
+
+        inner_actions = actions.dot(self.inner_weights.get_value(borrow=True).T)
+        hidden = np.einsum('mbf,mf->mb', states, inner_actions)
+        return np.maximum(hidden.dot(self.weights.get_value(borrow=True)) + self.bias.get_value(borrow=True), 0.)
 
     def update(self, state, action, label):
         loss = self.f_grad_shared(state, action, label)
-        self.f_update(0.01)
+        self.f_update(self.learning_rate)
+
+        return loss
+
+    def update_batch(self, states, actions, labels):
+        loss = self.f_grad_shared(states, actions, labels)
+        self.f_update(self.learning_rate)
 
         return loss
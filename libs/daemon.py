@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+
+"""The warm training daemon.
+
+The daemon runs the jobs one by one in the same process, and keeps the loaded datasets (`resident`)
+and the compiled Theano functions (the in-memory function cache) between jobs,
+so back-to-back jobs on the same dataset and model skip the data loading and the compilation.
+
+A job spec is a line of the same arguments as `train.py` (e.g. "G.job_name=@mnist-raw-Job01@ P.xxx=1 epoch=10").
+Each job starts from the configs in `config.json` and gets fresh parameters (new models) and random seed.
+Send "shutdown" to stop the daemon.
+"""
+
+from __future__ import print_function
+
+import copy
+import os
+import pipes
+import shlex
+import socket
+import time
+import traceback
+
+from .utility.config import Config, ProjectRootPath
+from .utility.lazy_function import enable_memory_cache
+from .utility.my_logging import message
+from .utility.utils import enable_resident_cache
+
+ShutdownCommand = 'shutdown'
+
+
+def get_socket_path(socket_path=None):
+    return socket_path or Config['daemon_socket'] or os.path.join(ProjectRootPath, '.train_daemon.sock')
+
+
+def _restore_config(saved_config):
+    """Restore the configs in place (the config sections are referenced by other modules)."""
+
+    for key, value in saved_config.items():
+        if isinstance(value, dict):
+            Config[key].clear()
+            Config[key].update(copy.deepcopy(value))
+        else:
+            Config[key] = copy.deepcopy(value)
+
+
+def run_daemon(run_job, socket_path=None):
+    """Run the daemon.
+
+    Parameters
+    ----------
+    run_job: function
+        Run a job, called as `run_job(args)`, `args` is same as `sys.argv`.
+    socket_path: str
+        The path of the Unix domain socket.
+    """
+
+    socket_path = get_socket_path(socket_path)
+
+    enable_resident_cache()
+    enable_memory_cache()
+    saved_config = copy.deepcopy(Config)
+
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(socket_path)
+    server.listen(1)
+    message('[Daemon listening on {}]'.format(socket_path))
+
+    try:
+        while True:
+            connection, _ = server.accept()
+            try:
+                job = connection.makefile('r').readline().strip()
+                if job == ShutdownCommand:
+                    connection.sendall('shutdown\n')
+                    break
+
+                message('[Daemon job: {}]'.format(job))
+                _restore_config(saved_config)
+
+                start_time = time.time()
+                status = 'done'
+                try:
+                    run_job(['train.py'] + shlex.split(job))
+                except SystemExit as e:
+                    # A failed job exits with a non-zero status (see `dataset_main`).
+                    if e.code not in (None, 0):
+                        status = 'error'
+                except Exception:
+                    status = 'error'
+                    message(traceback.format_exc())
+
+                connection.sendall('{} {:.2f}s\n'.format(status, time.time() - start_time))
+            finally:
+                connection.close()
+    finally:
+        server.close()
+        os.remove(socket_path)
+        message('[Daemon stopped]')
+
+
+def submit_job(args, socket_path=None):
+    """Submit a job (or "shutdown") to the daemon, and wait for it.
+
+    Returns
+    -------
+    The reply of the daemon ("done/error {time}s" or "shutdown").
+    """
+
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.connect(get_socket_path(socket_path))
+    try:
+        client.sendall(' '.join(pipes.quote(arg) for arg in args) + '\n')
+        return client.makefile('r').readline().strip()
+    finally:
+        client.close()
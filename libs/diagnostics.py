@@ -0,0 +1,396 @@
+# -*- coding: utf-8 -*-
+
+"""The diagnostics (temp jobs) of the batch updater, as plugins which subscribe to the updater events.
+
+Events (the callbacks of the diagnostic, the arguments are the same):
+    epoch_start():
+        At the start of each epoch.
+    batch_selected(indices, losses=None):
+        The selected indices of a batch, before they are put into the buffer
+        (`losses` is the loss of each index if it is already computed, such as in SPL and the policy updaters).
+    batch_filtered(action, probability):
+        The policy actions and the policy inputs of a batch (test policy only).
+    batch_trained(batch_index, batch_data, part_train_cost):
+        A batch is trained (`batch_data` is not prepared).
+    validation_point():
+        At the end of each validation point.
+    episode_end():
+        At the end of the episode.
+
+The diagnostics are selected by "temp_job" (several comma-separated names run together, such as
+"log_data,check_selected_data_label"). The updater calls the callbacks in the lists of `Hooks`,
+so the events cost nothing if no diagnostic subscribes to them.
+"""
+
+from __future__ import print_function
+
+import cPickle as pkl
+import os
+from itertools import izip
+
+import numpy as np
+
+from .utility.config import Config, DataPath, PolicyConfig
+from .utility.extensions import PartLossChecker
+from .utility.my_logging import message
+from .utility.name_register import NameRegister
+from .utility.utils import get_rank, get_temp_jobs
+
+# Some Magic Numbers.
+
+# Number of classes and size of each class.
+ClassSize = 5000
+ClassNumber = 10
+TotalSize = ClassSize * ClassNumber
+
+# Compute loss when needed in "log_data" (all updaters except SPL).
+# [NOTE] It will cause computation of loss on each data, and will slow down the training process.
+ComputeLoss = True
+
+# The target distribution of each corrupt levels.
+# [NOTE] This can be changed.
+TargetDistribution = np.array([0.20, 0.16, 0.12, 0.08, 0.04, 0.00, 0.04, 0.08, 0.12, 0.16])
+
+# Number of probe data of each corrupt level in the margin test of "log_data".
+ProbeSize = 1000
+
+
+def _score(distribution):
+    return np.sum((TargetDistribution - distribution) ** 2)
+
+
+def policy_input_losses(probability, output_size):
+    """Get the losses (-log(P(y))) from the policy inputs, None if they are not in the policy inputs.
+
+    [NOTE] The policy inputs start with the output probabilities ("add_output") and log(P(y)) ("add_label_input").
+    """
+
+    if not PolicyConfig['add_label_input']:
+        return None
+    return -probability[:, output_size if PolicyConfig['add_output'] else 0]
+
+
+class LevelStats(object):
+    """The streaming count, mean and variance (Welford / Chan et al.) of the losses in each corrupt level."""
+
+    def __init__(self):
+        self.count = np.zeros((ClassNumber,), dtype='int64')
+        self.mean = np.zeros((ClassNumber,), dtype='float64')
+        self.m2 = np.zeros((ClassNumber,), dtype='float64')
+
+    def update(self, levels, losses):
+        batch_count = np.bincount(levels, minlength=ClassNumber)
+        batch_mean = np.bincount(levels, weights=losses, minlength=ClassNumber) / np.maximum(batch_count, 1)
+        batch_m2 = np.bincount(levels, weights=(losses - batch_mean[levels]) ** 2, minlength=ClassNumber)
+
+        count = self.count + batch_count
+        delta = batch_mean - self.mean
+        ratio = batch_count / np.maximum(count, 1).astype('float64')
+
+        self.m2 += batch_m2 + delta ** 2 * self.count * ratio
+        self.mean += delta * ratio
+        self.count = count
+
+    def get_mean(self):
+        # [NOTE] The empty levels are NaN (same as `np.mean([])`).
+        return np.where(self.count > 0, self.mean, np.nan)
+
+    def get_std(self):
+        return np.where(self.count > 0, np.sqrt(self.m2 / np.maximum(self.count, 1)), np.nan)
+
+
+class Hooks(object):
+    """The event callbacks of the updater."""
+
+    EventNames = ('epoch_start', 'batch_selected', 'batch_filtered', 'batch_trained', 'validation_point',
+                  'episode_end')
+
+    def __init__(self, updater, names=None):
+        for event in self.EventNames:
+            setattr(self, event, [])
+        self.diagnostics = []
+
+        # [NOTE] The temp jobs which are not diagnostics (such as "discount_reward") are skipped.
+        for name in get_temp_jobs() if names is None else names:
+            if name in Diagnostic.NameTable:
+                self.register(Diagnostic.get_by_name(name)(updater))
+
+    def register(self, diagnostic):
+        self.diagnostics.append(diagnostic)
+        for event in diagnostic.Events:
+            getattr(self, event).append(getattr(diagnostic, event))
+
+
+class Diagnostic(NameRegister):
+    NameTable = {}
+
+    # The subscribed events.
+    Events = ()
+
+    def __init__(self, updater):
+        self.updater = updater
+
+
+class SelectedLabelCounter(Diagnostic):
+    """Log the number of selected data in each label."""
+
+    Events = ('epoch_start', 'batch_trained', 'validation_point')
+
+    def __init__(self, updater):
+        super(SelectedLabelCounter, self).__init__(updater)
+        self.epoch_label_count = np.zeros((updater.model.output_size,), dtype='int64')
+        self.total_label_count = np.zeros((updater.model.output_size,), dtype='int64')
+
+    def epoch_start(self):
+        self.epoch_label_count.fill(0)
+
+    def batch_trained(self, batch_index, batch_data, part_train_cost):
+        label_count = np.bincount(batch_data[-1], minlength=len(self.epoch_label_count))
+        self.epoch_label_count += label_count
+        self.total_label_count += label_count
+
+    def validation_point(self):
+        message("""\
+Epoch label count: {}
+Total label count: {}""".format(
+            self.epoch_label_count,
+            self.total_label_count,
+        ))
+
+SelectedLabelCounter.register_class(['check_selected_data_label'])
+
+
+class PartLossDiagnostic(Diagnostic):
+    """Check the loss and margin of different parts in corrupted data."""
+
+    Events = ('batch_trained',)
+
+    def __init__(self, updater):
+        super(PartLossDiagnostic, self).__init__(updater)
+        self.part_loss_checker = PartLossChecker(updater)
+
+    def batch_trained(self, batch_index, batch_data, part_train_cost):
+        self.part_loss_checker.check()
+
+PartLossDiagnostic.register_class(['check_part_loss'])
+
+
+class TrainAnalysis(Diagnostic):
+    """Log the features of training data."""
+
+    Events = ('batch_trained',)
+
+    def batch_trained(self, batch_index, batch_data, part_train_cost):
+        updater = self.updater
+        probability = updater.model.get_policy_input(*(batch_data + [updater, updater.history_accuracy]))
+        message('Loss', part_train_cost)
+        for line in probability:
+            message(' '.join('{:.6f}'.format(e) for e in line))
+
+TrainAnalysis.register_class(['train_analysis'])
+
+
+class IndexDumper(Diagnostic):
+    """Dump the index of all trained data."""
+
+    Events = ('epoch_start', 'batch_trained', 'episode_end')
+
+    def __init__(self, updater):
+        super(IndexDumper, self).__init__(updater)
+        self.train_index = []
+
+    def epoch_start(self):
+        self.train_index.append([])
+
+    def batch_trained(self, batch_index, batch_data, part_train_cost):
+        self.train_index[-1].append(batch_index)
+
+    def episode_end(self):
+        train_index_filename = os.path.join(DataPath, Config['dataset'],
+                                            '{}_train_index.pkl'.format(Config['job_name']))
+        with open(train_index_filename, 'wb') as f:
+            pkl.dump(self.train_index, f)
+        message("Dump train index to '{}'".format(train_index_filename))
+
+IndexDumper.register_class(['dump_index'])
+
+
+class DataLogger(Diagnostic):
+    """Log the number and the loss of selected data in each corrupt part."""
+
+    Events = ('batch_selected', 'validation_point')
+
+    def __init__(self, updater):
+        super(DataLogger, self).__init__(updater)
+
+        # The loss stats of the selected data after the last validation point, and of all selected data.
+        self.part_stats = LevelStats()
+        self.total_stats = LevelStats()
+
+        # The fixed probe set of the margin test, `ProbeSize` data of each corrupt level (level-major).
+        rng = np.random.RandomState(Config['seed'])
+        self.probe_indices = np.concatenate([
+            rng.choice(np.arange(level * ClassSize, (level + 1) * ClassSize), ProbeSize, replace=False)
+            for level in range(ClassNumber)
+        ])
+
+    def batch_selected(self, indices, losses=None):
+        updater = self.updater
+
+        if len(indices) == 0:
+            return
+
+        if losses is None:
+            if ComputeLoss:
+                selected_batch_data = [data[indices] for data in updater.all_data]
+                selected_batch_data = updater.prepare_data(*selected_batch_data)
+                losses = updater.model.f_cost_list_without_decay(*selected_batch_data)
+            else:
+                losses = np.zeros((len(indices),))
+
+        # [NOTE] cifar10 have mirrored data, so mod TotalSize.
+        levels = (np.asarray(indices) % TotalSize) // ClassSize
+        losses = np.asarray(losses, dtype='float64')
+
+        self.part_stats.update(levels, losses)
+        self.total_stats.update(levels, losses)
+
+    def validation_point(self):
+        self.log_data_message(reset=True)
+
+    def probe_margins_and_losses(self):
+        """Get the margins (P(y) - max_{j != y} P(j)) and the losses of the probe set, in chunks of the validate
+        batch size.
+
+        Returns
+        -------
+        (margins, losses), both in shape (ClassNumber, ProbeSize).
+        """
+
+        updater = self.updater
+        model = updater.model
+
+        # [NOTE] The data preparation (random crop of cifar10) uses the global random state,
+        # so seed it to get the same probe data at each validation point, and restore it to keep the training.
+        random_state = np.random.get_state()
+        np.random.seed(Config['seed'])
+
+        margins, losses = [], []
+        try:
+            for start in range(0, len(self.probe_indices), model.validate_batch_size):
+                chunk = self.probe_indices[start:start + model.validate_batch_size]
+                chunk_data = updater.prepare_data(*[data[chunk] for data in updater.all_data])
+                targets = chunk_data[-1]
+
+                probs, chunk_losses = model.f_probs_and_losses(*chunk_data)
+
+                rows = np.arange(len(chunk))
+                target_probs = probs[rows, targets]
+                probs = probs.copy()
+                probs[rows, targets] = -np.inf
+
+                margins.append(target_probs - probs.max(axis=1))
+                losses.append(chunk_losses)
+        finally:
+            np.random.set_state(random_state)
+
+        return (np.concatenate(margins).reshape((ClassNumber, ProbeSize)),
+                np.concatenate(losses).reshape((ClassNumber, ProbeSize)))
+
+    def log_data_message(self, reset=True, test_margin=True):
+        updater = self.updater
+
+        total_indices = self.total_stats.count.sum()
+        part_total_indices = self.part_stats.count.sum()
+
+        part_ratios = self.part_stats.count / float(part_total_indices)
+        total_ratios = self.total_stats.count / float(total_indices)
+
+        message('[Log Data]')
+        message('Part  (total {:>8}): {}'.format(
+            part_total_indices,
+            '\t'.join(format(val, '.3f') for val in part_ratios)))
+        message('Whole (total {:>8}): {}'.format(
+            total_indices,
+            '\t'.join(format(val, '.3f') for val in total_ratios)))
+        message('Score                 :',
+                'Part =', format(_score(part_ratios), '.6f'),
+                'Total = ', format(_score(total_ratios), '.6f'))
+
+        message('Part Avg Loss         :', '\t'.join(format(val, '.3f') for val in self.part_stats.get_mean()))
+        message('Part Loss Std         :', '\t'.join(format(val, '.3f') for val in self.part_stats.get_std()))
+        message('Total Avg Loss        :', '\t'.join(format(val, '.3f') for val in self.total_stats.get_mean()))
+        message('Total Loss Std        :', '\t'.join(format(val, '.3f') for val in self.total_stats.get_std()))
+
+        if test_margin:
+            margins, losses = self.probe_margins_and_losses()
+
+            message('Test the margin for all {} corrupt levels ({} probe data per level):'.format(
+                ClassNumber, ProbeSize))
+            message('Margin Avg            :', '\t'.join(format(val, '.3f') for val in margins.mean(axis=1)))
+            message('Margin Std            :', '\t'.join(format(val, '.3f') for val in margins.std(axis=1)))
+            message('Probe Avg Loss        :', '\t'.join(format(val, '.3f') for val in losses.mean(axis=1)))
+            message('Probe Loss Std        :', '\t'.join(format(val, '.3f') for val in losses.std(axis=1)))
+
+        message('[Log Data End]')
+
+        if reset:
+            self.part_stats = LevelStats()
+
+DataLogger.register_class(['log_data'])
+
+
+class DroppedDataLogger(Diagnostic):
+    """Log the features (the loss rank) of dropped data (only used in test policy process)."""
+
+    Events = ('batch_filtered', 'validation_point')
+
+    def __init__(self, updater):
+        super(DroppedDataLogger, self).__init__(updater)
+
+        self.total_dropped_ranks = [0 for _ in range(updater.batch_size)]
+        self.part_dropped_ranks = [0 for _ in range(updater.batch_size)]
+
+    def batch_filtered(self, action, probability):
+        updater = self.updater
+
+        # [NOTE] Just log rank now.
+        if PolicyConfig['add_loss_rank'] is True:
+            for a, p in izip(action, probability):
+                if not a:
+                    rank = int(round(p[-2] * updater.batch_size))
+
+                    self.total_dropped_ranks[rank] += 1
+                    self.part_dropped_ranks[rank] += 1
+        else:
+            # [NOTE] Compatibility for old IMDB version
+            # loss = -log(P(y)), output of PolicyConfig['add_label_input'] is log(P(y)).
+            losses = np.array([-prob[updater.model.output_size] for prob in probability])
+
+            rank = get_rank(losses)
+
+            for a, r in izip(action, rank):
+                if not a:
+                    self.total_dropped_ranks[int(round(r))] += 1
+                    self.part_dropped_ranks[int(round(r))] += 1
+
+    def validation_point(self):
+        message('[Log Dropped Data]')
+        message('Rank distribution (0 -> batch_size) of dropped data')
+
+        message('Part  (total {:>8}):'.format(sum(self.part_dropped_ranks)),
+                '\t'.join(str(r) for r in self.part_dropped_ranks))
+        message('Total (total {:>8}):'.format(sum(self.total_dropped_ranks)),
+                '\t'.join(str(r) for r in self.total_dropped_ranks))
+
+        message('[Log Dropped Data End]')
+
+        self.part_dropped_ranks = [0 for _ in range(self.updater.batch_size)]
+
+DroppedDataLogger.register_class(['log_dropped_data'])
+
+
+__all__ = [
+    'Hooks',
+    'Diagnostic',
+]
@@ -23,9 +23,10 @@ from lasagne.nonlinearities import softmax, rectify
 
 from ..utility.CIFAR10 import iterate_minibatches
 from ..utility.config import CifarConfig as ParamConfig, PolicyConfig
+from ..utility.lazy_function import LazyFunction
 from ..utility.my_logging import message, logging
 from ..utility.name_register import NameRegister
-from ..utility.utils import fX, floatX, shuffle_data, average, get_rank
+from ..utility.utils import fX, floatX, shuffle_data, average, get_rank, get_minibatches_idx
 
 
 class CIFARModelBase(NameRegister):
@@ -52,6 +53,7 @@ class CIFARModelBase(NameRegister):
         self.f_first_layer_output = None
         self.f_probs = None
         self.f_cost_list_without_decay = None
+        self.f_probs_and_losses = None
         self.f_train = None
         self.f_alpha_train = None
         self.f_cost_without_decay = None
@@ -81,7 +83,10 @@ class CIFARModelBase(NameRegister):
             param_values = [f['arr_%d' % i] for i in range(len(f.files))]
         lasagne.layers.set_all_param_values(self.network, param_values)
 
-    def get_training_loss(self, x_train, y_train):
+    def get_training_loss(self, x_train, y_train, indices=None):
+        if indices is not None:
+            x_train, y_train = x_train[indices], y_train[indices]
+
         sum_loss = 0.0
         training_batches = 0
         for batch in iterate_minibatches(x_train, y_train, self.train_batch_size, shuffle=False, augment=False):
@@ -98,12 +103,34 @@ class CIFARModelBase(NameRegister):
         message("$  test accuracy:\t\t{:.2f} %".format(
             test_acc / test_batches * 100))
 
-    def validate_or_test(self, x_test, y_test):
+    def get_parameter_snapshot(self):
+        """Get a copy of all parameter values (include the non-trainable ones, such as BN statistics)."""
+        return get_all_param_values(self.network)
+
+    def set_parameter_snapshot(self, values):
+        set_all_param_values(self.network, values)
+
+    def validate_or_test(self, x_test, y_test, indices=None):
+        """Validate or test the model.
+
+        Parameters
+        ----------
+        x_test, y_test: the data.
+        indices: array of int or None
+            If given, only use the data of these indices (the subset will not be copied).
+        """
+
+        if indices is None:
+            batches = iterate_minibatches(x_test, y_test, self.validate_batch_size, shuffle=False)
+        else:
+            batches = ((x_test[indices[batch_index]], y_test[indices[batch_index]])
+                       for _, batch_index in get_minibatches_idx(len(indices), self.validate_batch_size))
+
         # Calculate validation error of model:
         test_err = 0
         test_acc = 0
         test_batches = 0
-        for batch in iterate_minibatches(x_test, y_test, self.validate_batch_size, shuffle=False):
+        for batch in batches:
             inputs, targets = batch
             err, acc = self.f_validate(inputs, targets)
             test_err += err
@@ -283,7 +310,8 @@ class CIFARModel(CIFARModelBase):
         layer = batch_norm(ConvLayer(layer_in, num_filters=16, filter_size=(3, 3), stride=(1, 1), nonlinearity=rectify,
                                      pad='same', W=lasagne.init.HeNormal(gain='relu'), flip_filters=False))
         first_layer_output = lasagne.layers.get_output(layer, inputs=input_var)
-        self.f_first_layer_output = theano.function(
+        self.f_first_layer_output = LazyFunction(
+            name='f_first_layer_output',
             inputs=[input_var],
             outputs=first_layer_output
         )
@@ -318,18 +346,22 @@ class CIFARModel(CIFARModelBase):
         # Create a loss expression for training, i.e., a scalar objective we want
         # to minimize (for our multi-class problem, it is the cross-entropy loss):
         probs = lasagne.layers.get_output(self.network)
-        self.f_probs = theano.function(
+        self.f_probs = LazyFunction(
+            name='f_probs',
             inputs=[self.input_var],
             outputs=probs
         )
 
         loss = lasagne.objectives.categorical_crossentropy(probs, self.target_var)
 
-        self.f_cost_list_without_decay = theano.function([self.input_var, self.target_var], loss)
+        self.f_cost_list_without_decay = LazyFunction([self.input_var, self.target_var], loss,
+                                                      name='f_cost_list_without_decay')
+        self.f_probs_and_losses = LazyFunction([self.input_var, self.target_var], [probs, loss],
+                                               name='f_probs_and_losses')
 
         loss = loss.mean()
 
-        self.f_cost_without_decay = theano.function([self.input_var, self.target_var], loss)
+        self.f_cost_without_decay = LazyFunction([self.input_var, self.target_var], loss, name='f_cost_without_decay')
 
         # add weight decay
         all_layers = lasagne.layers.get_all_layers(self.network)
@@ -337,7 +369,7 @@ class CIFARModel(CIFARModelBase):
             ParamConfig['l2_penalty_factor']
         loss += l2_penalty
 
-        self.f_cost = theano.function([self.input_var, self.target_var], loss)
+        self.f_cost = LazyFunction([self.input_var, self.target_var], loss, name='f_cost')
 
         # Create update expressions for training
         # Stochastic Gradient Descent (SGD) with momentum
@@ -347,7 +379,7 @@ class CIFARModel(CIFARModelBase):
 
         # Compile a function performing a training step on a mini-batch (by giving
         # the updates dictionary) and returning the corresponding training loss:
-        self.f_train = theano.function([self.input_var, self.target_var], loss, updates=updates)
+        self.f_train = LazyFunction([self.input_var, self.target_var], loss, updates=updates, name='f_train')
 
         # ##########################################################
 
@@ -363,8 +395,8 @@ class CIFARModel(CIFARModelBase):
         updates = lasagne.updates.momentum(
             alpha_loss, params, learning_rate=self.learning_rate, momentum=ParamConfig['momentum'])
 
-        self.f_alpha_train = theano.function(
-            [self.input_var, self.target_var, alpha], alpha_loss, updates=updates)
+        self.f_alpha_train = LazyFunction(
+            [self.input_var, self.target_var, alpha], alpha_loss, updates=updates, name='f_alpha_train')
 
     @logging
     def build_validate_function(self):
@@ -379,7 +411,7 @@ class CIFARModel(CIFARModelBase):
                           dtype=theano.config.floatX)
 
         # Compile a second function computing the validation loss and accuracy:
-        self.f_validate = theano.function([self.input_var, self.target_var], [test_loss, test_acc])
+        self.f_validate = LazyFunction([self.input_var, self.target_var], [test_loss, test_acc], name='f_validate')
 
     @logging
     def train(self, x_train, y_train, x_test, y_test, num_epochs):
@@ -524,25 +556,29 @@ class VanillaCNNModel(CIFARModelBase):
 
     def build_train_function(self):
         probs = lasagne.layers.get_output(self.network)
-        self.f_probs = theano.function(
+        self.f_probs = LazyFunction(
+            name='f_probs',
             inputs=[self.input_var],
             outputs=probs
         )
 
         loss = lasagne.objectives.categorical_crossentropy(probs, self.target_var)
 
-        self.f_cost_list_without_decay = theano.function([self.input_var, self.target_var], loss)
+        self.f_cost_list_without_decay = LazyFunction([self.input_var, self.target_var], loss,
+                                                      name='f_cost_list_without_decay')
+        self.f_probs_and_losses = LazyFunction([self.input_var, self.target_var], [probs, loss],
+                                               name='f_probs_and_losses')
 
         loss = loss.mean()
 
-        self.f_cost_without_decay = theano.function([self.input_var, self.target_var], loss)
+        self.f_cost_without_decay = LazyFunction([self.input_var, self.target_var], loss, name='f_cost_without_decay')
 
         # add weight decay
         all_layers = lasagne.layers.get_all_layers(self.network)
         l2_penalty = lasagne.regularization.regularize_layer_params(all_layers, lasagne.regularization.l2) * 0.004
         loss += l2_penalty
 
-        self.f_cost = theano.function([self.input_var, self.target_var], loss)
+        self.f_cost = LazyFunction([self.input_var, self.target_var], loss, name='f_cost')
 
         params = lasagne.layers.get_all_params(self.network, trainable=True)
 
@@ -560,7 +596,7 @@ class VanillaCNNModel(CIFARModelBase):
 
         # f_train_sgd = theano.function([self.input_var, self.target_var], loss, updates=updates_sgd)
         # f_train_momentum = theano.function([self.input_var, self.target_var], loss, updates=updates_momentum)
-        f_train_adam = theano.function([self.input_var, self.target_var], loss, updates=updates_adam)
+        f_train_adam = LazyFunction([self.input_var, self.target_var], loss, updates=updates_adam, name='f_train')
         # f_train_adagrad = theano.function([self.input_var, self.target_var], loss, updates=updates_adagrad)
         # f_train_adadelta = theano.function([self.input_var, self.target_var], loss, updates=updates_adadelta)
         # f_train_rmsprop = theano.function([self.input_var, self.target_var], loss, updates=updates_rmsprop)
@@ -576,7 +612,7 @@ class VanillaCNNModel(CIFARModelBase):
                           dtype=theano.config.floatX)
 
         # Compile a second function computing the validation loss and accuracy:
-        self.f_validate = theano.function([self.input_var, self.target_var], [test_loss, test_acc])
+        self.f_validate = LazyFunction([self.input_var, self.target_var], [test_loss, test_acc], name='f_validate')
 
     @logging
     def update_learning_rate(self):
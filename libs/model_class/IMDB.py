@@ -14,6 +14,57 @@ from ..utility.my_logging import logging
 from ..utility.utils import fX, floatX, average, get_minibatches_idx, get_rank
 from ..utility.IMDB import prepare_imdb_data as prepare_data, pr, ortho_weight
 from ..utility.optimizers import get_optimizer
+from ..utility.lazy_function import LazyFunction
+
+
+class PaddedBatchCache(object):
+    """Pre-padded evaluation batches of the fixed datasets (validation and test sets).
+
+    The data is bucketed by length (sorted), then split into batches and padded once,
+    so each batch is padded to a similar length and later evaluations are only Theano calls.
+
+    Only the registered datasets are cached (keyed by the identity of the data arrays), other data (such as the
+    training set or random subsets of the validation set) is evaluated without the cache,
+    so the cache never grows beyond the fixed datasets.
+
+    [NOTE] The cached batches have `batch_size` (the validate batch size) data, while the uncached evaluation uses
+    the batching of the caller (the train batch size in `validate_or_test`), so the averages over batches
+    may be slightly different.
+    """
+
+    def __init__(self, batch_size):
+        self.batch_size = batch_size
+
+        # id(data_x) -> [data_x, data_y, batches (None if not built yet)]
+        self.entries = {}
+
+    def register(self, data_x, data_y):
+        """Register a fixed dataset, its batches are built at the first use."""
+
+        entry = self.entries.get(id(data_x))
+        if entry is None or entry[0] is not data_x or entry[1] is not data_y:
+            self.entries[id(data_x)] = [data_x, data_y, None]
+
+    def get(self, data_x, data_y):
+        """Get the list of padded (x, mask, y) batches of the data, None if the data is not registered."""
+
+        entry = self.entries.get(id(data_x))
+        if entry is None or entry[0] is not data_x or entry[1] is not data_y:
+            return None
+
+        if entry[2] is None:
+            entry[2] = self._build(data_x, data_y)
+        return entry[2]
+
+    def _build(self, data_x, data_y):
+        data_y = np.asarray(data_y)
+        order = np.argsort([len(s) for s in data_x], kind='mergesort')
+
+        batches = []
+        for start in range(0, len(order), self.batch_size):
+            batch_index = order[start:start + self.batch_size]
+            batches.append(prepare_data([data_x[t] for t in batch_index], data_y[batch_index], maxlen=None))
+        return batches
 
 
 class IMDBModelBase(object):
@@ -31,11 +82,15 @@ class IMDBModelBase(object):
 
         self.f_probs = None
         self.f_cost_list_without_decay = None
+        self.f_probs_and_losses = None
         self.f_cost_without_decay = None
         self.f_cost = None
 
         self.f_validate = None
 
+        # Pre-padded batches of validation and test sets
+        self.eval_cache = PaddedBatchCache(self.validate_batch_size) if ParamConfig['eval_cache'] else None
+
     def reset_parameters(self):
         pass
 
@@ -60,7 +115,7 @@ class IMDBModelBase(object):
         """
         pass
 
-    def get_training_loss(self, x_train, y_train):
+    def get_training_loss(self, x_train, y_train, indices=None):
         pass
 
     @staticmethod
@@ -153,10 +208,49 @@ class IMDBModelBase(object):
 
         return np.hstack(to_be_stacked)
 
-    def validate_or_test(self, x_test, y_test):
+    def get_parameter_snapshot(self):
+        pass
+
+    def set_parameter_snapshot(self, values):
+        pass
+
+    def register_eval_data(self, x_data, y_data):
+        """Register a fixed evaluation dataset (the validation or test set) into the padded batch cache."""
+
+        if self.eval_cache is not None:
+            self.eval_cache.register(x_data, y_data)
+
+    def validate_or_test(self, x_test, y_test, indices=None):
+        """Validate or test the model.
+
+        Parameters
+        ----------
+        x_test, y_test: the data.
+        indices: array of int or None
+            If given, only use the data of these indices (the subset will not be copied).
+        """
+
         test_err = 0.0
         test_acc = 0.0
-        kf = get_minibatches_idx(len(y_test), self.train_batch_size, shuffle=False)
+
+        # Unique indices of the whole dataset (such as a full probe set) are just the whole dataset.
+        if indices is not None and len(indices) == len(y_test):
+            indices = None
+
+        batches = self.eval_cache.get(x_test, y_test) if indices is None and self.eval_cache is not None else None
+        if batches is not None:
+            for x, mask, y in batches:
+                err, acc = self.f_validate(x, mask, y)
+                test_err += err
+                test_acc += acc
+
+            return test_err, test_acc, len(batches)
+
+        if indices is None:
+            kf = get_minibatches_idx(len(y_test), self.train_batch_size, shuffle=False)
+        else:
+            kf = [(i, indices[batch_index]) for i, batch_index in
+                  get_minibatches_idx(len(indices), self.train_batch_size, shuffle=False)]
 
         for _, test_index in kf:
             inputs = x_test[test_index]
@@ -324,21 +418,24 @@ class IMDBModel(IMDBModelBase):
 
         predict = T.nnet.softmax(T.dot(proj, self.parameters['U']) + self.parameters['b'])
 
-        self.f_probs = theano.function([self.inputs, self.mask], predict, name='f_pred_prob')
-        self.f_predict = theano.function([self.inputs, self.mask], predict.argmax(axis=1), name='f_pred')
+        self.f_probs = LazyFunction([self.inputs, self.mask], predict, name='f_probs')
+        self.f_predict = LazyFunction([self.inputs, self.mask], predict.argmax(axis=1), name='f_pred')
 
         off = 1e-8
         if predict.dtype == 'float16':
             off = 1e-6
 
         cost_list = -T.log(predict[T.arange(n_samples), self.targets] + off)
-        self.f_cost_list_without_decay = theano.function(
+        self.f_cost_list_without_decay = LazyFunction(
             [self.inputs, self.mask, self.targets], cost_list, name='f_cost_list_without_decay'
         )
+        self.f_probs_and_losses = LazyFunction(
+            [self.inputs, self.mask, self.targets], [predict, cost_list], name='f_probs_and_losses'
+        )
 
         cost = cost_list.mean()
 
-        self.f_cost_without_decay = theano.function(
+        self.f_cost_without_decay = LazyFunction(
             [self.inputs, self.mask, self.targets], cost, name='f_cost_without_decay'
         )
 
@@ -350,10 +447,10 @@ class IMDBModel(IMDBModelBase):
             weight_decay *= decay_c
             cost += weight_decay
 
-        self.f_cost = theano.function([self.inputs, self.mask, self.targets], cost, name='f_cost')
+        self.f_cost = LazyFunction([self.inputs, self.mask, self.targets], cost, name='f_cost')
 
         grads = T.grad(cost, wrt=list(self.parameters.values()))
-        self.f_grad = theano.function([self.inputs, self.mask, self.targets], grads, name='f_grad')
+        self.f_grad = LazyFunction([self.inputs, self.mask, self.targets], grads, name='f_grad')
 
         lr = T.scalar('lr', dtype=fX)
         self.f_grad_shared, self.f_update = get_optimizer(
@@ -361,7 +458,8 @@ class IMDBModel(IMDBModelBase):
 
         # Build validate function.
         test_acc = T.mean(T.eq(T.argmax(predict, axis=1), self.targets), dtype=theano.config.floatX)
-        self.f_validate = theano.function([self.inputs, self.mask, self.targets], [cost, test_acc])
+        self.f_validate = LazyFunction([self.inputs, self.mask, self.targets], [cost, test_acc],
+                                       name='f_validate')
 
     def build_validate_function(self):
         pass
@@ -391,13 +489,21 @@ class IMDBModel(IMDBModelBase):
         """
 
         valid_err = 0
-        for _, valid_index in batch_indices:
-            x, mask, y = prepare_data([data_x[t] for t in valid_index],
-                                      np.array(data_y)[valid_index],
-                                      maxlen=None)
-            predicts = self.f_predict(x, mask)
-            targets = np.array(data_y)[valid_index]
-            valid_err += (predicts == targets).sum()
+
+        batches = self.eval_cache.get(data_x, data_y) if self.eval_cache is not None else None
+        if batches is not None:
+            # A registered dataset, the cached batches (of the validate batch size) cover the whole data,
+            # `batch_indices` is not used.
+            for x, mask, y in batches:
+                valid_err += (self.f_predict(x, mask) == y).sum()
+        else:
+            data_y = np.asarray(data_y)
+            for _, valid_index in batch_indices:
+                x, mask, y = prepare_data([data_x[t] for t in valid_index],
+                                          data_y[valid_index],
+                                          maxlen=None)
+                predicts = self.f_predict(x, mask)
+                valid_err += (predicts == y).sum()
         valid_err = 1. - floatX(valid_err) / len(data_x)
 
         return valid_err
@@ -408,7 +514,18 @@ class IMDBModel(IMDBModelBase):
             result[key] = self.parameters[key].get_value()
         return result
 
-    def get_training_loss(self, x_train, y_train):
+    def get_parameter_snapshot(self):
+        return self.get_parameter_values()
+
+    def set_parameter_snapshot(self, values):
+        for key, value in values.iteritems():
+            self.parameters[key].set_value(value)
+
+    def get_training_loss(self, x_train, y_train, indices=None):
+        if indices is not None:
+            x_train = [x_train[t] for t in indices]
+            y_train = [y_train[t] for t in indices]
+
         sum_loss = 0.0
         kf = get_minibatches_idx(len(y_train), self.train_batch_size, shuffle=False)
 
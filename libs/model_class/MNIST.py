@@ -29,6 +29,7 @@ from lasagne.layers import LocalResponseNormalization2DLayer, MaxPool2DLayer
 from ..utility.config import Config, MNISTConfig as ParamConfig, PolicyConfig
 from ..utility.utils import fX, floatX, average, get_rank, get_minibatches_idx
 from ..utility.my_logging import message, logging
+from ..utility.lazy_function import LazyFunction
 from .model import ModelBase
 
 
@@ -50,6 +51,7 @@ class MNISTModelBase(ModelBase):
         self.f_first_layer_output = None
         self.f_probs = None
         self.f_cost_list_without_decay = None
+        self.f_probs_and_losses = None
         self.f_train = None
         self.f_alpha_train = None
         self.f_cost_without_decay = None
@@ -79,7 +81,10 @@ class MNISTModelBase(ModelBase):
             param_values = [f['arr_%d' % i] for i in range(len(f.files))]
         lasagne.layers.set_all_param_values(self.network, param_values)
 
-    def get_training_loss(self, x_train, y_train):
+    def get_training_loss(self, x_train, y_train, indices=None):
+        if indices is not None:
+            x_train, y_train = x_train[indices], y_train[indices]
+
         sum_loss = 0.0
         kf = get_minibatches_idx(len(y_train), self.train_batch_size, shuffle=False)
         for _, train_index in kf:
@@ -97,10 +102,31 @@ class MNISTModelBase(ModelBase):
         message("$  test accuracy:\t\t{:.2f} %".format(
             test_acc / test_batches * 100))
 
-    def validate_or_test(self, x_test, y_test):
+    def get_parameter_snapshot(self):
+        """Get a copy of all parameter values (include the non-trainable ones)."""
+        return get_all_param_values(self.network)
+
+    def set_parameter_snapshot(self, values):
+        set_all_param_values(self.network, values)
+
+    def validate_or_test(self, x_test, y_test, indices=None):
+        """Validate or test the model.
+
+        Parameters
+        ----------
+        x_test, y_test: the data.
+        indices: array of int or None
+            If given, only use the data of these indices (the subset will not be copied).
+        """
+
         test_err = 0.0
         test_acc = 0.0
-        kf = get_minibatches_idx(len(y_test), self.train_batch_size, shuffle=False)
+
+        if indices is None:
+            kf = get_minibatches_idx(len(y_test), self.train_batch_size, shuffle=False)
+        else:
+            kf = [(i, indices[batch_index]) for i, batch_index in
+                  get_minibatches_idx(len(indices), self.train_batch_size, shuffle=False)]
 
         for _, test_index in kf:
             inputs = x_test[test_index]
@@ -268,18 +294,22 @@ class MNISTModel(MNISTModelBase):
 
     def build_train_function(self):
         probs = lasagne.layers.get_output(self.network)
-        self.f_probs = theano.function(
+        self.f_probs = LazyFunction(
+            name='f_probs',
             inputs=[self.input_var],
             outputs=probs
         )
 
         loss = lasagne.objectives.categorical_crossentropy(probs, self.target_var)
 
-        self.f_cost_list_without_decay = theano.function([self.input_var, self.target_var], loss)
+        self.f_cost_list_without_decay = LazyFunction([self.input_var, self.target_var], loss,
+                                                      name='f_cost_list_without_decay')
+        self.f_probs_and_losses = LazyFunction([self.input_var, self.target_var], [probs, loss],
+                                               name='f_probs_and_losses')
 
         loss = loss.mean()
 
-        self.f_cost_without_decay = theano.function([self.input_var, self.target_var], loss)
+        self.f_cost_without_decay = LazyFunction([self.input_var, self.target_var], loss, name='f_cost_without_decay')
 
         # add weight decay
         all_layers = lasagne.layers.get_all_layers(self.network)
@@ -290,14 +320,14 @@ class MNISTModel(MNISTModelBase):
             ParamConfig['l2_penalty_factor']
         loss += l2_penalty
 
-        self.f_cost = theano.function([self.input_var, self.target_var], loss)
+        self.f_cost = LazyFunction([self.input_var, self.target_var], loss, name='f_cost')
 
         params = lasagne.layers.get_all_params(self.network, trainable=True)
 
         # SGD update.
         updates_sgd = lasagne.updates.sgd(loss, params, self.learning_rate)
 
-        f_train_sgd = theano.function([self.input_var, self.target_var], loss, updates=updates_sgd)
+        f_train_sgd = LazyFunction([self.input_var, self.target_var], loss, updates=updates_sgd, name='f_train')
         self.f_train = f_train_sgd
 
     def build_validate_function(self):
@@ -306,7 +336,7 @@ class MNISTModel(MNISTModelBase):
         test_loss = test_loss.mean()
         test_acc = T.mean(T.eq(T.argmax(test_preds, axis=1), self.target_var), dtype=fX)
 
-        self.f_validate = theano.function([self.input_var, self.target_var], [test_loss, test_acc])
+        self.f_validate = LazyFunction([self.input_var, self.target_var], [test_loss, test_acc], name='f_validate')
 
 
 if __name__ == '__main__':
@@ -11,7 +11,13 @@ class ModelBase(object):
     def build_validate_function(self):
         raise NotImplementedError()
 
-    def validate_or_test(self, x_test, y_test):
+    def validate_or_test(self, x_test, y_test, indices=None):
+        raise NotImplementedError()
+
+    def get_parameter_snapshot(self):
+        raise NotImplementedError()
+
+    def set_parameter_snapshot(self, values):
         raise NotImplementedError()
 
     @staticmethod
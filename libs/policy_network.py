@@ -11,10 +11,13 @@ import theano.tensor as T
 from theano.sandbox.rng_mrg import MRG_RandomStreams as RandomStreams
 
 from .utility.config import Config, PolicyConfig
+from .utility.lazy_function import LazyFunction
+from .utility import metrics
 from .utility.my_logging import message, logging
 from .utility.name_register import NameRegister
-from .utility.utils import fX, floatX, init_norm
+from .utility.utils import fX, floatX, init_norm, is_temp_job
 from .utility.optimizers import get_optimizer
+from .utility.resource_monitor import monitor_phase
 
 
 class PolicyNetworkBase(NameRegister):
@@ -86,12 +89,14 @@ class PolicyNetworkBase(NameRegister):
         self.batch_output_sample = self.random_generator.binomial(size=self.batch_output.shape, p=self.batch_output)
         self.batch_output_sample.name = 'batch_output_sample'
 
-        self.f_batch_output = theano.function(
+        self.f_batch_output = LazyFunction(
+            name='f_batch_output',
             inputs=[self.batch_input],
             outputs=self.batch_output,
         )
 
-        self.f_batch_output_sample = theano.function(
+        self.f_batch_output_sample = LazyFunction(
+            name='f_batch_output_sample',
             inputs=[self.batch_input],
             outputs=self.batch_output_sample,
         )
@@ -176,10 +181,12 @@ class PolicyNetworkBase(NameRegister):
         return cost
 
     @logging
+    @monitor_phase('policy_update')
     def update(self, reward_checker):
         cost = 0.0
 
         final_reward = reward_checker.get_reward(echo=True)
+        metrics.record('reward', checker=type(reward_checker).__name__, reward=final_reward)
 
         old_parameters = [param.get_value() for param in self.parameters]
 
@@ -208,7 +215,7 @@ ActionPartSize {} ImmediateRewardSize {}'''.format(
                     raise OverflowError('NaN detected at policy update')
 
                 # Add reward discount
-                if Config['temp_job'] == 'discount_reward':
+                if is_temp_job('discount_reward'):
                     temp *= self.gamma
 
             # Reward baseline (only for terminal reward)
@@ -291,6 +298,9 @@ Real cost (Final reward for terminal): {}""".format(
                 value_str = str(value)
             message('$    {} = {}'.format(parameter.name, value_str))
 
+        metrics.record('policy_parameters', parameters={
+            parameter.name: parameter.get_value() for parameter in self.parameters})
+
     def check_load(self):
         train_action = Config['action'].lower()
 
@@ -417,6 +427,7 @@ class FixedPolicyNetWork(LRPolicyNetwork):
         return discounted_rewards
 
     @logging
+    @monitor_phase('policy_update')
     def update(self, reward_checker):
         old_parameters = [param.get_value() for param in self.parameters]
 
@@ -432,6 +443,7 @@ class FixedPolicyNetWork(LRPolicyNetwork):
         assert input_buffer.shape[0] == action_buffer.shape[0]
 
         final_reward = reward_checker.get_reward(echo=True)
+        metrics.record('reward', checker=type(reward_checker).__name__, reward=final_reward)
 
         if reward_checker.ImmediateReward:
             imm_reward = reward_checker.get_immediate_reward(echo=True)
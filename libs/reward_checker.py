@@ -6,6 +6,7 @@ from __future__ import print_function
 
 import numpy as np
 
+from .utility import metrics
 from .utility.config import PolicyConfig
 from .utility.my_logging import message
 from .utility.name_register import NameRegister
@@ -27,6 +28,18 @@ class RewardChecker(NameRegister):
         """If ImmediateReward is True, must implement it."""
         return None
 
+    def state(self):
+        """The state of the checker (the public attributes), reported by the status server."""
+        return {key: value for key, value in vars(self).items() if not key.startswith('_')}
+
+    def pending_thresholds(self):
+        """The accuracy thresholds that `check` still need to decide.
+
+        If it is not None, the validation accuracy only need to be compared with these thresholds
+        (used in sequential validation). None means the exact validation accuracy is needed.
+        """
+        return None
+
 
 class SpeedRewardChecker(RewardChecker):
     def __init__(self, check_point_list, expected_total_cases):
@@ -48,6 +61,10 @@ class SpeedRewardChecker(RewardChecker):
     def num_checker(self):
         return len(self.thresholds)
 
+    def pending_thresholds(self):
+        return [threshold for threshold, first_over_cases in zip(self.thresholds, self.first_over_cases)
+                if first_over_cases is None]
+
     def check(self, validate_acc, updater):
         for i, threshold in enumerate(self.thresholds):
             if self.first_over_cases[i] is None and validate_acc >= threshold:
@@ -69,6 +86,8 @@ class SpeedRewardChecker(RewardChecker):
                 message('{} {} {}'.format(threshold, first_over_cases, terminal_reward))
             message('Total cases:', self.expected_total_cases)
             message('Terminal reward:', result)
+            metrics.record('reward_points', thresholds=self.thresholds, first_over_cases=self.first_over_cases,
+                           terminal_rewards=terminal_rewards, total_cases=self.expected_total_cases, reward=result)
 
         return result
 
@@ -116,9 +135,16 @@ class DeltaAccuracyRewardChecker(RewardChecker):
         self.delta_accuracy = []
 
     def check(self, validate_acc, updater):
-        vp_number = updater.vp_number
+        vp_position = updater.vp_position
+
+        if vp_position is None:
+            baseline_accuracy = self.baseline_accuracy_list[updater.vp_number]
+        else:
+            # Validation points are scheduled adaptively, interpolate the baseline at the nominal position.
+            baseline_accuracy = np.interp(
+                vp_position, np.arange(len(self.baseline_accuracy_list)), self.baseline_accuracy_list)
 
-        self.delta_accuracy.append(validate_acc - self.baseline_accuracy_list[vp_number])
+        self.delta_accuracy.append(validate_acc - baseline_accuracy)
 
     def get_reward(self, echo=True):
         return self.delta_accuracy[-1]
@@ -2,11 +2,17 @@
 
 from __future__ import print_function
 
+from functools import partial
+
+from ..actor_critic import actor_critic_update, run_parallel_actor_critic, Transition, EpisodeEnd, \
+    DelayedTransitions, display_AC_losses
+from ..async_evaluator import get_async_validator
 from ..batch_updater import *
 from ..critic_network import CriticNetwork
 from ..model_class.CIFAR10 import CIFARModelBase, CIFARModel
 from ..policy_network import PolicyNetworkBase
 from ..reward_checker import RewardChecker, get_reward_checker
+from ..vp_scheduler import get_vp_scheduler
 from ..utility.CIFAR10 import pre_process_CIFAR10_data, prepare_CIFAR10_data
 from ..utility.utils import *
 from ..utility.config import CifarConfig as ParamConfig, Config
@@ -57,22 +63,23 @@ def train_raw_CIFAR10():
 
             # Log training loss of each batch in test process
             if part_train_cost is not None:
-                message("tL {}: {:.6f}".format(updater.epoch_train_batches, part_train_cost.tolist()))
+                batch_loss_message(updater, part_train_cost)
 
             if updater.total_train_batches > 0 and \
                     updater.total_train_batches != last_validate_point and \
                     updater.total_train_batches % ParamConfig['valid_freq'] == 0:
                 last_validate_point = updater.total_train_batches
-                validate_acc, test_acc = validate_point_message(
+                vp_results = validate_point_message(
                     model, x_train, y_train, x_validate, y_validate, x_test, y_test, updater,
                     # validate_size=validate_size,  # Use part validation set in baseline
                     run_test=True,
                 )
 
-                if validate_acc > best_validate_acc:
-                    best_validate_acc = validate_acc
-                    best_iteration = updater.iteration
-                    test_score = test_acc
+                for validate_acc, test_acc, vp_state in vp_results:
+                    if validate_acc > best_validate_acc:
+                        best_validate_acc = validate_acc
+                        best_iteration = vp_state.iteration
+                        test_score = test_acc
 
             if isinstance(model, CIFARModel):
                 if not lr_discount_41 and updater.total_accepted_cases >= 41 * fixed_train_size:
@@ -130,22 +137,23 @@ def train_SPL_CIFAR10():
 
             # Log training loss of each batch in test process
             if part_train_cost is not None:
-                message("tL {}: {:.6f}".format(updater.epoch_train_batches, part_train_cost.tolist()))
+                batch_loss_message(updater, part_train_cost)
 
             if updater.total_train_batches > 0 and \
                     updater.total_train_batches != last_validate_point and \
                     updater.total_train_batches % ParamConfig['valid_freq'] == 0:
                 last_validate_point = updater.total_train_batches
-                validate_acc, test_acc = validate_point_message(
+                vp_results = validate_point_message(
                     model, x_train, y_train, x_validate, y_validate, x_test, y_test, updater,
                     # validate_size=validate_size,  # Use part validation set in baseline
                     run_test=True,
                 )
 
-                if validate_acc > best_validate_acc:
-                    best_validate_acc = validate_acc
-                    best_iteration = updater.iteration
-                    test_score = test_acc
+                for validate_acc, test_acc, vp_state in vp_results:
+                    if validate_acc > best_validate_acc:
+                        best_validate_acc = validate_acc
+                        best_iteration = vp_state.iteration
+                        test_score = test_acc
 
             if isinstance(model, CIFARModel):
                 if not lr_discount_41 and updater.total_accepted_cases >= 41 * fixed_train_size:
@@ -178,6 +186,8 @@ def train_policy_CIFAR10():
 
     reward_checker_type = RewardChecker.get_by_name(PolicyConfig['reward_checker'])
 
+    vp_validator = get_async_validator(type(model), x_validate, y_validate, x_test, y_test)
+
     # Train the network
     start_episode = 1 + PolicyConfig['start_episode']
     for episode in range(start_episode, start_episode + PolicyConfig['num_episodes']):
@@ -194,7 +204,7 @@ def train_policy_CIFAR10():
         # To prevent the double validate point
         last_validate_point = -1
 
-        if Config['temp_job'] in RemainOrderJobs:
+        if remain_order():
             x_train_small, y_train_small = x_train, y_train
         else:
             # get small training data
@@ -208,7 +218,9 @@ def train_policy_CIFAR10():
             ParamConfig['epoch_per_episode'] * train_small_size
         )
 
-        updater = TrainPolicyUpdater(model, [x_train_small, y_train_small], policy, prepare_data=prepare_CIFAR10_data)
+        updater = TrainPolicyUpdater(model, [x_train_small, y_train_small], policy, prepare_data=prepare_CIFAR10_data,
+                                     async_validator=vp_validator,
+                                     vp_scheduler=get_vp_scheduler(ParamConfig['valid_freq'], reward_checker))
 
         best_validate_acc = -np.inf
         best_iteration = 0
@@ -225,17 +237,18 @@ def train_policy_CIFAR10():
 
                 if updater.total_train_batches > 0 and \
                         updater.total_train_batches != last_validate_point and \
-                        updater.total_train_batches % ParamConfig['valid_freq'] == 0:
+                        is_validation_point(updater, ParamConfig['valid_freq']):
                     last_validate_point = updater.total_train_batches
-                    validate_acc, test_acc = validate_point_message(
+                    vp_results = validate_point_message(
                         model, x_train, y_train, x_validate, y_validate, x_test, y_test, updater, reward_checker,
                         run_test=PolicyConfig['run_test'],
                     )
 
-                    if validate_acc > best_validate_acc:
-                        best_validate_acc = validate_acc
-                        best_iteration = updater.iteration
-                        test_score = test_acc
+                    for validate_acc, test_acc, vp_state in vp_results:
+                        if validate_acc > best_validate_acc:
+                            best_validate_acc = validate_acc
+                            best_iteration = vp_state.iteration
+                            test_score = test_acc
 
             if isinstance(model, CIFARModel):
                 if not lr_discount_41 and updater.total_accepted_cases >= 41 * fixed_train_size:
@@ -248,6 +261,13 @@ def train_policy_CIFAR10():
             message("Epoch {} of {} took {:.3f}s".format(
                 epoch, ParamConfig['epoch_per_episode'], time.time() - epoch_start_time))
 
+        # Wait for the asynchronous validation points
+        for validate_acc, test_acc, vp_state in wait_validation_points(updater):
+            if validate_acc > best_validate_acc:
+                best_validate_acc = validate_acc
+                best_iteration = vp_state.iteration
+                test_score = test_acc
+
         episode_final_message(best_validate_acc, best_iteration, test_score, start_time)
 
         # Add a validation point at the final of the episode, related to last batches.
@@ -256,13 +276,21 @@ def train_policy_CIFAR10():
             run_test=PolicyConfig['run_test'],
             start_new_vp=False,
         )
+        wait_validation_points(updater)
         policy.update(reward_checker)
 
         if PolicyConfig['policy_save_freq'] > 0 and episode % PolicyConfig['policy_save_freq'] == 0:
             policy.save_policy(PolicyConfig['policy_save_file'], episode)
 
+    if vp_validator is not None:
+        vp_validator.close()
+
 
 def train_actor_critic_CIFAR10():
+    if PolicyConfig['AC_workers'] > 0:
+        train_actor_critic_parallel_CIFAR10()
+        return
+
     # Create neural network model
     model = CIFARModelBase.get_by_name(ParamConfig['model_name'])()
 
@@ -275,14 +303,47 @@ def train_actor_critic_CIFAR10():
     actor.check_load()
 
     # Load the dataset
+    data = pre_process_CIFAR10_data()
+
+    run_actor_critic_CIFAR10(model, actor, data, partial(actor_critic_update, actor, critic))
+
+
+def run_actor_critic_CIFAR10(model, actor, data, update_AC, save_policy=True, worker_id=None, episode_end=None):
+    """The episodes of Actor-Critic.
+
+    Parameters
+    ----------
+    model: the classifier.
+    actor: the actor network (take actions).
+    data: the dataset.
+    update_AC: function
+        Called as `update_AC(state, action, imm_reward, state_new, terminal)` at each AC update point,
+        returns the critic loss and the actor loss (or None if not updated at here).
+    save_policy: bool
+        Save the actor or not.
+    worker_id: int or None
+        The worker id in parallel mode.
+    episode_end: function or None
+        Called as `episode_end(episode)` at the end of each episode.
+    """
+
     x_train, y_train, x_validate, y_validate, x_test, y_test, \
-        train_size, validate_size, test_size = pre_process_CIFAR10_data()
+        train_size, validate_size, test_size = data
+
+    transitions = DelayedTransitions(model, update_AC, type(model), np.asarray(x_validate), np.asarray(y_validate),
+                                     use_async=worker_id is None)
+    vp_validator = get_async_validator(type(model), x_validate, y_validate, x_test, y_test)
 
     # Train the network
     start_episode = 1 + PolicyConfig['start_episode']
     for episode in range(start_episode, start_episode + PolicyConfig['num_episodes']):
-        print('[Episode {}]'.format(episode))
-        message('[Episode {}]'.format(episode))
+        if worker_id is None:
+            print('[Episode {}]'.format(episode))
+            message('[Episode {}]'.format(episode))
+        else:
+            message('[Worker {} Episode {}]'.format(worker_id, episode))
+        sampling_profiler.new_episode(episode)
+        status_server.update(episode=episode)
 
         actor.message_parameters()
 
@@ -299,7 +360,7 @@ def train_actor_critic_CIFAR10():
         # To prevent the double validate / AC update point
         last_AC_update_point = -1
 
-        if Config['temp_job'] in RemainOrderJobs:
+        if remain_order():
             x_train_small, y_train_small = x_train, y_train
         else:
             # get small training data
@@ -307,7 +368,8 @@ def train_actor_critic_CIFAR10():
         train_small_size = len(x_train_small)
         message('Training small size:', train_small_size)
 
-        updater = ACUpdater(model, [x_train_small, y_train_small], actor, prepare_data=prepare_CIFAR10_data)
+        updater = ACUpdater(model, [x_train_small, y_train_small], actor, prepare_data=prepare_CIFAR10_data,
+                            async_validator=vp_validator)
 
         for epoch in range(ParamConfig['epoch_per_episode']):
             epoch_start_time = start_new_epoch(updater, epoch)
@@ -316,6 +378,7 @@ def train_actor_critic_CIFAR10():
 
             for _, train_index in kf:
                 part_train_cost = updater.add_batch(train_index)
+                transitions.add_new_state(updater.last_probability)
 
                 if updater.total_train_batches > 0 and \
                         updater.total_train_batches != last_AC_update_point and \
@@ -325,37 +388,15 @@ def train_actor_critic_CIFAR10():
                     # [NOTE]: The batch is the batch sent into updater, NOT the buffer's batch.
                     inputs = x_train_small[train_index]
                     targets = y_train_small[train_index]
-                    probability = updater.last_probability
-                    actions = updater.last_action
-
-                    # Get immediate reward
-                    valid_part_x, valid_part_y = get_part_data(
-                        np.asarray(x_validate), np.asarray(y_validate), PolicyConfig['immediate_reward_sample_size'])
-                    _, valid_acc, validate_batches = model.validate_or_test(valid_part_x, valid_part_y)
-                    imm_reward = valid_acc / validate_batches
-
-                    # Get new state, new actions, and compute new Q value
-                    probability_new = model.get_policy_input(inputs, targets, updater, updater.history_accuracy)
-                    actions_new = actor.take_action(probability_new, log_replay=False)
-
-                    Q_value_new = critic.Q_function(state=probability_new, action=actions_new)
-                    if epoch < ParamConfig['epoch_per_episode'] - 1:
-                        label = PolicyConfig['actor_gamma'] * Q_value_new + imm_reward
-                    else:
-                        label = imm_reward
-
-                    # Update the critic Q network
-                    Q_loss = critic.update(probability, actions, floatX(label))
-
-                    # Update actor network
-                    actor_loss = actor.update_raw(probability, actions,
-                                                  np.full(actions.shape, label, dtype=probability.dtype))
-
-                    if PolicyConfig['AC_update_freq'] >= ParamConfig['display_freq'] or \
-                            updater.total_train_batches % ParamConfig['display_freq'] == 0:
-                        message('E {} TB {} Cost {} Critic loss {:.6f} Actor loss {:.6f}'
-                                .format(epoch, updater.total_train_batches, part_train_cost,
-                                        float(Q_loss), float(actor_loss)))
+
+                    # The immediate reward is evaluated on the parameter snapshot (maybe asynchronously), and the new
+                    # state is the policy input of the next batch ("AC_async_reward") or of this batch after training.
+                    transitions.add(
+                        updater.total_train_batches, updater.last_probability, updater.last_action,
+                        epoch == ParamConfig['epoch_per_episode'] - 1,
+                        partial(model.get_policy_input, inputs, targets, updater, updater.history_accuracy))
+
+                display_AC_losses(transitions.update(), epoch, part_train_cost, ParamConfig['display_freq'])
 
                 if isinstance(model, CIFARModel):
                     if not lr_discount_41 and updater.total_accepted_cases >= 41 * fixed_train_size:
@@ -368,14 +409,58 @@ def train_actor_critic_CIFAR10():
             message("Epoch {} of {} took {:.3f}s".format(
                 epoch, ParamConfig['epoch_per_episode'], time.time() - epoch_start_time))
 
-            validate_acc, test_acc = validate_point_message(
+            validate_point_message(
                 model, x_train, y_train, x_validate, y_validate, x_test, y_test, updater)
 
+        display_AC_losses(transitions.update(flush=True), epoch, part_train_cost, ParamConfig['display_freq'])
+        wait_validation_points(updater)
+
         model.test(x_test, y_test)
+        episode_end_report(updater)
 
-        if PolicyConfig['policy_save_freq'] > 0 and episode % PolicyConfig['policy_save_freq'] == 0:
+        if save_policy and PolicyConfig['policy_save_freq'] > 0 and episode % PolicyConfig['policy_save_freq'] == 0:
             actor.save_policy(PolicyConfig['policy_save_file'], episode)
 
+        if episode_end is not None:
+            episode_end(episode)
+
+    transitions.close()
+    if vp_validator is not None:
+        vp_validator.close()
+
+
+def actor_critic_worker_CIFAR10(worker_id, transition_queue, shared_actor, data):
+    """The worker of parallel Actor-Critic, train its own classifier with the shared actor."""
+
+    model = CIFARModelBase.get_by_name(ParamConfig['model_name'])()
+    actor = PolicyNetworkBase.get_by_name(PolicyConfig['policy_model_type'])(
+        input_size=CIFARModelBase.get_policy_input_size())
+
+    # Use a list to be modified in the closure.
+    actor_version = [shared_actor.pull(actor.parameters)]
+
+    def update_AC(state, action, imm_reward, state_new, terminal):
+        transition_queue.put(Transition(worker_id, state, action, imm_reward, state_new, terminal))
+        actor_version[0] = shared_actor.pull(actor.parameters, actor_version[0])
+
+    def episode_end(episode):
+        transition_queue.put(EpisodeEnd(worker_id, episode))
+
+    run_actor_critic_CIFAR10(model, actor, data, update_AC,
+                             save_policy=False, worker_id=worker_id, episode_end=episode_end)
+
+
+def train_actor_critic_parallel_CIFAR10():
+    # Load the dataset before forking the workers, so they can share it.
+    data = pre_process_CIFAR10_data()
+
+    run_parallel_actor_critic(
+        partial(actor_critic_worker_CIFAR10, data=data),
+        CIFARModelBase.get_policy_input_size(),
+        ParamConfig['train_batch_size'],
+        ParamConfig['display_freq'],
+    )
+
 
 def test_policy_CIFAR10():
     # Create neural network model
@@ -428,22 +513,23 @@ def test_policy_CIFAR10():
 
             # Log training loss of each batch in test process
             if part_train_cost is not None:
-                message("tL {}: {:.6f}".format(updater.epoch_train_batches, part_train_cost.tolist()))
+                batch_loss_message(updater, part_train_cost)
 
             if updater.total_train_batches > 0 and \
                     updater.total_train_batches != last_validate_point and \
                     updater.total_train_batches % ParamConfig['valid_freq'] == 0:
                 last_validate_point = updater.total_train_batches
-                validate_acc, test_acc = validate_point_message(
+                vp_results = validate_point_message(
                     model, x_train, y_train, x_validate, y_validate, x_test, y_test, updater,
                     # validate_size=validate_size,  # Use part validation set in baseline
                     run_test=True,
                 )
 
-                if validate_acc > best_validate_acc:
-                    best_validate_acc = validate_acc
-                    best_iteration = updater.iteration
-                    test_score = test_acc
+                for validate_acc, test_acc, vp_state in vp_results:
+                    if validate_acc > best_validate_acc:
+                        best_validate_acc = validate_acc
+                        best_iteration = vp_state.iteration
+                        test_score = test_acc
 
             if isinstance(model, CIFARModel):
                 if not lr_discount_41 and updater.total_accepted_cases >= 41 * fixed_train_size:
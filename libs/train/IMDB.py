@@ -2,11 +2,16 @@
 
 from __future__ import print_function
 
+from functools import partial
+
+from ..actor_critic import actor_critic_update, DelayedTransitions, display_AC_losses
+from ..async_evaluator import get_async_validator
 from ..batch_updater import *
 from ..critic_network import CriticNetwork
 from ..model_class.IMDB import IMDBModel
 from ..policy_network import PolicyNetworkBase
 from ..reward_checker import get_reward_checker, RewardChecker
+from ..vp_scheduler import get_vp_scheduler
 from ..utility.IMDB import pre_process_IMDB_data, pre_process_config
 from ..utility.IMDB import prepare_imdb_data as prepare_data
 from ..utility.utils import *
@@ -57,6 +62,8 @@ def train_raw_IMDB():
         train_size, valid_size, test_size = pre_process_IMDB_data()
 
     model = IMDBModel()
+    model.register_eval_data(x_validate, y_validate)
+    model.register_eval_data(x_test, y_test)
 
     # Loading configure settings
     kf_valid, kf_test, \
@@ -91,7 +98,7 @@ def train_raw_IMDB():
 
             # Log training loss of each batch in test process
             if part_train_cost is not None:
-                message("tL {}: {:.6f}".format(updater.epoch_train_batches, part_train_cost.tolist()))
+                batch_loss_message(updater, part_train_cost)
 
             if updater.total_train_batches > 0 and \
                     updater.total_train_batches != last_validate_point and \
@@ -99,24 +106,27 @@ def train_raw_IMDB():
                 last_validate_point = updater.total_train_batches
 
                 model.use_noise.set_value(floatX(0.))
-                validate_acc, test_acc = validate_point_message(
+                vp_results = validate_point_message(
                     model, x_train, y_train, x_validate, y_validate, x_test, y_test, updater,
                     validate_size=valid_size,  # Use part validation set in baseline
                     run_test=True,
                 )
 
-                if validate_acc > best_validate_acc:
-                    best_validate_acc = validate_acc
-                    best_iteration = updater.total_train_batches
-                    test_score = test_acc
-                    bad_counter = 0
-
-                if len(updater.history_accuracy) > patience and \
-                        validate_acc <= max(updater.history_accuracy[:-patience]):
-                    bad_counter += 1
-                    if bad_counter > patience:
-                        early_stop = True
-                        break
+                for validate_acc, test_acc, vp_state in vp_results:
+                    if validate_acc > best_validate_acc:
+                        best_validate_acc = validate_acc
+                        best_iteration = vp_state.total_train_batches
+                        test_score = test_acc
+                        bad_counter = 0
+
+                    if len(updater.history_accuracy) > patience and \
+                            validate_acc <= max(updater.history_accuracy[:-patience]):
+                        bad_counter += 1
+                        if bad_counter > patience:
+                            early_stop = True
+                            break
+                if early_stop:
+                    break
 
         message("Epoch {} of {} took {:.3f}s".format(
             epoch, ParamConfig['epoch_per_episode'], time.time() - epoch_start_time))
@@ -134,6 +144,8 @@ def train_SPL_IMDB():
         train_size, valid_size, test_size = pre_process_IMDB_data()
 
     model = IMDBModel()
+    model.register_eval_data(x_validate, y_validate)
+    model.register_eval_data(x_test, y_test)
 
     # Loading configure settings
     kf_valid, kf_test, \
@@ -168,7 +180,7 @@ def train_SPL_IMDB():
 
             # Log training loss of each batch in test process
             if part_train_cost is not None:
-                message("tL {}: {:.6f}".format(updater.epoch_train_batches, part_train_cost.tolist()))
+                batch_loss_message(updater, part_train_cost)
 
             if updater.total_train_batches > 0 and \
                     updater.total_train_batches != last_validate_point and \
@@ -176,24 +188,27 @@ def train_SPL_IMDB():
                 last_validate_point = updater.total_train_batches
 
                 model.use_noise.set_value(floatX(0.))
-                validate_acc, test_acc = validate_point_message(
+                vp_results = validate_point_message(
                     model, x_train, y_train, x_validate, y_validate, x_test, y_test, updater,
                     validate_size=valid_size,  # Use part validation set in baseline
                     run_test=True,
                 )
 
-                if validate_acc > best_validate_acc:
-                    best_validate_acc = validate_acc
-                    best_iteration = updater.total_train_batches
-                    test_score = test_acc
-                    bad_counter = 0
-
-                if len(updater.history_accuracy) > patience and \
-                        validate_acc <= max(updater.history_accuracy[:-patience]):
-                    bad_counter += 1
-                    if bad_counter > patience:
-                        early_stop = True
-                        break
+                for validate_acc, test_acc, vp_state in vp_results:
+                    if validate_acc > best_validate_acc:
+                        best_validate_acc = validate_acc
+                        best_iteration = vp_state.total_train_batches
+                        test_score = test_acc
+                        bad_counter = 0
+
+                    if len(updater.history_accuracy) > patience and \
+                            validate_acc <= max(updater.history_accuracy[:-patience]):
+                        bad_counter += 1
+                        if bad_counter > patience:
+                            early_stop = True
+                            break
+                if early_stop:
+                    break
 
         message("Epoch {} of {} took {:.3f}s".format(
             epoch, ParamConfig['epoch_per_episode'], time.time() - epoch_start_time))
@@ -211,6 +226,8 @@ def train_policy_IMDB():
         train_size, valid_size, test_size = pre_process_IMDB_data()
 
     model = IMDBModel()
+    model.register_eval_data(x_validate, y_validate)
+    model.register_eval_data(x_test, y_test)
 
     # Build policy
     input_size = model.get_policy_input_size()
@@ -226,6 +243,8 @@ def train_policy_IMDB():
 
     reward_checker_type = RewardChecker.get_by_name(PolicyConfig['reward_checker'])
 
+    vp_validator = get_async_validator(build_evaluate_model_IMDB, x_validate, y_validate, x_test, y_test)
+
     start_episode = 1 + PolicyConfig['start_episode']
     for episode in range(start_episode, start_episode + PolicyConfig['num_episodes']):
         start_new_episode(model, policy, episode)
@@ -236,7 +255,7 @@ def train_policy_IMDB():
         # To prevent the double validate point
         last_validate_point = -1
 
-        if Config['temp_job'] in RemainOrderJobs:
+        if remain_order():
             x_train_small, y_train_small = x_train, y_train
         else:
             # get small training data
@@ -250,7 +269,9 @@ def train_policy_IMDB():
             ParamConfig['epoch_per_episode'] * train_small_size
         )
 
-        updater = TrainPolicyUpdater(model, [x_train_small, y_train_small], policy, prepare_data=prepare_data)
+        updater = TrainPolicyUpdater(model, [x_train_small, y_train_small], policy, prepare_data=prepare_data,
+                                     async_validator=vp_validator,
+                                     vp_scheduler=get_vp_scheduler(valid_freq, reward_checker))
 
         best_validate_acc = -np.inf
         best_iteration = 0
@@ -273,28 +294,31 @@ def train_policy_IMDB():
 
                 if updater.total_train_batches > 0 and \
                         updater.total_train_batches != last_validate_point and \
-                        updater.total_train_batches % valid_freq == 0:
+                        is_validation_point(updater, valid_freq):
                     last_validate_point = updater.total_train_batches
 
                     model.use_noise.set_value(floatX(0.))
-                    validate_acc, test_acc = validate_point_message(
+                    vp_results = validate_point_message(
                         model, x_train, y_train, x_validate, y_validate, x_test, y_test, updater, reward_checker,
                         validate_size=valid_size,  # Use part validation set in baseline
                         run_test=PolicyConfig['run_test'],
                     )
 
-                    if validate_acc > best_validate_acc:
-                        best_validate_acc = validate_acc
-                        best_iteration = updater.total_train_batches
-                        test_score = test_acc
-                        bad_counter = 0
-
-                    if len(updater.history_accuracy) > patience and \
-                            validate_acc <= max(updater.history_accuracy[:-patience]):
-                        bad_counter += 1
-                        if bad_counter > patience:
-                            early_stop = True
-                            break
+                    for validate_acc, test_acc, vp_state in vp_results:
+                        if validate_acc > best_validate_acc:
+                            best_validate_acc = validate_acc
+                            best_iteration = vp_state.total_train_batches
+                            test_score = test_acc
+                            bad_counter = 0
+
+                        if len(updater.history_accuracy) > patience and \
+                                validate_acc <= max(updater.history_accuracy[:-patience]):
+                            bad_counter += 1
+                            if bad_counter > patience:
+                                early_stop = True
+                                break
+                    if early_stop:
+                        break
 
             message("Epoch {} of {} took {:.3f}s".format(
                 epoch, ParamConfig['epoch_per_episode'], time.time() - epoch_start_time))
@@ -302,6 +326,13 @@ def train_policy_IMDB():
                 message('Early Stop!')
                 break
 
+        # Wait for the asynchronous validation points
+        for validate_acc, test_acc, vp_state in wait_validation_points(updater):
+            if validate_acc > best_validate_acc:
+                best_validate_acc = validate_acc
+                best_iteration = vp_state.total_train_batches
+                test_score = test_acc
+
         episode_final_message(best_validate_acc, best_iteration, test_score, start_time)
 
         # Add a validation point at the final of the episode, related to last batches.
@@ -310,11 +341,38 @@ def train_policy_IMDB():
             run_test=PolicyConfig['run_test'],
             start_new_vp=False,
         )
+        wait_validation_points(updater)
         policy.update(reward_checker)
 
         if PolicyConfig['policy_save_freq'] > 0 and episode % PolicyConfig['policy_save_freq'] == 0:
             policy.save_policy(PolicyConfig['policy_save_file'], episode)
 
+    if vp_validator is not None:
+        vp_validator.close()
+
+
+def policy_input_without_noise(model, x, mask, y, updater, history_accuracy):
+    """Get the policy input with the dropout noise off.
+
+    [NOTE] The new state function of the AC transition may be called later (with "AC_async_reward"),
+    when the noise is on again, so set it explicitly.
+    """
+
+    use_noise = model.use_noise.get_value()
+    model.use_noise.set_value(floatX(0.))
+    try:
+        return model.get_policy_input(x, mask, y, updater, history_accuracy)
+    finally:
+        model.use_noise.set_value(use_noise)
+
+
+def build_evaluate_model_IMDB():
+    """Build the model in the evaluator process (without dropout noise)."""
+
+    model = IMDBModel(ParamConfig['reload_model'])
+    model.use_noise.set_value(floatX(0.))
+    return model
+
 
 def train_actor_critic_IMDB():
     # Loading data
@@ -323,6 +381,8 @@ def train_actor_critic_IMDB():
 
     # Building model
     model = IMDBModel(ParamConfig['reload_model'])
+    model.register_eval_data(x_valid, y_valid)
+    model.register_eval_data(x_test, y_test)
 
     # Loading configure settings
     kf_valid, kf_test, \
@@ -337,6 +397,10 @@ def train_actor_critic_IMDB():
 
     actor.check_load()
 
+    transitions = DelayedTransitions(model, partial(actor_critic_update, actor, critic), build_evaluate_model_IMDB,
+                                     np.asarray(x_valid), np.asarray(y_valid))
+    vp_validator = get_async_validator(build_evaluate_model_IMDB, x_valid, y_valid, x_test, y_test)
+
     # Train the network
     start_episode = 1 + PolicyConfig['start_episode']
     for episode in range(start_episode, start_episode + PolicyConfig['num_episodes']):
@@ -349,7 +413,7 @@ def train_actor_critic_IMDB():
         last_validate_point = -1
         last_AC_update_point = -1
 
-        if Config['temp_job'] in RemainOrderJobs:
+        if remain_order():
             x_train_small, y_train_small = x_train, y_train
         else:
             # get small training data
@@ -357,7 +421,8 @@ def train_actor_critic_IMDB():
         train_small_size = len(x_train_small)
         message('Training small size:', train_small_size)
 
-        updater = ACUpdater(model, [x_train_small, y_train_small], actor, prepare_data=prepare_data)
+        updater = ACUpdater(model, [x_train_small, y_train_small], actor, prepare_data=prepare_data,
+                            async_validator=vp_validator)
 
         best_validate_acc = -np.inf
         best_iteration = 0
@@ -377,6 +442,7 @@ def train_actor_critic_IMDB():
             for _, train_index in kf:
                 model.use_noise.set_value(floatX(1.))
                 part_train_cost = updater.add_batch(train_index)
+                transitions.add_new_state(updater.last_probability)
 
                 if updater.total_train_batches > 0 and \
                         updater.total_train_batches != last_AC_update_point and \
@@ -387,58 +453,40 @@ def train_actor_critic_IMDB():
                     inputs = x_train_small[train_index]
                     targets = y_train_small[train_index]
                     x, mask, y = prepare_data(inputs, targets)
-                    probability = updater.last_probability
-                    actions = updater.last_action
-
-                    # Get immediate reward
-                    valid_part_x, valid_part_y = get_part_data(
-                        np.asarray(x_valid), np.asarray(y_valid), PolicyConfig['immediate_reward_sample_size'])
-                    _, valid_acc, validate_batches = model.validate_or_test(valid_part_x, valid_part_y)
-                    imm_reward = valid_acc / validate_batches
-
-                    # Get new state, new actions, and compute new Q value
-                    probability_new = model.get_policy_input(x, mask, y, updater, updater.history_accuracy)
-                    actions_new = actor.take_action(probability_new, log_replay=False)
-
-                    Q_value_new = critic.Q_function(state=probability_new, action=actions_new)
-                    if epoch < ParamConfig['epoch_per_episode'] - 1:
-                        label = PolicyConfig['actor_gamma'] * Q_value_new + imm_reward
-                    else:
-                        label = imm_reward
-
-                    # Update the critic Q network
-                    Q_loss = critic.update(probability, actions, floatX(label))
-
-                    # Update actor network
-                    actor_loss = actor.update_raw(probability, actions,
-                                                  np.full(actions.shape, label, dtype=probability.dtype))
-
-                    if PolicyConfig['AC_update_freq'] >= display_freq or \
-                            updater.total_train_batches % display_freq == 0:
-                        message('E {} TB {} Cost {} Critic loss {:.6f} Actor loss {:.6f}'
-                                .format(epoch, updater.total_train_batches, part_train_cost,
-                                        float(Q_loss), float(actor_loss)))
+
+                    # The immediate reward is evaluated on the parameter snapshot (maybe asynchronously), and the new
+                    # state is the policy input of the next batch ("AC_async_reward") or of this batch after training.
+                    model.use_noise.set_value(floatX(0.))
+                    transitions.add(
+                        updater.total_train_batches, updater.last_probability, updater.last_action,
+                        epoch == ParamConfig['epoch_per_episode'] - 1,
+                        partial(policy_input_without_noise, model, x, mask, y, updater, updater.history_accuracy))
+
+                display_AC_losses(transitions.update(), epoch, part_train_cost, display_freq)
 
                 if updater.total_train_batches > 0 and \
                         updater.total_train_batches != last_validate_point and \
                         updater.total_train_batches % valid_freq == 0:
                     last_validate_point = updater.total_train_batches
 
-                    validate_acc, test_acc = validate_point_message(
+                    vp_results = validate_point_message(
                         model, x_train, y_train, x_valid, y_valid, x_test, y_test, updater)
 
-                    if validate_acc > best_validate_acc:
-                        best_validate_acc = validate_acc
-                        best_iteration = updater.total_train_batches
-                        test_score = test_acc
-                        bad_counter = 0
-
-                    if len(updater.history_accuracy) > patience and \
-                            validate_acc <= max(updater.history_accuracy[:-patience]):
-                        bad_counter += 1
-                        if bad_counter > patience:
-                            early_stop = True
-                            break
+                    for validate_acc, test_acc, vp_state in vp_results:
+                        if validate_acc > best_validate_acc:
+                            best_validate_acc = validate_acc
+                            best_iteration = vp_state.total_train_batches
+                            test_score = test_acc
+                            bad_counter = 0
+
+                        if len(updater.history_accuracy) > patience and \
+                                validate_acc <= max(updater.history_accuracy[:-patience]):
+                            bad_counter += 1
+                            if bad_counter > patience:
+                                early_stop = True
+                                break
+                    if early_stop:
+                        break
 
             message("Epoch {} of {} took {:.3f}s".format(
                 epoch, ParamConfig['epoch_per_episode'], time.time() - epoch_start_time))
@@ -446,11 +494,24 @@ def train_actor_critic_IMDB():
                 message('Early Stop!')
                 break
 
+        display_AC_losses(transitions.update(flush=True), epoch, part_train_cost, display_freq)
+
+        # Wait for the asynchronous validation points
+        for validate_acc, test_acc, vp_state in wait_validation_points(updater):
+            if validate_acc > best_validate_acc:
+                best_validate_acc = validate_acc
+                best_iteration = vp_state.total_train_batches
+                test_score = test_acc
+
         episode_final_message(best_validate_acc, best_iteration, test_score, start_time)
 
         if PolicyConfig['policy_save_freq'] > 0 and episode % PolicyConfig['policy_save_freq'] == 0:
             actor.save_policy(PolicyConfig['policy_save_file'], episode)
 
+    transitions.close()
+    if vp_validator is not None:
+        vp_validator.close()
+
 
 def test_policy_IMDB():
     # Loading data
@@ -459,6 +520,8 @@ def test_policy_IMDB():
         train_size, valid_size, test_size = pre_process_IMDB_data()
 
     model = IMDBModel()
+    model.register_eval_data(x_validate, y_validate)
+    model.register_eval_data(x_test, y_test)
 
     # Loading configure settings
     kf_valid, kf_test, \
@@ -506,7 +569,7 @@ def test_policy_IMDB():
 
             # Log training loss of each batch in test process
             if part_train_cost is not None:
-                message("tL {}: {:.6f}".format(updater.epoch_train_batches, part_train_cost.tolist()))
+                batch_loss_message(updater, part_train_cost)
 
             if updater.total_train_batches > 0 and \
                     updater.total_train_batches != last_validate_point and \
@@ -514,24 +577,27 @@ def test_policy_IMDB():
                 last_validate_point = updater.total_train_batches
 
                 model.use_noise.set_value(floatX(0.))
-                validate_acc, test_acc = validate_point_message(
+                vp_results = validate_point_message(
                     model, x_train, y_train, x_validate, y_validate, x_test, y_test, updater,
                     # validate_size=valid_size,  # Use part validation set in baseline
                     run_test=True,
                 )
 
-                if validate_acc > best_validate_acc:
-                    best_validate_acc = validate_acc
-                    best_iteration = updater.total_train_batches
-                    test_score = test_acc
-                    bad_counter = 0
-
-                if len(updater.history_accuracy) > patience and \
-                        validate_acc <= max(updater.history_accuracy[:-patience]):
-                    bad_counter += 1
-                    if bad_counter > patience:
-                        early_stop = True
-                        break
+                for validate_acc, test_acc, vp_state in vp_results:
+                    if validate_acc > best_validate_acc:
+                        best_validate_acc = validate_acc
+                        best_iteration = vp_state.total_train_batches
+                        test_score = test_acc
+                        bad_counter = 0
+
+                    if len(updater.history_accuracy) > patience and \
+                            validate_acc <= max(updater.history_accuracy[:-patience]):
+                        bad_counter += 1
+                        if bad_counter > patience:
+                            early_stop = True
+                            break
+                if early_stop:
+                    break
 
         message("Epoch {} of {} took {:.3f}s".format(
             epoch, ParamConfig['epoch_per_episode'], time.time() - epoch_start_time))
@@ -5,11 +5,15 @@ from __future__ import print_function
 
 from functools import partial
 
+from ..actor_critic import actor_critic_update, run_parallel_actor_critic, Transition, EpisodeEnd, \
+    DelayedTransitions, display_AC_losses
+from ..async_evaluator import get_async_validator
 from ..batch_updater import *
 from ..critic_network import CriticNetwork
 from ..model_class.MNIST import MNISTModel
 from ..policy_network import PolicyNetworkBase
 from ..reward_checker import RewardChecker, get_reward_checker
+from ..vp_scheduler import get_vp_scheduler
 from ..utility.MNIST import pre_process_MNIST_data, pre_process_config
 from ..utility.utils import *
 from ..utility.config import MNISTConfig as ParamConfig, Config
@@ -77,25 +81,26 @@ def train_raw_MNIST_template(train_type='raw'):
 
             # Log training loss of each batch in test process
             if part_train_cost is not None:
-                message("tL {}: {:.6f}".format(updater.epoch_train_batches, part_train_cost.tolist()))
+                batch_loss_message(updater, part_train_cost)
 
             if updater.total_train_batches > 0 and \
                     updater.total_train_batches != last_validate_point and \
                     updater.total_train_batches % validation_frequency == 0:
                 last_validate_point = updater.total_train_batches
-                validate_acc, test_acc = validate_point_message(
+                vp_results = validate_point_message(
                     model, x_train, y_train, x_validate, y_validate, x_test, y_test, updater,
                     # validate_size=validate_size,  # Use part validation set in baseline
                     run_test=True,
                 )
 
-                if validate_acc > best_validate_acc:
-                    # improve patience if loss improvement is good enough
-                    if (1. - validate_acc) < (1. - best_validate_acc) * improvement_threshold:
-                        patience = max(patience, updater.total_train_batches * patience_increase)
-                    best_validate_acc = validate_acc
-                    best_iteration = updater.total_train_batches
-                    test_score = test_acc
+                for validate_acc, test_acc, vp_state in vp_results:
+                    if validate_acc > best_validate_acc:
+                        # improve patience if loss improvement is good enough
+                        if (1. - validate_acc) < (1. - best_validate_acc) * improvement_threshold:
+                            patience = max(patience, vp_state.total_train_batches * patience_increase)
+                        best_validate_acc = validate_acc
+                        best_iteration = vp_state.total_train_batches
+                        test_score = test_acc
 
             if updater.total_train_batches >= patience:
                 break
@@ -139,6 +144,8 @@ def train_policy_MNIST():
 
     reward_checker_type = RewardChecker.get_by_name(PolicyConfig['reward_checker'])
 
+    vp_validator = get_async_validator(MNISTModel, x_validate, y_validate, x_test, y_test)
+
     start_episode = 1 + PolicyConfig['start_episode']
     for episode in range(start_episode, start_episode + PolicyConfig['num_episodes']):
         start_new_episode(model, policy, episode)
@@ -149,7 +156,7 @@ def train_policy_MNIST():
         # To prevent the double validate point
         last_validate_point = -1
 
-        if Config['temp_job'] in RemainOrderJobs:
+        if remain_order():
             x_train_small, y_train_small = x_train, y_train
         else:
             # get small training data
@@ -164,7 +171,8 @@ def train_policy_MNIST():
             ParamConfig['epoch_per_episode'] * train_small_size
         )
 
-        updater = TrainPolicyUpdater(model, [x_train_small, y_train_small], policy)
+        updater = TrainPolicyUpdater(model, [x_train_small, y_train_small], policy, async_validator=vp_validator,
+                                     vp_scheduler=get_vp_scheduler(validation_frequency, reward_checker))
 
         best_validate_acc = -np.inf
         best_iteration = 0
@@ -181,20 +189,21 @@ def train_policy_MNIST():
 
                 if updater.total_train_batches > 0 and \
                         updater.total_train_batches != last_validate_point and \
-                        updater.total_train_batches % validation_frequency == 0:
+                        is_validation_point(updater, validation_frequency):
                     last_validate_point = updater.total_train_batches
-                    validate_acc, test_acc = validate_point_message(
+                    vp_results = validate_point_message(
                         model, x_train, y_train, x_validate, y_validate, x_test, y_test, updater, reward_checker,
                         run_test=PolicyConfig['run_test'],
                     )
-                    
-                    if validate_acc > best_validate_acc:
-                        # improve patience if loss improvement is good enough
-                        if (1. - validate_acc) < (1. - best_validate_acc) * improvement_threshold:
-                            patience = max(patience, updater.total_train_batches * patience_increase)
-                        best_validate_acc = validate_acc
-                        best_iteration = updater.total_train_batches
-                        test_score = test_acc
+
+                    for validate_acc, test_acc, vp_state in vp_results:
+                        if validate_acc > best_validate_acc:
+                            # improve patience if loss improvement is good enough
+                            if (1. - validate_acc) < (1. - best_validate_acc) * improvement_threshold:
+                                patience = max(patience, vp_state.total_train_batches * patience_increase)
+                            best_validate_acc = validate_acc
+                            best_iteration = vp_state.total_train_batches
+                            test_score = test_acc
 
                 if updater.total_train_batches >= patience:
                     break
@@ -206,6 +215,13 @@ def train_policy_MNIST():
                 message('Early Stop!')
                 break
 
+        # Wait for the asynchronous validation points
+        for validate_acc, test_acc, vp_state in wait_validation_points(updater):
+            if validate_acc > best_validate_acc:
+                best_validate_acc = validate_acc
+                best_iteration = vp_state.total_train_batches
+                test_score = test_acc
+
         episode_final_message(best_validate_acc, best_iteration, test_score, start_time)
 
         # Add a validation point at the final of the episode, related to last batches.
@@ -214,13 +230,21 @@ def train_policy_MNIST():
             run_test=PolicyConfig['run_test'],
             start_new_vp=False,
         )
+        wait_validation_points(updater)
         policy.update(reward_checker)
 
         if PolicyConfig['policy_save_freq'] > 0 and episode % PolicyConfig['policy_save_freq'] == 0:
             policy.save_policy(PolicyConfig['policy_save_file'], episode)
 
+    if vp_validator is not None:
+        vp_validator.close()
+
 
 def train_actor_critic_MNIST():
+    if PolicyConfig['AC_workers'] > 0:
+        train_actor_critic_parallel_MNIST()
+        return
+
     model = MNISTModel()
 
     # Create the policy network
@@ -232,13 +256,31 @@ def train_actor_critic_MNIST():
 
     critic = CriticNetwork(feature_size=input_size, batch_size=model.train_batch_size)
 
-    # Load the dataset and config
-    x_train, y_train, x_validate, y_validate, x_test, y_test, train_size, validate_size, test_size = pre_process_MNIST_data()
+    # Load the dataset
+    data = pre_process_MNIST_data()
+
+    run_actor_critic_MNIST(model, actor, data, partial(actor_critic_update, actor, critic))
+
+
+def run_actor_critic_MNIST(model, actor, data, update_AC, save_policy=True, worker_id=None, episode_end=None):
+    """The episodes of Actor-Critic.
+
+    See `run_actor_critic_CIFAR10` for the arguments.
+    """
+
+    # Load the config
+    x_train, y_train, x_validate, y_validate, x_test, y_test, train_size, validate_size, test_size = data
     patience, patience_increase, improvement_threshold, validation_frequency = pre_process_config(model, train_size)
 
+    transitions = DelayedTransitions(model, update_AC, MNISTModel, np.asarray(x_validate), np.asarray(y_validate),
+                                     use_async=worker_id is None)
+    vp_validator = get_async_validator(MNISTModel, x_validate, y_validate, x_test, y_test)
+
     # Train the network
     start_episode = 1 + PolicyConfig['start_episode']
     for episode in range(start_episode, start_episode + PolicyConfig['num_episodes']):
+        if worker_id is not None:
+            message('[Worker {}]'.format(worker_id))
         start_new_episode(model, actor, episode)
 
         # Train the network
@@ -248,7 +290,7 @@ def train_actor_critic_MNIST():
         last_validate_point = -1
         last_AC_update_point = -1
 
-        if Config['temp_job'] in RemainOrderJobs:
+        if remain_order():
             x_train_small, y_train_small = x_train, y_train
         else:
             # get small training data
@@ -256,7 +298,7 @@ def train_actor_critic_MNIST():
         train_small_size = len(x_train_small)
         message('Training small size:', train_small_size)
 
-        updater = ACUpdater(model, [x_train_small, y_train_small], actor)
+        updater = ACUpdater(model, [x_train_small, y_train_small], actor, async_validator=vp_validator)
 
         best_validate_acc = -np.inf
         best_iteration = 0
@@ -270,6 +312,7 @@ def train_actor_critic_MNIST():
 
             for _, train_index in kf:
                 part_train_cost = updater.add_batch(train_index)
+                transitions.add_new_state(updater.last_probability)
 
                 if updater.total_train_batches > 0 and \
                         updater.total_train_batches != last_AC_update_point and \
@@ -279,53 +322,32 @@ def train_actor_critic_MNIST():
                     # [NOTE]: The batch is the batch sent into updater, NOT the buffer's batch.
                     inputs = x_train_small[train_index]
                     targets = y_train_small[train_index]
-                    probability = updater.last_probability
-                    actions = updater.last_action
-
-                    # Get immediate reward
-                    valid_part_x, valid_part_y = get_part_data(
-                        np.asarray(x_validate), np.asarray(y_validate), PolicyConfig['immediate_reward_sample_size'])
-                    _, valid_acc, validate_batches = model.validate_or_test(valid_part_x, valid_part_y)
-                    imm_reward = valid_acc / validate_batches
-
-                    # Get new state, new actions, and compute new Q value
-                    probability_new = model.get_policy_input(inputs, targets, updater, updater.history_accuracy)
-                    actions_new = actor.take_action(probability_new, log_replay=False)
-
-                    Q_value_new = critic.Q_function(state=probability_new, action=actions_new)
-                    if epoch < ParamConfig['epoch_per_episode'] - 1:
-                        label = PolicyConfig['actor_gamma'] * Q_value_new + imm_reward
-                    else:
-                        label = imm_reward
-
-                    # Update the critic Q network
-                    Q_loss = critic.update(probability, actions, floatX(label))
-
-                    # Update actor network
-                    actor_loss = actor.update_raw(probability, actions,
-                                                  np.full(actions.shape, label, dtype=probability.dtype))
-
-                    if PolicyConfig['AC_update_freq'] >= ParamConfig['display_freq'] or \
-                       updater.total_train_batches % ParamConfig['display_freq'] == 0:
-                        message('E {} TB {} Cost {} Critic loss {:.6f} Actor loss {:.6f}'
-                                .format(epoch, updater.total_train_batches, part_train_cost,
-                                        float(Q_loss), float(actor_loss)))
+
+                    # The immediate reward is evaluated on the parameter snapshot (maybe asynchronously), and the new
+                    # state is the policy input of the next batch ("AC_async_reward") or of this batch after training.
+                    transitions.add(
+                        updater.total_train_batches, updater.last_probability, updater.last_action,
+                        epoch == ParamConfig['epoch_per_episode'] - 1,
+                        partial(model.get_policy_input, inputs, targets, updater, updater.history_accuracy))
+
+                display_AC_losses(transitions.update(), epoch, part_train_cost, ParamConfig['display_freq'])
 
                 if updater.total_train_batches > 0 and \
                         updater.total_train_batches != last_validate_point and \
                         updater.total_train_batches % validation_frequency == 0:
                     last_validate_point = updater.total_train_batches
 
-                    validate_acc, test_acc = validate_point_message(
+                    vp_results = validate_point_message(
                         model, x_train, y_train, x_validate, y_validate, x_test, y_test, updater)
-                    
-                    if validate_acc > best_validate_acc:
-                        # improve patience if loss improvement is good enough
-                        if (1. - validate_acc) < (1. - best_validate_acc) * improvement_threshold:
-                            patience = max(patience, updater.total_train_batches * patience_increase)
-                        best_validate_acc = validate_acc
-                        best_iteration = updater.total_train_batches
-                        test_score = test_acc
+
+                    for validate_acc, test_acc, vp_state in vp_results:
+                        if validate_acc > best_validate_acc:
+                            # improve patience if loss improvement is good enough
+                            if (1. - validate_acc) < (1. - best_validate_acc) * improvement_threshold:
+                                patience = max(patience, vp_state.total_train_batches * patience_increase)
+                            best_validate_acc = validate_acc
+                            best_iteration = vp_state.total_train_batches
+                            test_score = test_acc
 
                 if updater.total_train_batches >= patience:
                     break
@@ -336,11 +358,60 @@ def train_actor_critic_MNIST():
                 message('Early Stop!')
                 break
 
+        display_AC_losses(transitions.update(flush=True), epoch, part_train_cost, ParamConfig['display_freq'])
+
+        # Wait for the asynchronous validation points
+        for validate_acc, test_acc, vp_state in wait_validation_points(updater):
+            if validate_acc > best_validate_acc:
+                best_validate_acc = validate_acc
+                best_iteration = vp_state.total_train_batches
+                test_score = test_acc
+
         episode_final_message(best_validate_acc, best_iteration, test_score, start_time)
 
-        if PolicyConfig['policy_save_freq'] > 0 and episode % PolicyConfig['policy_save_freq'] == 0:
+        if save_policy and PolicyConfig['policy_save_freq'] > 0 and episode % PolicyConfig['policy_save_freq'] == 0:
             actor.save_policy(PolicyConfig['policy_save_file'], episode)
 
+        if episode_end is not None:
+            episode_end(episode)
+
+    transitions.close()
+    if vp_validator is not None:
+        vp_validator.close()
+
+
+def actor_critic_worker_MNIST(worker_id, transition_queue, shared_actor, data):
+    """The worker of parallel Actor-Critic, train its own classifier with the shared actor."""
+
+    model = MNISTModel()
+    actor = PolicyNetworkBase.get_by_name(PolicyConfig['policy_model_type'])(
+        input_size=MNISTModel.get_policy_input_size())
+
+    # Use a list to be modified in the closure.
+    actor_version = [shared_actor.pull(actor.parameters)]
+
+    def update_AC(state, action, imm_reward, state_new, terminal):
+        transition_queue.put(Transition(worker_id, state, action, imm_reward, state_new, terminal))
+        actor_version[0] = shared_actor.pull(actor.parameters, actor_version[0])
+
+    def episode_end(episode):
+        transition_queue.put(EpisodeEnd(worker_id, episode))
+
+    run_actor_critic_MNIST(model, actor, data, update_AC,
+                           save_policy=False, worker_id=worker_id, episode_end=episode_end)
+
+
+def train_actor_critic_parallel_MNIST():
+    # Load the dataset before forking the workers, so they can share it.
+    data = pre_process_MNIST_data()
+
+    run_parallel_actor_critic(
+        partial(actor_critic_worker_MNIST, data=data),
+        MNISTModel.get_policy_input_size(),
+        ParamConfig['train_batch_size'],
+        ParamConfig['display_freq'],
+    )
+
 
 def main():
     dataset_main({
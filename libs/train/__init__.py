@@ -1,11 +1,5 @@
 #! /usr/bin/python
 # -*- encoding: utf-8 -*-
 
-from . import CIFAR10, IMDB, MNIST
-
-
-__all__ = [
-    'CIFAR10',
-    'IMDB',
-    'MNIST',
-]
+# [NOTE] The train modules (CIFAR10, IMDB, MNIST) are not imported here,
+# `train.py` imports the module of the selected dataset only.
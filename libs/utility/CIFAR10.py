@@ -7,11 +7,13 @@ import os
 import numpy as np
 
 from config import CifarConfig as ParamConfig, Config
-from utils import f_open, floatX, fX, get_part_data
+from utils import f_open, floatX, fX, get_part_data, resident
 from my_logging import message, logging
+from resource_monitor import monitor_phase
 
 
 @logging
+@resident(lambda: (ParamConfig['data_dir'], ParamConfig['one_file'], Config['filter_data']))
 def load_cifar10_data(data_dir=None, one_file=None):
     """
 
@@ -166,6 +168,7 @@ def iterate_minibatches(inputs, targets, batch_size, shuffle=False, augment=Fals
             yield inp_exc, targets[excerpt]
 
 
+@monitor_phase('data_load')
 def pre_process_CIFAR10_data():
     # Load the dataset
     x_train, y_train, x_validate, y_validate, x_test, y_test = split_cifar10_data(load_cifar10_data())
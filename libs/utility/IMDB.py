@@ -7,11 +7,13 @@ import cPickle as pkl
 import numpy as np
 
 from config import IMDBConfig as ParamConfig, Config
-from utils import fX, get_minibatches_idx, get_part_data
+from utils import fX, get_minibatches_idx, get_part_data, resident
 from my_logging import logging, message
+from resource_monitor import monitor_phase
 
 
 @logging
+@resident(lambda: ParamConfig['data_dir'])
 def load_imdb_data(data_dir=None, n_words=100000, valid_portion=0.1, maxlen=None, sort_by_len=True):
     """Loads the dataset
 
@@ -210,6 +212,7 @@ def test():
     print(sum(train_y), sum(valid_y), sum(test_y))
     
 
+@monitor_phase('data_load')
 def pre_process_IMDB_data():
     # Loading data
     train_data, valid_data, test_data = load_imdb_data(n_words=ParamConfig['n_words'],
@@ -11,10 +11,12 @@ import theano
 import theano.tensor as T
 
 from config import Config, MNISTConfig as ParamConfig
-from utils import fX, get_part_data
+from utils import fX, get_part_data, resident
+from resource_monitor import monitor_phase
 from my_logging import message
 
 
+@resident(lambda: (ParamConfig['data_dir'], Config['filter_data']))
 def load_mnist_data(data_dir=None):
     """ Loads the dataset
 
@@ -98,6 +100,7 @@ def load_mnist_data(data_dir=None):
     return result
 
 
+@monitor_phase('data_load')
 def pre_process_MNIST_data():
     # Load the dataset
     x_train, y_train, x_validate, y_validate, x_test, y_test = load_mnist_data()
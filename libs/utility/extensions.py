@@ -5,39 +5,88 @@ from __future__ import print_function
 
 import numpy as np
 
+from config import Config
 from my_logging import message
 
 
+def _part_indices(part, data_size):
+    """Get the index array of a checked part.
+
+    Parameters
+    ----------
+    part: slice, array, or list
+        A slice, an index array, or a list of index ranges [start, stop] or a list of indices (in config).
+    data_size: int
+        The size of the data (to resolve slices).
+    """
+
+    if isinstance(part, slice):
+        return np.arange(*part.indices(data_size))
+    if isinstance(part, np.ndarray):
+        return part
+    if all(isinstance(item, (list, tuple)) for item in part):
+        return np.concatenate([np.arange(start, stop) for start, stop in part])
+    return np.asarray(part, dtype='int64')
+
+
+def _part_name(part):
+    if isinstance(part, slice):
+        return '{}:{}'.format(part.start, part.stop)
+    if not isinstance(part, np.ndarray) and all(isinstance(item, (list, tuple)) for item in part):
+        return ' + '.join('{}:{}'.format(start, stop) for start, stop in part)
+    return '{} indices'.format(len(part))
+
+
 class PartLossChecker(object):
     def __init__(self,
                  updater,
-                 check_parts=('range(20000, 30000)', 'range(0, 20000) + range(30000, 50000)'),
-                 check_per_epoch=2
+                 check_parts=None,
+                 check_per_epoch=None,
+                 batch_size=None,
                  ):
+        checker_config = Config['part_loss_checker']
+
         self.updater = updater
-        self.check_parts = check_parts
-        self.check_freq = self.updater.data_size // self.updater.batch_size // check_per_epoch
+        self.check_parts = [
+            (_part_name(part), _part_indices(part, updater.data_size))
+            for part in (check_parts if check_parts is not None else checker_config['check_parts'])
+        ]
+        self.batch_size = batch_size or checker_config['batch_size'] or updater.model.validate_batch_size
+
+        check_per_epoch = check_per_epoch or checker_config['check_per_epoch']
+        self.check_freq = max(self.updater.data_size // self.updater.batch_size // check_per_epoch, 1)
+
+    def part_losses_and_margins(self, indices):
+        """Get the losses and the margins (P(y) - max_{j != y} P(j)) of the part, in chunks of the batch size."""
+
+        model = self.updater.model
+        inputs, targets = self.updater.all_data
+
+        losses, margins = [], []
+        for start in range(0, len(indices), self.batch_size):
+            chunk = indices[start:start + self.batch_size]
+            chunk_targets = targets[chunk]
+
+            probabilities, chunk_losses = model.f_probs_and_losses(inputs[chunk], chunk_targets)
+
+            rows = np.arange(len(chunk))
+            target_probabilities = probabilities[rows, chunk_targets]
+            probabilities = probabilities.copy()
+            probabilities[rows, chunk_targets] = -np.inf
+
+            losses.append(chunk_losses)
+            margins.append(target_probabilities - probabilities.max(axis=1))
+
+        return np.concatenate(losses), np.concatenate(margins)
 
     def check(self):
         if self.updater.epoch_train_batches % self.check_freq == 0:
-            inputs, targets = self.updater.all_data
-
             message('Check point: epoch {} batch {}'.format(self.updater.epoch, self.updater.epoch_train_batches))
-            for check_part_str in self.check_parts:
-                check_part = eval(check_part_str)
-                losses = self.updater.model.f_cost_list_without_decay(
-                    *(data[check_part] for data in self.updater.all_data))
-
-                # Get margins
-                probabilities = self.updater.model.f_probs(inputs[check_part])
-                margins = np.zeros((len(check_part),))
-                for i, prob in enumerate(probabilities):
-                    margins[i] = prob[targets[check_part[i]]]
-                    prob[targets[check_part[i]]] = -np.inf
-                    margins[i] -= np.max(prob)
+            for part_name, indices in self.check_parts:
+                losses, margins = self.part_losses_and_margins(indices)
 
                 message('''\
     Part {}:
         Loss: mean={}, std={}
         Margin: mean={}, std={}
-'''.format(check_part_str, losses.mean(), losses.std(), margins.mean(), margins.std()))
+'''.format(part_name, losses.mean(), losses.std(), margins.mean(), margins.std()))
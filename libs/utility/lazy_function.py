@@ -0,0 +1,293 @@
+# -*- coding: utf-8 -*-
+
+"""Compile Theano functions on their first call, and cache the compiled functions on disk (or in memory).
+
+The cache (enabled by "function_cache") stores the pickled compiled functions in "{ModelPath}/function_cache".
+The key of a function is the hash of its graph (the debug print of outputs and updates),
+the shapes of its shared variables, some model configs, the Theano flags and the library versions,
+so a changed graph or environment is never loaded (the unused old entries are just left on disk).
+The unpickled function has its own copies of the shared variables,
+they are swapped with the shared variables of the current graph.
+In the daemon mode, the compiled functions are also kept in memory (with the same keys).
+
+The functions selected by "theano_profile.functions" are compiled with Theano op-level profiling (not cached),
+their aggregated per-op time tables are written to the log at the end of each episode (`profile_report`).
+"""
+
+from __future__ import print_function
+
+import cPickle as pkl
+import hashlib
+import os
+import sys
+import time
+import traceback
+from collections import OrderedDict
+
+from config import Config, ModelPath
+from my_logging import message
+
+# [name, compile time, loaded from cache] of all compiled lazy functions, in compile order
+_compiled_functions = []
+_reported_functions = 0
+
+# The in-memory cache of the daemon mode (None means disabled): key -> (function, shared positions)
+_memory_cache = None
+
+# [name, Theano profile, reported totals] of the profiled functions
+_profiles = []
+
+FunctionCachePath = os.path.join(ModelPath, 'function_cache')
+
+
+class LazyFunction(object):
+    """A Theano function which is compiled on its first call.
+
+    The arguments are the same as `theano.function`, the symbolic graph is built eagerly (it is cheap),
+    but the compilation is deferred, so the unused functions (for the given train type) are never compiled.
+    """
+
+    def __init__(self, inputs, outputs=None, name=None, **kwargs):
+        self.inputs = inputs
+        self.outputs = outputs
+        self.name = name
+        self.kwargs = kwargs
+
+        self.function = None
+
+    @property
+    def compiled(self):
+        return self.function is not None
+
+    def compile(self):
+        # [NOTE] Theano is imported here, so `utils` (which imports `compile_report`) does not depend on it.
+        import theano
+
+        if self.function is None:
+            start_time = time.time()
+
+            # [NOTE] The profiled functions are not cached (the profile is a part of the compiled function).
+            profile = None
+            if self.name in Config['theano_profile']['functions']:
+                profile = theano.compile.ProfileStats(atexit_print=False, message=self.name)
+                self.kwargs['profile'] = profile
+
+            use_cache = Config['function_cache'] and profile is None
+            memory_cache = _memory_cache if profile is None else None
+            if use_cache or memory_cache is not None:
+                variables = self._graph_variables()
+                shared_variables = _shared_variables(variables)
+                cache_key = self._cache_key(variables, shared_variables)
+                cache_file = os.path.join(FunctionCachePath, '{}.pkl'.format(cache_key))
+
+                if memory_cache is not None and cache_key in memory_cache:
+                    self.function = _bind_function(memory_cache[cache_key], shared_variables)
+                elif use_cache:
+                    self.function = _load_function(cache_file, shared_variables)
+
+            loaded = self.function is not None
+            if not loaded:
+                self.function = theano.function(self.inputs, self.outputs, name=self.name, **self.kwargs)
+                if use_cache:
+                    _save_function(cache_file, self.function, shared_variables)
+                if memory_cache is not None:
+                    memory_cache[cache_key] = self.function, _shared_positions(self.function, shared_variables)
+            compile_time = time.time() - start_time
+
+            if profile is not None:
+                _profiles.append([self.name, profile, {'calls': 0, 'time': 0.0, 'ops': {}}])
+
+            _compiled_functions.append([self.name, compile_time, loaded])
+            message('[{} function {} in {:.2f}s]'.format(
+                'Loaded' if loaded else 'Compiled', self.name, compile_time))
+
+            # Release the graph
+            self.inputs, self.outputs, self.kwargs = None, None, None
+        return self.function
+
+    def __call__(self, *args, **kwargs):
+        if self.function is None:
+            self.compile()
+        return self.function(*args, **kwargs)
+
+    def _graph_variables(self):
+        """All output variables of the graph (outputs, update targets and update values), in a fixed order."""
+
+        outputs = self.outputs
+        if outputs is None:
+            outputs = []
+        elif not isinstance(outputs, (list, tuple)):
+            outputs = [outputs]
+
+        updates = self.kwargs.get('updates', None) or []
+        if isinstance(updates, dict):
+            updates = list(updates.items())
+
+        variables = list(outputs)
+        for target, value in updates:
+            variables.extend([target, value])
+        return variables
+
+    def _cache_key(self, variables, shared_variables):
+        import theano
+
+        model_config = Config.get(Config['dataset'], {})
+
+        key_parts = [
+            self.name,
+            theano.printing.debugprint(variables, file='str') if variables else '',
+            [str(v.type) for v in self.inputs],
+            [v.get_value(borrow=True).shape for v in shared_variables],
+            sorted(self.kwargs.keys()),
+            [model_config.get(k, None) for k in ('n', 'model_name', 'train_batch_size', 'validate_batch_size',
+                                                 'optimizer')],
+            [theano.config.floatX, theano.config.device, theano.config.mode, theano.config.optimizer],
+            _library_versions(),
+        ]
+
+        return hashlib.sha1(repr(key_parts)).hexdigest()
+
+
+def _library_versions():
+    import lasagne
+    import numpy
+    import theano
+
+    return [sys.version, numpy.__version__, theano.__version__, lasagne.__version__]
+
+
+def _shared_variables(variables):
+    """The shared variables of the graph, in the (deterministic) traversal order."""
+
+    from theano.compile import SharedVariable
+    from theano.gof.graph import inputs
+
+    return list(OrderedDict.fromkeys(v for v in inputs(variables) if isinstance(v, SharedVariable)))
+
+
+def enable_memory_cache():
+    """Keep the compiled functions in memory (daemon mode), the same graphs of later jobs reuse them."""
+
+    global _memory_cache
+    if _memory_cache is None:
+        _memory_cache = {}
+
+
+def _shared_positions(function, shared_variables):
+    """The positions of the shared variables of the compiled function in `shared_variables`."""
+
+    position = {id(v): i for i, v in enumerate(shared_variables)}
+    return [position[id(i.variable)] for i in function.maker.inputs if i.implicit]
+
+
+def _bind_function(entry, shared_variables):
+    """Copy the cached function, and swap its shared variables with `shared_variables`."""
+
+    function, shared_positions = entry
+
+    old_shared_variables = [i.variable for i in function.maker.inputs if i.implicit]
+    if len(old_shared_variables) != len(shared_positions):
+        raise ValueError('Shared variables mismatch')
+
+    swap = {}
+    for old_variable, i in zip(old_shared_variables, shared_positions):
+        new_variable = shared_variables[i]
+        if old_variable.type != new_variable.type:
+            raise ValueError('Shared variable type mismatch: {} vs {}'.format(old_variable.type, new_variable.type))
+        swap[old_variable] = new_variable
+
+    return function.copy(swap=swap)
+
+
+def _save_function(cache_file, function, shared_variables):
+    """Save the compiled function, with the positions of its shared variables in `shared_variables`."""
+
+    try:
+        shared_positions = _shared_positions(function, shared_variables)
+
+        if not os.path.exists(FunctionCachePath):
+            os.makedirs(FunctionCachePath)
+
+        # Write and rename, the cache file is never partial (such as the job is preempted).
+        temp_file = '{}.{}.tmp'.format(cache_file, os.getpid())
+        with open(temp_file, 'wb') as f:
+            pkl.dump((function, shared_positions), f, pkl.HIGHEST_PROTOCOL)
+        os.rename(temp_file, cache_file)
+    except Exception:
+        message('[Cannot cache function {}]'.format(function.name))
+        message(traceback.format_exc())
+
+
+def _load_function(cache_file, shared_variables):
+    """Load the cached function and swap its shared variables. Return None if it is missing or invalid."""
+
+    if not os.path.exists(cache_file):
+        return None
+
+    try:
+        with open(cache_file, 'rb') as f:
+            entry = pkl.load(f)
+        return _bind_function(entry, shared_variables)
+    except Exception:
+        message('[Invalid cached function {}, removed]'.format(cache_file))
+        message(traceback.format_exc())
+        os.remove(cache_file)
+        return None
+
+
+def compile_report():
+    """Report the compiled functions and their compile time (if there are new compiled functions)."""
+
+    global _reported_functions
+
+    if len(_compiled_functions) == _reported_functions:
+        return
+    _reported_functions = len(_compiled_functions)
+
+    message('Compiled functions:')
+    for name, compile_time, loaded in _compiled_functions:
+        message('    {}: {:.2f}s{}'.format(name, compile_time, ' (cached)' if loaded else ''))
+    message('Total compile time: {:.2f}s'.format(sum(compile_time for _, compile_time, _ in _compiled_functions)))
+
+
+def profile_report(title):
+    """Report the per-function and per-op time of the profiled functions since the last report."""
+
+    if not _profiles:
+        return
+
+    n_ops = Config['theano_profile']['n_ops']
+
+    # Op name -> [time, calls, function names]
+    op_totals = {}
+
+    message('[Theano profile: {}]'.format(title))
+    message('{:<32}{:>10}{:>12}{:>12}'.format('Function', 'Calls', 'Time(s)', 'Op time(s)'))
+    for name, profile, reported in _profiles:
+        op_time, op_calls = profile.op_time(), profile.op_callcount()
+
+        function_op_time = 0.0
+        for op, total_time in op_time.iteritems():
+            key = str(op)
+            reported_time, reported_calls = reported['ops'].get(key, (0.0, 0))
+            reported['ops'][key] = total_time, op_calls[op]
+
+            entry = op_totals.setdefault(key, [0.0, 0, set()])
+            entry[0] += total_time - reported_time
+            entry[1] += op_calls[op] - reported_calls
+            entry[2].add(name)
+            function_op_time += total_time - reported_time
+
+        message('{:<32}{:>10}{:>12.3f}{:>12.3f}'.format(
+            name, profile.fct_callcount - reported['calls'], profile.fct_call_time - reported['time'],
+            function_op_time))
+        reported['calls'], reported['time'] = profile.fct_callcount, profile.fct_call_time
+
+    total_op_time = sum(entry[0] for entry in op_totals.itervalues())
+    message('Top {} ops (total op time {:.3f}s):'.format(n_ops, total_op_time))
+    message('{:>8}{:>12}{:>10}  {}'.format('%', 'Time(s)', 'Calls', 'Op <functions>'))
+    for key, (op_time, calls, names) in sorted(op_totals.iteritems(), key=lambda item: -item[1][0])[:n_ops]:
+        message('{:>8.1f}{:>12.3f}{:>10}  {} <{}>'.format(
+            100.0 * op_time / total_op_time if total_op_time > 0 else 0.0, op_time, calls, key,
+            ','.join(sorted(names))))
+    message('[Theano profile end]')
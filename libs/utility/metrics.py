@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+
+"""The buffered structured metrics sink.
+
+Typed events (batch loss, validation point stats, reward points, policy parameters) are recorded into
+an in-memory buffer, and a background thread flushes them to a JSON lines file next to the logging file
+("{logging file root}.metrics.jsonl", one compact JSON dict per line, such as
+{"t":1500000000.0,"e":"batch_loss","epoch":0,"batch":1,"loss":2.3}).
+The forked worker processes write their own files ("{logging file root}.{pid}.metrics.jsonl").
+
+The human-readable `message` lines are kept, "metrics.verbosity" and "metrics.batch_echo_freq" control
+the echo of the per-batch lines ("tL").
+"""
+
+from __future__ import print_function
+
+import json
+import os
+import threading
+import time
+
+from config import Config
+from my_logging import get_logging_file
+
+
+def _to_json(value):
+    # NumPy scalars and arrays
+    if hasattr(value, 'tolist'):
+        return value.tolist()
+    raise TypeError('{!r} is not JSON serializable'.format(value))
+
+
+class _Writer(object):
+    """The buffer and the background writer thread of a process."""
+
+    def __init__(self, filename):
+        self.pid = os.getpid()
+        self.filename = filename
+
+        self.buffer = []
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.stopped = False
+
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _run(self):
+        while not self.stopped:
+            self.wakeup.wait(Config['metrics']['flush_interval'])
+            self.wakeup.clear()
+            self.flush()
+
+    def add(self, event):
+        with self.lock:
+            self.buffer.append(event)
+            full = len(self.buffer) >= Config['metrics']['buffer_size']
+        if full:
+            self.wakeup.set()
+
+    def flush(self):
+        with self.lock:
+            events, self.buffer = self.buffer, []
+        if not events or self.filename is None:
+            return
+
+        with open(self.filename, 'a') as f:
+            f.write(''.join(json.dumps(event, separators=(',', ':'), default=_to_json) + '\n' for event in events))
+
+    def close(self):
+        self.stopped = True
+        self.wakeup.set()
+        self.thread.join()
+        self.flush()
+
+
+# The writer of the current job (None if not started)
+_writer = None
+
+# The pid of the process which started the first writer (the main process)
+_main_pid = None
+
+
+def enabled():
+    return Config['metrics']['enabled']
+
+
+def _metrics_filename():
+    filename = getattr(get_logging_file(), 'name', None)
+    if filename is None or filename.startswith('<'):
+        # Logging to stderr, do not write the metrics.
+        return None
+
+    root, _ = os.path.splitext(filename)
+    if os.getpid() != _main_pid:
+        root = '{}.{}'.format(root, os.getpid())
+    return root + '.metrics.jsonl'
+
+
+def _get_writer():
+    global _writer, _main_pid
+
+    if _main_pid is None:
+        _main_pid = os.getpid()
+
+    # [NOTE] In a forked worker, the writer (and its thread) of the parent does not work, create a new one.
+    if _writer is None or _writer.pid != os.getpid():
+        _writer = _Writer(_metrics_filename())
+    return _writer
+
+
+def record(event, **fields):
+    """Record an event (do nothing if metrics is not enabled)."""
+
+    if not enabled():
+        return
+
+    fields['t'] = time.time()
+    fields['e'] = event
+    _get_writer().add(fields)
+
+
+def echo_batch(batch_number):
+    """Should the per-batch line be echoed?"""
+
+    if not enabled():
+        return True
+
+    metrics_config = Config['metrics']
+    return metrics_config['verbosity'] >= 2 and metrics_config['batch_echo_freq'] > 0 and \
+        batch_number % metrics_config['batch_echo_freq'] == 0
+
+
+def close():
+    """Flush all recorded events and stop the writer (at the end of the job)."""
+
+    global _writer
+
+    if _writer is not None and _writer.pid == os.getpid():
+        _writer.close()
+    _writer = None
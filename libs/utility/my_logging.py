@@ -53,10 +53,15 @@ def init_logging_file(append=False, new=True):
 
 
 def finalize_logging_file():
+    global logging_file
+
     if logging_file != sys.stderr:
         logging_file.flush()
         logging_file.close()
 
+        # Later messages (e.g. of the next job in the daemon) go to stderr.
+        logging_file = sys.stderr
+
 
 def get_logging_file():
     global logging_file
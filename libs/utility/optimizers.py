@@ -5,6 +5,7 @@ from __future__ import print_function
 import theano
 import theano.tensor as T
 
+from lazy_function import LazyFunction
 from utils import floatX
 
 
@@ -43,14 +44,15 @@ def adadelta(learning_rate, parameters, grads, inputs, cost):
     zg_up = [(zg, g) for zg, g in zip(zipped_grads, grads)]
     rg2_up = [(rg2, 0.95 * rg2 + 0.05 * (g ** 2)) for rg2, g in zip(running_grads2, grads)]
 
-    f_grad_shared = theano.function(inputs, cost, updates=zg_up + rg2_up, profile=False)
+    f_grad_shared = LazyFunction(inputs, cost, name='f_grad_shared', updates=zg_up + rg2_up, profile=False)
 
     updir = [-T.sqrt(ru2 + 1e-6) / T.sqrt(rg2 + 1e-6) * zg for zg, ru2, rg2 in
              zip(zipped_grads, running_up2, running_grads2)]
     ru2_up = [(ru2, 0.95 * ru2 + 0.05 * (ud ** 2)) for ru2, ud in zip(running_up2, updir)]
     param_up = [(p, p + ud) for p, ud in zip(parameters.itervalues(), updir)]
 
-    f_update = theano.function([learning_rate], [], updates=ru2_up + param_up, on_unused_input='ignore', profile=False)
+    f_update = LazyFunction([learning_rate], [], name='f_update',
+                            updates=ru2_up + param_up, on_unused_input='ignore', profile=False)
 
     return f_grad_shared, f_update
 
@@ -73,13 +75,14 @@ def rmsprop(learning_rate, parameters, grads, inputs, cost):
     rg_up = [(rg, 0.95 * rg + 0.05 * g) for rg, g in zip(running_grads, grads)]
     rg2_up = [(rg2, 0.95 * rg2 + 0.05 * (g ** 2)) for rg2, g in zip(running_grads2, grads)]
 
-    f_grad_shared = theano.function(inputs, cost, updates=zg_up + rg_up + rg2_up, profile=False)
+    f_grad_shared = LazyFunction(inputs, cost, name='f_grad_shared', updates=zg_up + rg_up + rg2_up, profile=False)
 
     updir = [theano.shared(p.get_value() * floatX(0.), name='%s_updir' % k) for k, p in parameters.iteritems()]
     updir_new = [(ud, 0.9 * ud - 1e-4 * zg / T.sqrt(rg2 - rg ** 2 + 1e-4)) for ud, zg, rg, rg2 in
                  zip(updir, zipped_grads, running_grads, running_grads2)]
     param_up = [(p, p + udn[1]) for p, udn in zip(parameters.itervalues(), updir_new)]
-    f_update = theano.function([learning_rate], [], updates=updir_new + param_up, on_unused_input='ignore', profile=False)
+    f_update = LazyFunction([learning_rate], [], name='f_update',
+                            updates=updir_new + param_up, on_unused_input='ignore', profile=False)
 
     return f_grad_shared, f_update
 
@@ -91,7 +94,7 @@ def adam(learning_rate, parameters, grads, inputs, cost):
     g_shared = [theano.shared(p.get_value() * floatX(0.), name='%s_grad' % k) for k, p in parameters.iteritems()]
     gs_up = [(gs, g) for gs, g in zip(g_shared, grads)]
 
-    f_grad_shared = theano.function(inputs, cost, updates=gs_up)
+    f_grad_shared = LazyFunction(inputs, cost, name='f_grad_shared', updates=gs_up)
     lr0 = learning_rate
     b1 = 0.1
     b2 = 0.001
@@ -115,7 +118,8 @@ def adam(learning_rate, parameters, grads, inputs, cost):
         updates.append((p, p_t))
     updates.append((i, i_t))
 
-    f_update = theano.function([learning_rate], [], updates=updates, on_unused_input='ignore')
+    f_update = LazyFunction([learning_rate], [], name='f_update',
+                            updates=updates, on_unused_input='ignore')
 
     return f_grad_shared, f_update
 
@@ -125,10 +129,11 @@ def sgd(learning_rate, parameters, grads, inputs, cost):
     g_shared = [theano.shared(p.get_value() * floatX(0.), name='%s_grad' % k) for k, p in parameters.iteritems()]
     gs_up = [(gs, g) for gs, g in zip(g_shared, grads)]
 
-    f_grad_shared = theano.function(inputs, cost, updates=gs_up, profile=False)
+    f_grad_shared = LazyFunction(inputs, cost, name='f_grad_shared', updates=gs_up, profile=False)
 
     p_up = [(p, p - learning_rate * g) for p, g in zip(parameters.itervalues(), g_shared)]
-    f_update = theano.function([learning_rate], [], updates=p_up, profile=False)
+    f_update = LazyFunction([learning_rate], [], name='f_update',
+                            updates=p_up, profile=False)
 
     return f_grad_shared, f_update
 
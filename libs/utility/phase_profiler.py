@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+
+"""The hierarchical phase profiler of the training hot path.
+
+The time and call count of each phase (index batching, gather, data preparation (augmentation or padding),
+policy input, policy action, `f_train`, validation and logging) are accumulated per epoch and per episode.
+Phases can be nested, a nested phase is reported under its parent (e.g. "train/f_train").
+
+Enable it by "phase_profiler" in config, the breakdown tables are printed at the end of each epoch and episode.
+When disabled, `phase` returns a shared no-op context manager.
+"""
+
+from __future__ import print_function
+
+import time
+from functools import wraps
+
+from config import Config
+from my_logging import message
+
+# The current phase path
+_stack = []
+
+# The accumulators of each scope: {scope: {path: [time, calls]}}, and the start time of each scope.
+_tables = {'epoch': {}, 'episode': {}}
+_start_times = {'epoch': time.time(), 'episode': time.time()}
+
+
+def enabled():
+    return Config['phase_profiler']
+
+
+class _Phase(object):
+    __slots__ = ('name', 'start_time')
+
+    def __init__(self, name):
+        self.name = name
+        self.start_time = None
+
+    def __enter__(self):
+        _stack.append(self.name)
+        self.start_time = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        elapsed = time.time() - self.start_time
+        path = tuple(_stack)
+        _stack.pop()
+
+        for table in _tables.itervalues():
+            entry = table.get(path)
+            if entry is None:
+                table[path] = [elapsed, 1]
+            else:
+                entry[0] += elapsed
+                entry[1] += 1
+        return False
+
+
+class _NullPhase(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+_null_phase = _NullPhase()
+
+
+def phase(name):
+    """The context manager of a phase.
+
+    Examples
+    --------
+    >>> with phase('f_train'):
+    ...     cost = model.f_train(*inputs)
+    """
+
+    if not Config['phase_profiler']:
+        return _null_phase
+    return _Phase(name)
+
+
+def profile_phase(name):
+    """The decorator version of `phase`."""
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with phase(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def phase_totals(scope):
+    """Get the accumulated {phase path: (time, calls)} of the scope ('epoch' or 'episode')."""
+    return {path: tuple(entry) for path, entry in _tables[scope].items()}
+
+
+def reset_phases(scope):
+    """Reset the accumulators of the scope ('epoch' or 'episode')."""
+
+    _tables[scope].clear()
+    _start_times[scope] = time.time()
+
+
+def phase_report(scope, title):
+    """Print the breakdown table of the scope ('epoch' or 'episode'), then reset it."""
+
+    if not enabled():
+        return
+
+    table = _tables[scope]
+    wall_time = time.time() - _start_times[scope]
+
+    message('[Phase profile: {}]'.format(title))
+    message('{:<36}{:>12}{:>10}{:>12}{:>9}'.format('Phase', 'Time(s)', 'Calls', 'Avg(ms)', '%Wall'))
+
+    for path in sorted(table):
+        total_time, calls = table[path]
+        message('{:<36}{:>12.3f}{:>10}{:>12.3f}{:>9.1f}'.format(
+            '  ' * (len(path) - 1) + path[-1], total_time, calls, 1000.0 * total_time / calls,
+            100.0 * total_time / wall_time if wall_time > 0 else 0.0))
+
+    untracked_time = wall_time - sum(entry[0] for path, entry in table.iteritems() if len(path) == 1)
+    message('{:<36}{:>12.3f}{:>10}{:>12}{:>9.1f}'.format(
+        '(untracked)', untracked_time, '', '', 100.0 * untracked_time / wall_time if wall_time > 0 else 0.0))
+    message('{:<36}{:>12.3f}'.format('(wall)', wall_time))
+    message('[Phase profile end]')
+
+    reset_phases(scope)
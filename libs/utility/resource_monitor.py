@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+
+"""The resource usage monitor.
+
+A background thread samples the RSS, CPU utilization and thread count of the process per "interval" seconds,
+and attributes them to the current phase ("data_load", "epoch", "validation", "policy_update", ...).
+The per-phase peaks are accumulated per validation point and per episode (two scopes, 'vp' and 'episode'),
+and logged (then reset) at each validation point and each episode end respectively.
+
+If the RSS exceeds the soft memory limit ("memory_limit" MB), a warning and the largest live NumPy arrays
+are logged (once per summary period).
+
+[NOTE] Only the main process is monitored, and the RSS is read from "/proc/self/status" (Linux),
+on other platforms the peak RSS (`getrusage`) is used.
+"""
+
+from __future__ import print_function
+
+import gc
+import os
+import resource
+import sys
+import threading
+import time
+from functools import wraps
+
+import numpy as np
+
+from config import Config
+from my_logging import message
+
+# The current phase
+_current_phase = 'other'
+
+# The monitor of the current job (None if not started)
+_monitor = None
+
+_MB = 2.0 ** 20
+
+
+def _read_usage():
+    """Get the RSS (bytes) and the thread count."""
+
+    rss, threads = None, None
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    rss = int(line.split()[1]) * 1024
+                elif line.startswith('Threads:'):
+                    threads = int(line.split()[1])
+    except IOError:
+        pass
+
+    if rss is None:
+        # The peak RSS, KB on Linux and bytes on macOS.
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if not sys.platform.startswith('darwin'):
+            rss *= 1024
+    if threads is None:
+        threads = threading.active_count()
+    return rss, threads
+
+
+def _cpu_time():
+    times = os.times()
+    return times[0] + times[1]
+
+
+def largest_arrays(n):
+    """Get the largest live NumPy arrays (which own their memory), found by the referents of GC objects.
+
+    Returns
+    -------
+    list of (nbytes, shape, dtype, the type name of the referrer), in descending order of nbytes.
+    """
+
+    arrays = {}
+    for obj in gc.get_objects():
+        for referent in gc.get_referents(obj):
+            if isinstance(referent, np.ndarray) and not isinstance(referent.base, np.ndarray) and \
+                    id(referent) not in arrays:
+                arrays[id(referent)] = referent.nbytes, referent.shape, referent.dtype, type(obj).__name__
+    return sorted(arrays.itervalues(), key=lambda array: -array[0])[:n]
+
+
+class _Monitor(object):
+    def __init__(self, interval):
+        self.pid = os.getpid()
+        self.interval = interval
+
+        self.lock = threading.Lock()
+
+        # The stats of the current period of each scope: {scope: {phase: [samples, peak RSS, CPU sum, peak CPU,
+        # max threads]}}
+        self.periods = {'vp': {}, 'episode': {}}
+        # The peak RSS of the job and its phase
+        self.peak_rss, self.peak_phase = 0, None
+        # Warned the memory limit in the current summary period?
+        self.warned = False
+
+        self.last_time, self.last_cpu_time = time.time(), _cpu_time()
+
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            self.sample()
+
+    def sample(self):
+        rss, threads = _read_usage()
+        phase = _current_phase
+
+        with self.lock:
+            now, cpu_time = time.time(), _cpu_time()
+            cpu = 100.0 * (cpu_time - self.last_cpu_time) / max(now - self.last_time, 1e-6)
+            self.last_time, self.last_cpu_time = now, cpu_time
+
+            for period in self.periods.itervalues():
+                stats = period.setdefault(phase, [0, 0, 0.0, 0.0, 0])
+                stats[0] += 1
+                stats[1] = max(stats[1], rss)
+                stats[2] += cpu
+                stats[3] = max(stats[3], cpu)
+                stats[4] = max(stats[4], threads)
+
+            if rss > self.peak_rss:
+                self.peak_rss, self.peak_phase = rss, phase
+
+            memory_limit = Config['resource_monitor']['memory_limit']
+            over_limit = memory_limit is not None and rss > memory_limit * _MB and not self.warned
+            if over_limit:
+                self.warned = True
+
+        if over_limit:
+            message('[WARNING] RSS {:.1f} MB exceeds the soft memory limit {} MB (in phase {})'.format(
+                rss / _MB, memory_limit, phase))
+            message('Largest live arrays:')
+            for nbytes, shape, dtype, referrer in largest_arrays(Config['resource_monitor']['n_arrays']):
+                message('    {:>10.1f} MB  {} {} (in {})'.format(nbytes / _MB, dtype, shape, referrer))
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+
+def running():
+    return _monitor is not None and _monitor.pid == os.getpid()
+
+
+def start():
+    """Start the monitor (if enabled)."""
+
+    global _monitor
+
+    if not Config['resource_monitor']['enabled'] or running():
+        return
+    _monitor = _Monitor(Config['resource_monitor']['interval'])
+
+
+def stop():
+    global _monitor
+
+    if running():
+        _monitor.stop()
+    _monitor = None
+
+
+def set_phase(name):
+    global _current_phase
+    _current_phase = name
+
+
+class _Phase(object):
+    def __init__(self, name):
+        self.name = name
+        self.saved_phase = None
+
+    def __enter__(self):
+        self.saved_phase = _current_phase
+        set_phase(self.name)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        set_phase(self.saved_phase)
+        return False
+
+
+def resource_phase(name):
+    """The context manager of a phase (the previous phase is restored at exit)."""
+    return _Phase(name)
+
+
+def monitor_phase(name):
+    """The decorator version of `resource_phase`."""
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with _Phase(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def resource_summary(title, scope='vp'):
+    """Log the per-phase usage of the current period of the scope ('vp' or 'episode'),
+    then start a new period of the scope.
+    """
+
+    if not running():
+        return
+
+    monitor = _monitor
+    monitor.sample()
+
+    with monitor.lock:
+        period, monitor.periods[scope] = monitor.periods[scope], {}
+        monitor.warned = False
+
+    message('[Resource usage: {}]'.format(title))
+    message('{:<16}{:>10}{:>14}{:>10}{:>11}{:>9}'.format(
+        'Phase', 'Samples', 'Peak RSS(MB)', 'Avg CPU%', 'Peak CPU%', 'Threads'))
+    for phase in sorted(period):
+        samples, peak_rss, cpu_sum, peak_cpu, max_threads = period[phase]
+        message('{:<16}{:>10}{:>14.1f}{:>10.1f}{:>11.1f}{:>9}'.format(
+            phase, samples, peak_rss / _MB, cpu_sum / samples, peak_cpu, max_threads))
+    message('Peak RSS of the job: {:.1f} MB (in phase {})'.format(monitor.peak_rss / _MB, monitor.peak_phase))
+    message('[Resource usage end]')
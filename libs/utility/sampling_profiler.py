@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+
+"""The on-demand sampling profiler.
+
+A background thread samples the Python stack of the main thread at a fixed interval ("interval" seconds),
+and counts the collapsed stacks ("file:function;file:function;..."). At the end of a profiling window, the
+counts are written to "{logging file root}.profile{N}.collapsed" (one "stack count" line per stack), which can
+be read by flamegraph tools directly (e.g. `flamegraph.pl x.collapsed > x.svg`, or speedscope).
+The forked worker processes write their own files ("{logging file root}.{pid}.profile{N}.collapsed").
+
+A window is started and stopped:
+    by signal: send SIGUSR2 to the process (`kill -USR2 <pid>`) to start a window, send it again to stop it.
+        The worker processes inherit the signal handler, so they can be profiled in the same way.
+    by config: start at the epoch "start_epoch" of the episode "start_episode" (null means any),
+        and stop after "epochs" epochs.
+"""
+
+from __future__ import print_function
+
+import os
+import signal
+import sys
+import threading
+import time
+
+from config import Config, LogPath
+from my_logging import message, get_logging_file
+
+# The sampler of the current window (None if not running)
+_sampler = None
+
+# The pid of the process which installed the profiler (the main process)
+_main_pid = None
+
+# Number of windows of this process
+_window_number = 0
+
+# The current episode (None in the jobs without episodes)
+_episode = None
+
+
+def _collapse(frame):
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append('{}:{}'.format(os.path.basename(code.co_filename), code.co_name))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class _Sampler(object):
+    def __init__(self, interval, epochs=None):
+        self.pid = os.getpid()
+        self.thread_id = threading.current_thread().ident
+        self.interval = interval
+
+        # The remaining epochs of the window (None means until stopped)
+        self.epochs = epochs
+
+        self.counts = {}
+        self.samples = 0
+        self.start_time = time.time()
+
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = _collapse(frame)
+            del frame
+
+            self.counts[stack] = self.counts.get(stack, 0) + 1
+            self.samples += 1
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+
+def _profile_filename(window_number):
+    filename = getattr(get_logging_file(), 'name', None)
+    if filename is None or filename.startswith('<'):
+        root = os.path.join(LogPath, 'sampling_profile')
+    else:
+        root, _ = os.path.splitext(filename)
+
+    if os.getpid() != _main_pid:
+        root = '{}.{}'.format(root, os.getpid())
+    return '{}.profile{}.collapsed'.format(root, window_number)
+
+
+def _write_profile(sampler):
+    global _window_number
+
+    _window_number += 1
+    filename = _profile_filename(_window_number)
+    with open(filename, 'w') as f:
+        for stack, count in sorted(sampler.counts.iteritems()):
+            f.write('{} {}\n'.format(stack, count))
+
+    message('[Sampling profiler: {} samples in {:.2f}s, written to {}]'.format(
+        sampler.samples, time.time() - sampler.start_time, filename))
+
+    # The top functions (by self samples)
+    self_counts = {}
+    for stack, count in sampler.counts.iteritems():
+        leaf = stack.rsplit(';', 1)[-1]
+        self_counts[leaf] = self_counts.get(leaf, 0) + count
+    for leaf, count in sorted(self_counts.iteritems(), key=lambda item: -item[1])[:10]:
+        message('{:>8.1f}%  {}'.format(100.0 * count / max(sampler.samples, 1), leaf))
+
+
+def running():
+    return _sampler is not None and _sampler.pid == os.getpid()
+
+
+def start(epochs=None):
+    """Start a profiling window (do nothing if it is running).
+
+    Parameters
+    ----------
+    epochs: int or None
+        Stop after the given number of epochs, None means until `stop` is called.
+    """
+
+    global _sampler
+
+    if running():
+        return
+
+    # [NOTE] The sampler of the parent (forked while profiling) does not work in the worker, drop it.
+    _sampler = _Sampler(Config['sampling_profiler']['interval'], epochs)
+    message('[Sampling profiler started]')
+
+
+def stop():
+    """Stop the profiling window and write the profile."""
+
+    global _sampler
+
+    if not running():
+        _sampler = None
+        return
+
+    sampler, _sampler = _sampler, None
+    sampler.stop()
+    _write_profile(sampler)
+
+
+def _on_signal(signum, frame):
+    if running():
+        stop()
+    else:
+        start()
+
+
+def install():
+    """Install the signal handler (in the main process, before the workers are forked)."""
+
+    global _main_pid
+
+    _main_pid = os.getpid()
+
+    # [NOTE] SIGUSR2 is not available on Windows.
+    if Config['sampling_profiler']['signal'] and hasattr(signal, 'SIGUSR2'):
+        signal.signal(signal.SIGUSR2, _on_signal)
+
+
+def _epoch_end():
+    if running() and _sampler.epochs is not None:
+        _sampler.epochs -= 1
+        if _sampler.epochs <= 0:
+            stop()
+
+
+def new_episode(episode):
+    global _episode
+    _episode = episode
+
+
+def new_epoch(epoch):
+    """Check the config window at the start of each epoch."""
+
+    if epoch > 0:
+        _epoch_end()
+
+    profiler_config = Config['sampling_profiler']
+    start_episode, start_epoch = profiler_config['start_episode'], profiler_config['start_epoch']
+    if start_episode is None and start_epoch is None:
+        return
+
+    if (start_episode is None or start_episode == _episode) and epoch == (start_epoch or 0):
+        start(profiler_config['epochs'])
+
+
+def episode_end():
+    _epoch_end()
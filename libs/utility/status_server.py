@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+
+"""The live status endpoint of the running job.
+
+An HTTP server (in a background thread of the training process) serves the current status as JSON on "GET /":
+the episode, epoch, iteration, samples per second, accepted ratio (total accepted cases / total seen cases),
+the last validation point results, the reward checker state and the phase timings (if "phase_profiler" is set).
+
+It listens on "{host}:{port}" (port 0 means a free port), or on the Unix domain socket
+"{logging file root}.status.sock" if "unix_socket" is set. The address is logged at the start of the job, e.g.:
+    $ curl http://127.0.0.1:12345/
+    $ curl --unix-socket log/cifar10/log-cifar10-raw-Job01.status.sock http://localhost/
+"""
+
+from __future__ import print_function
+
+import BaseHTTPServer
+import SocketServer
+import json
+import os
+import socket
+import threading
+import time
+
+from config import Config, LogPath
+from my_logging import message, get_logging_file
+from phase_profiler import phase_totals
+
+# The plain status values (updated by the training process)
+_state = {}
+
+# The tracked objects, read at each request
+_updater = None
+_reward_checker = None
+
+# The time when the current updater is tracked
+_updater_start_time = None
+
+# The server of the current job (None if not started)
+_server = None
+
+
+def update(**kwargs):
+    """Update the status values."""
+    _state.update(kwargs)
+
+
+def track(updater=None, reward_checker=None):
+    """Track the updater and the reward checker (their state is read at each request)."""
+
+    global _updater, _reward_checker, _updater_start_time
+
+    if updater is not None and updater is not _updater:
+        _updater = updater
+        _updater_start_time = time.time()
+    if reward_checker is not None:
+        _reward_checker = reward_checker
+
+
+def get_status():
+    status = dict(_state)
+    status['pid'] = os.getpid()
+    status['job_name'] = Config['job_name']
+    status['time'] = time.time()
+
+    updater = _updater
+    if updater is not None:
+        seen_cases, accepted_cases = updater.total_seen_cases, updater.total_accepted_cases
+        elapsed_time = time.time() - _updater_start_time
+        status.update({
+            'epoch': updater.epoch,
+            'iteration': updater.iteration,
+            'total_train_batches': updater.total_train_batches,
+            'total_seen_cases': seen_cases,
+            'total_accepted_cases': accepted_cases,
+            'accepted_ratio': float(accepted_cases) / seen_cases if seen_cases > 0 else None,
+            'samples_per_second': seen_cases / elapsed_time if elapsed_time > 0 else None,
+        })
+
+    reward_checker = _reward_checker
+    if reward_checker is not None:
+        status['reward_checker'] = {
+            'type': type(reward_checker).__name__,
+            'state': reward_checker.state(),
+        }
+
+    if Config['phase_profiler']:
+        status['phases'] = {
+            '/'.join(path): {'time': total_time, 'calls': calls}
+            for path, (total_time, calls) in phase_totals('episode').iteritems()
+        }
+
+    return status
+
+
+def _to_json(value):
+    # NumPy scalars and arrays
+    if hasattr(value, 'tolist'):
+        return value.tolist()
+    return str(value)
+
+
+class _StatusHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/status'):
+            self.send_error(404)
+            return
+
+        body = json.dumps(get_status(), default=_to_json, sort_keys=True)
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        # The client address of the Unix domain socket is empty.
+        return str(self.client_address[0]) if self.client_address else 'local'
+
+    def log_message(self, format_, *args):
+        # Do not write the access log into the job log.
+        pass
+
+
+class _TCPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class _UnixServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    address_family = socket.AF_UNIX
+
+    def server_bind(self):
+        # [NOTE] `HTTPServer.server_bind` gets the (host, port) of the socket, skip it.
+        SocketServer.TCPServer.server_bind(self)
+        self.server_name, self.server_port = 'localhost', 0
+
+
+def _socket_path():
+    filename = getattr(get_logging_file(), 'name', None)
+    if filename is None or filename.startswith('<'):
+        root = os.path.join(LogPath, 'train-{}'.format(os.getpid()))
+    else:
+        root, _ = os.path.splitext(filename)
+    return root + '.status.sock'
+
+
+def start():
+    """Start the server (if enabled)."""
+
+    global _server
+
+    server_config = Config['status_server']
+    if not server_config['enabled'] or _server is not None:
+        return
+
+    try:
+        if server_config['unix_socket']:
+            address = _socket_path()
+            if os.path.exists(address):
+                os.remove(address)
+            _server = _UnixServer(address, _StatusHandler)
+            message('[Status server listening on {}]'.format(address))
+        else:
+            _server = _TCPServer((server_config['host'], server_config['port']), _StatusHandler)
+            message('[Status server listening on http://{}:{}/]'.format(*_server.server_address[:2]))
+    except (socket.error, OSError) as e:
+        message('[WARNING] Cannot start the status server: {}'.format(e))
+        _server = None
+        return
+
+    thread = threading.Thread(target=_server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+
+def stop():
+    global _server, _updater, _reward_checker
+
+    if _server is not None:
+        _server.shutdown()
+        _server.server_close()
+        if _server.address_family == socket.AF_UNIX and os.path.exists(_server.server_address):
+            os.remove(_server.server_address)
+        _server = None
+
+    _state.clear()
+    _updater, _reward_checker = None, None
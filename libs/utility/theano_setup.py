@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+
+"""Set the Theano backend and BLAS settings (the "theano" config section) before Theano is imported.
+
+Settings:
+    openmp: bool or None
+        The Theano "openmp" flag (None means Theano default).
+    blas_threads: int or None
+        The thread count of BLAS and OpenMP ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS").
+    conv: str or None
+        The CPU convolution implementation, "corrmm" (the GEMM-based one, Theano default) or "legacy".
+
+If "autotune" is set (or `--autotune` is given), each candidate setting is benchmarked (see `libs/autotune.py`)
+in a new process on the actual model graph, the fastest one is cached per host (and model) and used.
+"""
+
+from __future__ import print_function
+
+import hashlib
+import itertools
+import json
+import os
+import platform
+import subprocess
+import sys
+
+from config import Config, ModelPath, ProjectRootPath
+from my_logging import message
+
+SettingNames = ['openmp', 'blas_threads', 'conv']
+AutotuneCacheFile = os.path.join(ModelPath, 'autotune.json')
+
+# The model configs used as the autotune cache key.
+_ModelConfigKeys = ['model_name', 'n', 'hidden_size', 'dim_proj', 'n_words', 'maxlen',
+                    'train_batch_size', 'validate_batch_size', 'optimizer']
+
+
+def settings_env(settings, base_env=None):
+    """Get the environment variables of the settings."""
+
+    env = dict(os.environ if base_env is None else base_env)
+
+    flags = ['floatX={}'.format(Config['floatX'])]
+    if settings.get('openmp') is not None:
+        flags.append('openmp={}'.format(bool(settings['openmp'])))
+    if settings.get('conv') == 'legacy':
+        flags.append('optimizer_excluding=conv_gemm')
+    if Config['theano']['flags']:
+        flags.append(Config['theano']['flags'])
+
+    # The flags set by the user environment come last (they win).
+    if env.get('THEANO_FLAGS'):
+        flags.append(env['THEANO_FLAGS'])
+    env['THEANO_FLAGS'] = ','.join(flags)
+
+    if settings.get('blas_threads'):
+        for key in ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS'):
+            env[key] = str(settings['blas_threads'])
+
+    return env
+
+
+def _autotune_key(dataset, param_config):
+    theano_config = Config['theano']
+    key = json.dumps([
+        dataset,
+        [param_config.get(k, None) for k in _ModelConfigKeys],
+        Config['floatX'],
+        theano_config['flags'],
+        theano_config['autotune_candidates'],
+        theano_config['autotune_iterations'],
+    ], sort_keys=True)
+    return '{}-{}-{}'.format(platform.node(), dataset, hashlib.sha1(key).hexdigest()[:12])
+
+
+def _load_autotune_cache():
+    if not os.path.exists(AutotuneCacheFile):
+        return {}
+    with open(AutotuneCacheFile, 'r') as f:
+        return json.load(f)
+
+
+def _save_autotune_cache(cache):
+    if not os.path.exists(ModelPath):
+        os.makedirs(ModelPath)
+
+    temp_file = '{}.{}.tmp'.format(AutotuneCacheFile, os.getpid())
+    with open(temp_file, 'w') as f:
+        json.dump(cache, f, indent=1, sort_keys=True)
+    os.rename(temp_file, AutotuneCacheFile)
+
+
+def benchmark_settings(dataset, param_config, settings):
+    """Benchmark the settings in a new process.
+
+    Returns
+    -------
+    The time (seconds) per train batch, or None if failed (the traceback of the process is logged).
+    """
+
+    job = json.dumps({
+        'dataset': dataset,
+        'config': param_config,
+        'iterations': Config['theano']['autotune_iterations'],
+    })
+
+    process = subprocess.Popen([sys.executable, '-m', 'libs.autotune'], cwd=ProjectRootPath,
+                               env=settings_env(settings), stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE)
+    output, error = process.communicate(job)
+
+    if process.returncode != 0 or not output.strip():
+        # Log the traceback (the end of the error output, the compilation warnings before it are skipped).
+        traceback_start = error.rfind('Traceback (most recent call last)')
+        message('Autotune {} failed (exit status {}):\n{}'.format(
+            json.dumps(settings, sort_keys=True), process.returncode,
+            error[traceback_start:] if traceback_start >= 0 else error[-2000:]))
+        return None
+    return float(output.strip().split()[-1])
+
+
+def autotune(dataset, param_config):
+    """Find the fastest settings of the candidates."""
+
+    candidates = Config['theano']['autotune_candidates']
+    names = [name for name in SettingNames if name in candidates]
+
+    results = []
+    for values in itertools.product(*[candidates[name] for name in names]):
+        settings = dict(zip(names, values))
+        batch_time = benchmark_settings(dataset, param_config, settings)
+        message('Autotune {}: {}'.format(
+            json.dumps(settings, sort_keys=True), 'failed' if batch_time is None else '{:.6f}s'.format(batch_time)))
+        if batch_time is not None:
+            results.append((batch_time, settings))
+
+    if not results:
+        return None, None
+    return min(results, key=lambda result: result[0])
+
+
+def setup_theano(dataset, param_config, autotune_now=False):
+    """Apply the Theano settings (in the pre-train message block).
+
+    Parameters
+    ----------
+    dataset: str
+    param_config: dict
+        The config of the dataset.
+    autotune_now: bool
+        Run the autotune even if it is not set in config.
+    """
+
+    theano_config = Config['theano']
+    settings = {name: theano_config[name] for name in SettingNames}
+
+    if theano_config['autotune'] or autotune_now:
+        key = _autotune_key(dataset, param_config)
+        cache = _load_autotune_cache()
+
+        if key in cache:
+            message('Autotune result (cached): {}'.format(key))
+        else:
+            message('Autotune {}...'.format(key))
+            batch_time, best_settings = autotune(dataset, param_config)
+            if best_settings is not None:
+                cache[key] = {'settings': best_settings, 'batch_time': batch_time}
+                _save_autotune_cache(cache)
+
+        if key in cache:
+            settings.update(cache[key]['settings'])
+            message('Autotune best: {:.6f}s per batch'.format(cache[key]['batch_time']))
+
+    if 'theano' in sys.modules:
+        message('[WARNING] Theano is already imported, the Theano settings are not applied')
+        return
+
+    env = settings_env(settings)
+    for key in ('THEANO_FLAGS', 'OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS'):
+        if key in env:
+            os.environ[key] = env[key]
+
+    message('Theano settings: {}'.format(json.dumps(settings, sort_keys=True)))
+    message('THEANO_FLAGS: {}'.format(os.environ['THEANO_FLAGS']))
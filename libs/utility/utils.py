@@ -9,14 +9,24 @@ import sys
 import time
 import traceback
 from collections import namedtuple
+from functools import wraps
 
 import numpy as np
 
 from config import *
 from my_logging import init_logging_file, finalize_logging_file, message, get_logging_file
+from lazy_function import compile_report, profile_report
+import metrics
+from phase_profiler import profile_phase, reset_phases, phase_report
+import sampling_profiler
+import resource_monitor
+from resource_monitor import monitor_phase, resource_summary
+import status_server
 from path import get_path, split_policy_name, find_newest
 from preprocess import Tilde, simple_parse_args, check_config, strict_update
+from theano_setup import setup_theano
 
+# `main_entry` is "{module}.{function}", the module is in `libs.train`, and it is imported only when it is selected.
 DatasetAttributes = namedtuple('DatasetAttributes', ['name', 'config', 'main_entry'])
 
 # All datasets
@@ -26,6 +36,66 @@ Datasets = {
     'imdb': DatasetAttributes('imdb', IMDBConfig, 'IMDB.main'),
 }
 
+# The resident cache of the daemon mode (None means disabled), see `resident`.
+_resident_cache = None
+
+
+def enable_resident_cache():
+    global _resident_cache
+    if _resident_cache is None:
+        _resident_cache = {}
+
+
+def _random_state():
+    return np.random.get_state(), random.getstate()
+
+
+def _same_random_state(state_a, state_b):
+    (np_state_a, py_state_a), (np_state_b, py_state_b) = state_a, state_b
+    return py_state_a == py_state_b and np_state_a[0] == np_state_b[0] and \
+        np.array_equal(np_state_a[1], np_state_b[1]) and np_state_a[2:] == np_state_b[2:]
+
+
+def resident(config_key):
+    """Keep the results of the (data loading) function in the daemon mode, and reuse them in later jobs.
+
+    Parameters
+    ----------
+    config_key: function
+        Return the configs used by the function, they are part of the cache key (with the arguments).
+
+    [NOTE] The results are shared by the jobs, so they must not be modified in place.
+    The random states before and after the call are cached too. If the call consumed random numbers,
+    the result is only reused when the random state is same as the cached call (then the state is moved to
+    the state after it), so the jobs get the same data and random numbers as a cold run.
+    """
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if _resident_cache is None:
+                return func(*args, **kwargs)
+
+            key = func.__name__, repr(args), repr(sorted(kwargs.items())), repr(config_key())
+            state_before = _random_state()
+
+            entry = _resident_cache.get(key)
+            if entry is not None:
+                result, cached_state_before, cached_state_after = entry
+                if _same_random_state(cached_state_before, cached_state_after):
+                    return result
+                if _same_random_state(cached_state_before, state_before):
+                    np.random.set_state(cached_state_after[0])
+                    random.setstate(cached_state_after[1])
+                    return result
+
+            result = func(*args, **kwargs)
+            _resident_cache[key] = result, state_before, _random_state()
+            return result
+        return wrapper
+    return decorator
+
+
 # The float type of Theano. Default to 'float32'.
 # fX = config.floatX
 fX = Config['floatX']
@@ -34,6 +104,20 @@ fX = Config['floatX']
 RemainOrderJobs = ('log_data', 'check_part_loss',)
 
 
+def get_temp_jobs():
+    """Get the temp jobs (several temp jobs are separated by commas in "temp_job")."""
+    return [name.strip() for name in (Config['temp_job'] or '').split(',') if name.strip()]
+
+
+def is_temp_job(name):
+    return name in get_temp_jobs()
+
+
+def remain_order():
+    """Do the temp jobs need to remain the order of data?"""
+    return any(name in RemainOrderJobs for name in get_temp_jobs())
+
+
 def floatX(value):
     return np.asarray(value, dtype=fX)
 
@@ -106,7 +190,7 @@ def get_part_data(x_data, y_data, part_size=None):
         return x_data, y_data
 
     train_size = x_data.shape[0]
-    if train_size < part_size:
+    if train_size <= part_size:
         return x_data, y_data
 
     # Use small dataset to check the code
@@ -141,6 +225,9 @@ def process_before_train(args=None):
         print('See comments of file "config.json" to know how to set arguments.')
         exit(0)
 
+    autotune_now = '--autotune' in args
+    args = [arg for arg in args if arg != '--autotune']
+
     global_args_dict, policy_args_dict, param_args_dict = simple_parse_args(args)
 
     strict_update(Config, global_args_dict)
@@ -267,7 +354,8 @@ def process_before_train(args=None):
     message('Running on node: {}'.format(platform.node()))
     message('Start Time: {}'.format(time.ctime()))
 
-    message('Command line: "{}"'.format(' '.join(sys.argv)))
+    # [NOTE] Log the parsed arguments (in the daemon, `sys.argv` is the command line of the daemon).
+    message('Command line: "{}"'.format(' '.join(args)))
     message('The configures and hyperparameters are:')
     pprint.pprint(Config, stream=sys.stderr)
 
@@ -275,6 +363,12 @@ def process_before_train(args=None):
     if logging_file != sys.stderr:
         pprint.pprint(Config, stream=logging_file)
 
+    # [NOTE] Must be called before Theano is imported (the train module of the dataset is imported after this).
+    setup_theano(dataset_attr.name, ParamConfig, autotune_now)
+    sampling_profiler.install()
+    resource_monitor.start()
+    status_server.start()
+
     message('[Message before train done]')
 
     return dataset_attr
@@ -290,6 +384,13 @@ def call_or_throw(call_dict, key, *args, **kwargs):  # Unused now
 
 
 def dataset_main(call_table):
+    """Run the train function of the train type.
+
+    If the training fails, the traceback is logged, and the process exits with status 1
+    (after the "after train" messages), so the scheduler and the daemon can tell it from a finished job.
+    """
+
+    succeeded = False
     try:
         train_func = call_table.get(Config['train_type'].lower(), None)
 
@@ -297,19 +398,34 @@ def dataset_main(call_table):
             raise KeyError('Unknown train type {}'.format(Config['train_type']))
 
         train_func()
+        succeeded = True
     except:
         message(traceback.format_exc())
     finally:
-        process_after_train()
+        process_after_train(succeeded)
 
+    if not succeeded:
+        sys.exit(1)
 
-def process_after_train():
+
+# The message of a successful job (see "others/scheduler.py").
+TrainSucceededTag = '[Train succeeded]'
+
+
+def process_after_train(succeeded=True):
     message('[Message after train]')
     message('End Time: {}'.format(time.ctime()))
+    if succeeded:
+        message(TrainSucceededTag)
     message('[Message after train done]')
+    sampling_profiler.stop()
+    resource_monitor.stop()
+    status_server.stop()
+    metrics.close()
     finalize_logging_file()
 
 
+@profile_phase('batching')
 def get_minibatches_idx(n, minibatch_size, shuffle=False):
     """
     Used to shuffle the dataset at each iteration.
@@ -348,38 +464,171 @@ def get_policy(model_type, policy_type, save=True):
     return policy
 
 
-def validate_point_message(
-        model,
-        x_train, y_train, x_validate, y_validate, x_test, y_test,
-        updater,
-        reward_checker=None,
-        **kwargs
-):
-    validate_size = kwargs.pop('validate_size', PolicyConfig['vp_sample_size'])
-    get_training_loss = kwargs.pop('get_training_loss', False)
-    run_test = kwargs.pop('run_test', False)
+# The updater values at a validation point (used in the message and the reward checkers).
+VPState = namedtuple('VPState', [
+    'vp_number', 'vp_position', 'epoch', 'iteration', 'epoch_train_batches', 'total_train_batches',
+    'history_train_loss', 'total_accepted_cases', 'total_seen_cases',
+])
 
-    # Get training loss
-    if get_training_loss:
-        train_loss = model.get_training_loss(x_train, y_train)
-    else:
-        train_loss = None
-
-    # Get validation loss and accuracy
-    x_validate_small, y_validate_small = get_part_data(x_validate, y_validate, validate_size)
-    validate_loss, validate_acc, validate_batches = model.validate_or_test(x_validate_small, y_validate_small)
-    validate_loss /= validate_batches
-    validate_acc /= validate_batches
-
-    if run_test:
-        # Get test loss and accuracy
-        # [NOTE]: In this version, test at each validate point is fixed.
-        test_loss, test_acc, test_batches = model.validate_or_test(x_test, y_test)
-        test_loss /= test_batches
-        test_acc /= test_batches
-    else:
-        test_loss = None
-        test_acc = None
+
+def get_vp_state(updater):
+    return VPState(
+        updater.vp_number, updater.vp_position, updater.epoch, updater.iteration, updater.epoch_train_batches,
+        updater.total_train_batches,
+        updater.epoch_history_train_loss / updater.epoch_train_batches,
+        updater.total_accepted_cases, updater.total_seen_cases,
+    )
+
+
+def is_validation_point(updater, valid_freq):
+    """Is it time to run a validation point? Use the adaptive validation scheduler if it is set."""
+
+    if updater.vp_scheduler is not None:
+        return updater.vp_scheduler.is_validation_point(updater.total_train_batches)
+    return updater.total_train_batches % valid_freq == 0
+
+
+def is_new_best_validation(validate_acc, updater):
+    """Is the validation accuracy better than all previous validation points of the updater?"""
+    return not updater.history_accuracy or validate_acc > max(updater.history_accuracy)
+
+
+def sequential_validate(model, x_validate, y_validate, thresholds, validate_size=None):
+    """Validate the model with sequential testing.
+
+    The validation data is evaluated chunk by chunk in random order.
+    It stops as soon as the Hoeffding bound shows that the accuracy is clearly above or below all thresholds,
+    so the full pass is only needed near a threshold.
+
+    Parameters
+    ----------
+    model: the classifier.
+    x_validate, y_validate: the validation data.
+    thresholds: list of float
+        The pending accuracy thresholds. If it is empty, all validation samples are evaluated.
+    validate_size: int or None
+        The size of the (random) validation sample. None means the whole validation set.
+
+    Returns
+    -------
+    validate_loss, validate_acc, the number of evaluated samples, the size of the validation sample.
+    """
+
+    indices = np.random.permutation(len(y_validate))
+    if validate_size is not None:
+        indices = indices[:validate_size]
+    total_size = len(indices)
+
+    chunk_size = PolicyConfig['sequential_validation_chunk']
+    num_chunks = (total_size + chunk_size - 1) // chunk_size
+
+    # Split the confidence among all the (possible) looks.
+    delta = PolicyConfig['sequential_validation_delta'] / num_chunks
+
+    sum_loss = 0.0
+    sum_acc = 0.0
+    evaluated_size = 0
+    for start in range(0, total_size, chunk_size):
+        chunk = np.sort(indices[start:start + chunk_size])
+        loss, acc, batches = model.validate_or_test(x_validate, y_validate, chunk)
+        sum_loss += loss / batches * len(chunk)
+        sum_acc += acc / batches * len(chunk)
+        evaluated_size += len(chunk)
+
+        if evaluated_size < PolicyConfig['sequential_validation_min_size']:
+            continue
+
+        epsilon = np.sqrt(np.log(2.0 / delta) / (2.0 * evaluated_size))
+        if thresholds and all(abs(sum_acc / evaluated_size - threshold) > epsilon for threshold in thresholds):
+            break
+
+    return sum_loss / evaluated_size, sum_acc / evaluated_size, evaluated_size, total_size
+
+
+# id(x_train) -> (x_train, indices of the stratified sample)
+_training_loss_samples = {}
+
+
+def _get_training_loss_sample(x_train, y_train, sample_size, batch_size):
+    """Get the fixed stratified (by label) sample of the training set, in random order.
+
+    The sample is built once per training set, with its own random state (the global one is not changed).
+    Its size is rounded down to a multiple of `batch_size`.
+    """
+
+    entry = _training_loss_samples.get(id(x_train))
+    if entry is None or entry[0] is not x_train:
+        labels = np.asarray(y_train)
+        rng = np.random.RandomState(Config['seed'])
+        ratio = min(float(sample_size) / len(labels), 1.0)
+
+        indices = np.concatenate([
+            rng.choice(label_indices, int(round(len(label_indices) * ratio)), replace=False)
+            for label_indices in (np.flatnonzero(labels == label) for label in np.unique(labels))
+        ])
+        rng.shuffle(indices)
+        indices = indices[:max(len(indices) // batch_size, 1) * batch_size]
+
+        entry = x_train, indices
+        _training_loss_samples[id(x_train)] = entry
+    return entry[1]
+
+
+def _mean_confidence(batch_losses):
+    """The mean of the batch losses and the half width of its 95% confidence interval (None if unknown)."""
+
+    batch_losses = np.asarray(batch_losses, dtype='float64')
+    if len(batch_losses) < 2:
+        return batch_losses.mean(), None
+    return batch_losses.mean(), 1.96 * batch_losses.std(ddof=1) / np.sqrt(len(batch_losses))
+
+
+def estimate_training_loss(model, x_train, y_train, updater):
+    """Estimate the training loss at the validation point.
+
+    The estimator is set by "train_loss_estimator":
+        "full": the loss on the whole training set (a full forward pass).
+        "sample": the loss on a fixed stratified sample of the training set.
+        "running": the average loss of the batches trained after the last validation point
+            (already computed by `f_train`, so it is free, but the parameters change over these batches).
+            Use "sample" if no batch is trained.
+
+    Returns
+    -------
+    train_loss, the half width of its 95% confidence interval (None for "full").
+    """
+
+    estimator = PolicyConfig['train_loss_estimator']
+
+    if estimator == 'full':
+        return model.get_training_loss(x_train, y_train), None
+
+    if estimator == 'running' and updater.vp_train_losses:
+        return _mean_confidence(updater.vp_train_losses)
+
+    if estimator not in ('sample', 'running'):
+        raise ValueError('Unknown training loss estimator "{}"'.format(estimator))
+
+    batch_size = model.train_batch_size
+    indices = _get_training_loss_sample(x_train, y_train, PolicyConfig['train_loss_sample_size'], batch_size)
+    return _mean_confidence([
+        model.get_training_loss(x_train, y_train, indices[start:start + batch_size])
+        for start in range(0, len(indices), batch_size)
+    ])
+
+
+@profile_phase('logging')
+def vp_result_message(vp_state, train_loss, validate_loss, validate_acc, test_loss, test_acc, test_carried=False,
+                      validate_samples=None, train_loss_ci=None):
+    """The message of the validation point.
+
+    If `test_carried` is True, the test is skipped at this validation point ("test_on_improvement"),
+    and `test_acc` is the test accuracy carried from the last tested validation point, logged as "TeA~:".
+    If `validate_samples` is not None, it is (the number of evaluated samples, the size of the validation sample)
+    of the sequential validation, logged as "VSN:".
+    If `train_loss_ci` is not None, it is the half width of the 95% confidence interval of the estimated
+    training loss, logged as "TLCI:".
+    """
 
     if False:
         message("""\
@@ -391,71 +640,203 @@ def validate_point_message(
     Test Loss: {}
     Test accuracy: {}
     Number of accepted cases: {} of {} total""".format(
-            updater.vp_number, updater.epoch, updater.iteration, updater.epoch_train_batches,
-            updater.total_train_batches,
+            vp_state.vp_number, vp_state.epoch, vp_state.iteration, vp_state.epoch_train_batches,
+            vp_state.total_train_batches,
             '[NotComputed]' if train_loss is None else train_loss,
-            updater.epoch_history_train_loss / updater.epoch_train_batches,
+            vp_state.history_train_loss,
             validate_loss,
             validate_acc,
             '[NotComputed]' if test_loss is None else test_loss,
             '[NotComputed]' if test_acc is None else test_acc,
-            updater.total_accepted_cases, updater.total_seen_cases,
+            vp_state.total_accepted_cases, vp_state.total_seen_cases,
         ))
     else:
         message("VP {}: E {} I {} B {} TB {}".format(
-            updater.vp_number, updater.epoch, updater.iteration, updater.epoch_train_batches,
-            updater.total_train_batches))
+            vp_state.vp_number, vp_state.epoch, vp_state.iteration, vp_state.epoch_train_batches,
+            vp_state.total_train_batches))
         if train_loss is not None:
             message("TL: {:.6f}".format(train_loss))
+        if train_loss_ci is not None:
+            message("TLCI: {:.6f}".format(train_loss_ci))
         message("""\
 HTL: {:.6f}
 VL: {:.6f}
 VA: {:.6f}""".format(
-            updater.epoch_history_train_loss / updater.epoch_train_batches,
+            vp_state.history_train_loss,
             validate_loss,
             validate_acc,
         ))
+        if validate_samples is not None:
+            message("VSN: {} / {}".format(*validate_samples))
         if test_loss is not None:
             message("TeL: {:.6f}".format(test_loss))
         if test_acc is not None:
-            message("TeA: {:.6f}".format(test_acc))
-        message("NAC: {} / {} T".format(updater.total_accepted_cases, updater.total_seen_cases, ))
+            message("{}: {:.6f}".format('TeA~' if test_carried else 'TeA', test_acc))
+        message("NAC: {} / {} T".format(vp_state.total_accepted_cases, vp_state.total_seen_cases, ))
+
+    metrics.record(
+        'vp', vp=vp_state.vp_number, epoch=vp_state.epoch, iteration=vp_state.iteration,
+        batch=vp_state.epoch_train_batches, total_batch=vp_state.total_train_batches,
+        train_loss=train_loss, train_loss_ci=train_loss_ci, history_train_loss=vp_state.history_train_loss,
+        validate_loss=validate_loss, validate_acc=validate_acc, test_loss=test_loss, test_acc=test_acc,
+        test_carried=test_carried, accepted_cases=vp_state.total_accepted_cases,
+        seen_cases=vp_state.total_seen_cases,
+    )
+
+
+@profile_phase('logging')
+def batch_loss_message(updater, part_train_cost):
+    """The message of the batch training loss ("tL", echoed as `metrics.echo_batch`)."""
+
+    metrics.record('batch_loss', epoch=updater.epoch, batch=updater.epoch_train_batches,
+                   total_batch=updater.total_train_batches, loss=part_train_cost)
+    if metrics.echo_batch(updater.epoch_train_batches):
+        message("tL {}: {:.6f}".format(updater.epoch_train_batches, part_train_cost.tolist()))
+
+
+@profile_phase('validation')
+@monitor_phase('validation')
+def validate_point_message(
+        model,
+        x_train, y_train, x_validate, y_validate, x_test, y_test,
+        updater,
+        reward_checker=None,
+        **kwargs
+):
+    """The validation point.
+
+    If `updater.async_validator` is set, the validation (and test) is run asynchronously.
+
+    Returns
+    -------
+    List of (validate_acc, test_acc, vp_state) of the finished validation points:
+        the current one in synchronous mode, or all delivered after the last validation point in asynchronous mode
+        (maybe empty, or more than one). The callers should process each of them in order,
+        and use the `VPState` of the result (not the current updater values) for the iteration of the result.
+    """
+
+    validate_size = kwargs.pop('validate_size', PolicyConfig['vp_sample_size'])
+    get_training_loss = kwargs.pop('get_training_loss', False)
+    run_test = kwargs.pop('run_test', False)
+
+    # Get training loss
+    if get_training_loss:
+        train_loss, train_loss_ci = estimate_training_loss(model, x_train, y_train, updater)
+    else:
+        train_loss, train_loss_ci = None, None
+    updater.vp_train_losses = []
+
+    vp_state = get_vp_state(updater)
+
+    if updater.async_validator is not None:
+        if validate_size is None or len(y_validate) <= validate_size:
+            validate_indices = None
+        else:
+            validate_indices = np.sort(random.sample(range(len(y_validate)), validate_size))
+
+        vp_results = updater.async_validator.submit(
+            model, updater, vp_state, reward_checker, train_loss, validate_indices, run_test, train_loss_ci)
+
+        # Schedule the next validation point (the delivered results are added to the scheduler by the validator)
+        if updater.vp_scheduler is not None:
+            updater.vp_scheduler.schedule(updater.total_train_batches)
+    else:
+        thresholds = reward_checker.pending_thresholds() \
+            if PolicyConfig['sequential_validation'] and reward_checker is not None else None
+
+        # [NOTE] No pending thresholds (all decided) does not mean any accuracy is enough:
+        # the accuracy is still used in the history accuracy and the best validation, so run the full pass.
+        if thresholds:
+            # Only compare with the thresholds, stop early if the accuracy is far from them.
+            validate_loss, validate_acc, evaluated_size, sample_size = sequential_validate(
+                model, x_validate, y_validate, thresholds, validate_size)
+            validate_samples = evaluated_size, sample_size
+        else:
+            # Get validation loss and accuracy
+            x_validate_small, y_validate_small = get_part_data(x_validate, y_validate, validate_size)
+            validate_loss, validate_acc, validate_batches = model.validate_or_test(x_validate_small, y_validate_small)
+            validate_loss /= validate_batches
+            validate_acc /= validate_batches
+            validate_samples = None
+
+        # In "test_on_improvement" mode, only test when the validation accuracy is a new best.
+        test_carried = run_test and Config['test_on_improvement'] and \
+            not is_new_best_validation(validate_acc, updater)
+
+        if test_carried:
+            test_loss = None
+            test_acc = updater.last_test_acc
+        elif run_test:
+            # Get test loss and accuracy
+            # [NOTE]: In this version, test at each validate point is fixed.
+            test_loss, test_acc, test_batches = model.validate_or_test(x_test, y_test)
+            test_loss /= test_batches
+            test_acc /= test_batches
+            updater.last_test_acc = test_acc
+        else:
+            test_loss = None
+            test_acc = None
+
+        vp_result_message(vp_state, train_loss, validate_loss, validate_acc, test_loss, test_acc, test_carried,
+                          validate_samples, train_loss_ci)
+
+        # Check speed rewards
+        if reward_checker is not None:
+            reward_checker.check(validate_acc, updater)
 
-    # Check speed rewards
-    if reward_checker is not None:
-        reward_checker.check(validate_acc, updater)
+        vp_results = [(validate_acc, test_acc, vp_state)]
+
+        # Schedule the next validation point
+        if updater.vp_scheduler is not None:
+            updater.vp_scheduler.update(updater.total_train_batches, validate_acc)
 
     # The policy start a new validation point
+    # [NOTE] The replay buffer of the policy is still partitioned per validation point,
+    # so the immediate rewards and the partitions are aligned.
     updater_policy = getattr(updater, 'policy', None)
     if kwargs.pop('start_new_vp', True) and updater_policy:
         updater.policy.start_new_validation_point()
 
+    resource_summary('VP {}'.format(vp_state.vp_number))
+    status_server.track(reward_checker=reward_checker)
+    status_server.update(vp_number=vp_state.vp_number)
+    if vp_results:
+        status_server.update(validate_acc=vp_results[-1][0], test_acc=vp_results[-1][1])
+
     # [NOTE] Important! increment `vp_number` in validation point.
     # `DeltaAccuracyRewardChecker` need `vp_number` to work correctly.
     updater.vp_number += 1
 
-    if Config['temp_job'] == 'check_selected_data_label':
-        message("""\
-Epoch label count: {}
-Total label count: {}""".format(
-            updater.epoch_label_count,
-            updater.total_label_count,
-        ))
-    elif Config['temp_job'] == 'log_data':
-        updater.log_data_message_at_vp(reset=True)
-    elif Config['temp_job'] == 'log_dropped_data':
-        updater.log_dropped_data_message_at_vp()
+    for hook in updater.hooks.validation_point:
+        hook()
 
     # Update the history accuracy.
-    updater.history_accuracy.append(validate_acc)
+    if updater.async_validator is None:
+        updater.history_accuracy.append(validate_acc)
+
+    return vp_results
 
-    return validate_acc, test_acc
+
+def wait_validation_points(updater):
+    """Wait for the asynchronous validation points.
+
+    Returns
+    -------
+    List of (validate_acc, test_acc, vp_state) of the validation points finished after the last validation point
+    message.
+    """
+
+    if updater.async_validator is None:
+        return []
+    return updater.async_validator.wait()
 
 
 def start_new_episode(model, policy, episode):
     print('[Episode {}]'.format(episode))
     message('[Episode {}]'.format(episode))
 
+    sampling_profiler.new_episode(episode)
+    status_server.update(episode=episode)
     policy.start_new_episode(episode)
     model.reset_parameters()
 
@@ -464,6 +845,16 @@ def start_new_epoch(updater, epoch):
     print('[Epoch {}]'.format(epoch))
     message('[Epoch {}]'.format(epoch))
 
+    if epoch > 0:
+        phase_report('epoch', 'Epoch {}'.format(epoch - 1))
+    else:
+        # A new episode
+        reset_phases('episode')
+        reset_phases('epoch')
+    sampling_profiler.new_epoch(epoch)
+    resource_monitor.set_phase('epoch')
+    status_server.track(updater)
+
     updater.start_new_epoch()
     return time.time()
 
@@ -475,15 +866,26 @@ def episode_final_message(best_validate_acc, best_iteration, test_score, start_t
     message('$  obtained at iteration {}'.format(best_iteration))
     message('$  Time passed: {:.2f}s'.format(time.time() - start_time))
 
+    episode_end_report(updater)
+
+
+def episode_end_report(updater=None):
+    """The reports and the hooks at the end of an episode (also used by the loops without final results)."""
+
+    # The functions compiled in this episode (in the first episode, all used functions)
+    compile_report()
+    profile_report('Episode')
+
+    phase_report('epoch', 'Last epoch' if updater is None else 'Epoch {}'.format(updater.epoch))
+    phase_report('episode', 'Episode')
+    sampling_profiler.episode_end()
+    resource_summary('Episode', 'episode')
+
     if updater is None:
         return
 
-    if Config['temp_job'] == 'dump_index':
-        train_index_filename = os.path.join(DataPath, Config['dataset'],
-                                            '{}_train_index.pkl'.format(Config['job_name']))
-        with open(train_index_filename, 'wb') as f:
-            pkl.dump(updater.train_index, f)
-        message("Dump train index to '{}'".format(train_index_filename))
+    for hook in updater.hooks.episode_end:
+        hook()
 
 
 def _test_initialize():
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+
+"""Adaptive validation point scheduling."""
+
+from __future__ import print_function
+
+import numpy as np
+
+from .utility.config import PolicyConfig
+
+
+class ValidationScheduler(object):
+    """Set the gap between validation points from the observed accuracy slope and the pending reward thresholds.
+
+    The nominal gap is `valid_freq` batches, the real gap is clipped into
+    [`adaptive_vp_min_ratio` * valid_freq, `adaptive_vp_max_ratio` * valid_freq].
+
+    If there are pending thresholds (speed reward), the reward is sensitive to when the accuracy crosses them,
+    so the gap is set to check `adaptive_vp_checks` times before the (extrapolated) crossing of the nearest one.
+    Else, the gap is inversely proportional to the accuracy slope (relative to the max slope seen),
+    so validation points are sparse late in training, when the accuracy changes slowly.
+
+    [NOTE] `updater.vp_number` is still increased by 1 at each validation point,
+    the nominal position (`vp_position`) is used to look up the baseline of `DeltaAccuracyRewardChecker`.
+    """
+
+    def __init__(self, valid_freq, reward_checker=None):
+        self.valid_freq = valid_freq
+        self.reward_checker = reward_checker
+
+        self.min_gap = max(1, int(valid_freq * PolicyConfig['adaptive_vp_min_ratio']))
+        self.max_gap = max(self.min_gap, int(valid_freq * PolicyConfig['adaptive_vp_max_ratio']))
+
+        # (total train batches, validation accuracy) of previous validation points
+        self.history = []
+        self.max_slope = 0.0
+
+        self.next_point = valid_freq
+
+    def is_validation_point(self, total_train_batches):
+        return total_train_batches >= self.next_point
+
+    def vp_position(self, total_train_batches):
+        """The nominal validation point number (maybe fractional) of fixed `valid_freq`."""
+        return float(total_train_batches) / self.valid_freq - 1
+
+    def add_result(self, total_train_batches, validate_acc):
+        """Add the validation accuracy of a validation point, at the total train batches of that point."""
+
+        if not np.isfinite(validate_acc):
+            return
+
+        self.history.append((total_train_batches, validate_acc))
+        if len(self.history) >= 2:
+            self.max_slope = max(self.max_slope, abs(self._slope()))
+
+    def _slope(self):
+        (batches_0, acc_0), (batches_1, acc_1) = self.history[-2:]
+        return (acc_1 - acc_0) / max(batches_1 - batches_0, 1)
+
+    def schedule(self, total_train_batches):
+        """Schedule the next validation point after the current one (from the results added so far)."""
+
+        gap = self.valid_freq
+
+        if len(self.history) >= 2:
+            slope = self._slope()
+            acc_1 = self.history[-1][1]
+
+            thresholds = self.reward_checker.pending_thresholds() if self.reward_checker is not None else None
+
+            if thresholds:
+                above = [threshold - acc_1 for threshold in thresholds if threshold > acc_1]
+                if above and slope > 0:
+                    gap = min(above) / slope / PolicyConfig['adaptive_vp_checks']
+                elif not above:
+                    # Already over the thresholds (not checked yet), check it soon.
+                    gap = self.min_gap
+                else:
+                    gap = self.max_gap
+            elif slope != 0:
+                gap = self.valid_freq * self.max_slope / abs(slope)
+            else:
+                gap = self.max_gap
+
+        self.next_point = total_train_batches + int(np.clip(gap, self.min_gap, self.max_gap))
+
+    def update(self, total_train_batches, validate_acc):
+        """Add the result of the current validation point and schedule the next one (synchronous validation).
+
+        [NOTE] In asynchronous validation, the results are added when they are delivered
+        (at the total train batches of their own validation points), and `schedule` is called at each point.
+        """
+
+        self.add_result(total_train_batches, validate_acc)
+        self.schedule(total_train_batches)
+
+
+def get_vp_scheduler(valid_freq, reward_checker=None):
+    """Create the validation scheduler if "adaptive_vp" is set, else return None."""
+
+    if not PolicyConfig['adaptive_vp']:
+        return None
+    return ValidationScheduler(valid_freq, reward_checker)
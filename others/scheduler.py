@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+
+"""A local experiment scheduler, which packs the jobs across the CPU cores.
+
+The jobs are `train.py` command lines (such as the lines in "common_config/*.bat").
+Each running job gets its own CPU cores (by `taskset`, if available) and BLAS/OpenMP thread count,
+at most (number of cores / threads per job) jobs run at once.
+
+The queue is persistent (a JSON file), so an interrupted scheduler can be resumed (the running jobs are rerun).
+The jobs which are already finished (the log file in "log/" has the "train succeeded" message) are skipped,
+a job is done only if it exits with 0 and writes this message (a crashed job is failed and rerun on resume).
+The throughput stats of each job (time, validation points, batches per second) are appended to a JSON lines file.
+
+Usage:
+    python others/scheduler.py add <job file> [<job file> ...]
+    python others/scheduler.py run [-t THREADS] [-j JOBS]
+    python others/scheduler.py status
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import multiprocessing as mp
+import os
+import shlex
+import subprocess
+import sys
+import time
+from distutils.spawn import find_executable
+
+ProjectRootPath = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ProjectRootPath)
+
+from libs.utility.config import Config, LogPath
+from libs.utility.preprocess import Tilde, simple_parse_args
+
+SchedulerPath = os.path.join(LogPath, 'scheduler')
+QueueFile = os.path.join(SchedulerPath, 'queue.json')
+StatsFile = os.path.join(SchedulerPath, 'stats.jsonl')
+
+# The message of a successful job (`TrainSucceededTag` in "libs/utility/utils.py", see `process_after_train`).
+FinishedTag = '[Train succeeded]'
+
+
+def parse_job(command):
+    """Get the job name and the logging file of the `train.py` command line."""
+
+    global_args, _, _ = simple_parse_args(shlex.split(command))
+
+    job_name = global_args.get('job_name', Config['job_name'])
+    dataset = global_args.get('dataset', Config['dataset'])
+    logging_file = global_args.get('logging_file', Config['logging_file'])
+
+    if job_name:
+        dataset = job_name.split('-')[0]
+        logging_file = logging_file or '~/log-{}.txt'.format(job_name)
+
+    if logging_file:
+        logging_file = logging_file.replace(Tilde, os.path.join(LogPath, dataset))
+        logging_file = os.path.normpath(os.path.join(ProjectRootPath, logging_file))
+
+    return job_name or (logging_file and os.path.basename(logging_file)) or command, logging_file
+
+
+def is_finished(logging_file):
+    if not logging_file or not os.path.exists(logging_file):
+        return False
+    with open(logging_file, 'r') as f:
+        return any(line.startswith(FinishedTag) for line in f)
+
+
+def load_queue():
+    if not os.path.exists(QueueFile):
+        return []
+    with open(QueueFile, 'r') as f:
+        return json.load(f)
+
+
+def save_queue(queue):
+    if not os.path.exists(SchedulerPath):
+        os.makedirs(SchedulerPath)
+
+    temp_file = QueueFile + '.tmp'
+    with open(temp_file, 'w') as f:
+        json.dump(queue, f, indent=1)
+    os.rename(temp_file, QueueFile)
+
+
+def read_job_file(filename):
+    """Read the `train.py` command lines (skip comments and other commands)."""
+
+    commands = []
+    with open(filename, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith('python') and 'train.py' in line:
+                commands.append(line[line.index('train.py') + len('train.py'):].strip())
+    return commands
+
+
+def add_jobs(job_files):
+    queue = load_queue()
+    known_names = {job['name'] for job in queue}
+
+    added = 0
+    for filename in job_files:
+        for command in read_job_file(filename):
+            name, logging_file = parse_job(command)
+            if name in known_names:
+                print('Skip duplicated job {}'.format(name))
+                continue
+
+            known_names.add(name)
+            queue.append({
+                'name': name,
+                'command': command,
+                'logging_file': logging_file,
+                'status': 'pending',
+            })
+            added += 1
+
+    save_queue(queue)
+    print('Added {} jobs, {} jobs in queue'.format(added, len(queue)))
+
+
+def job_stats(job, duration):
+    """The throughput stats of the finished job, parsed from its log file."""
+
+    vp_number, total_batches = 0, None
+    if job['logging_file'] and os.path.exists(job['logging_file']):
+        with open(job['logging_file'], 'r') as f:
+            for line in f:
+                # "VP {}: E {} I {} B {} TB {}"
+                if line.startswith('VP '):
+                    vp_number += 1
+                    total_batches = int(line.split()[-1])
+
+    return {
+        'name': job['name'],
+        'status': job['status'],
+        'cores': job['cores'],
+        'threads': len(job['cores']),
+        'time': duration,
+        'validation_points': vp_number,
+        'total_batches': total_batches,
+        'batches_per_second': total_batches / duration if total_batches and duration > 0 else None,
+    }
+
+
+def start_job(job, cores):
+    env = dict(os.environ)
+    threads = str(len(cores))
+    for key in ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS'):
+        env[key] = threads
+
+    command = [sys.executable, 'train.py'] + shlex.split(job['command'])
+    if find_executable('taskset'):
+        command = ['taskset', '-c', ','.join(str(core) for core in cores)] + command
+
+    output = open(os.path.join(SchedulerPath, '{}.out'.format(job['name'].replace(os.sep, '_'))), 'a')
+    return subprocess.Popen(command, cwd=ProjectRootPath, env=env, stdout=output, stderr=subprocess.STDOUT)
+
+
+def run_jobs(threads, max_jobs=None):
+    queue = load_queue()
+
+    # Resume: the running jobs of the interrupted scheduler are rerun.
+    for job in queue:
+        if job['status'] == 'running':
+            job['status'] = 'pending'
+
+    cpu_count = mp.cpu_count()
+    threads = max(1, min(threads, cpu_count))
+    slots = [list(range(i * threads, (i + 1) * threads)) for i in range(cpu_count // threads)]
+    if max_jobs:
+        slots = slots[:max_jobs]
+    print('Run at most {} jobs at once, {} threads per job'.format(len(slots), threads))
+
+    free_slots = list(range(len(slots)))
+    running = {}    # job index -> (process, slot, start time)
+
+    while True:
+        for i, job in enumerate(queue):
+            if not free_slots:
+                break
+            if job['status'] != 'pending':
+                continue
+
+            if is_finished(job['logging_file']):
+                job['status'] = 'skipped'
+                print('Skip finished job {}'.format(job['name']))
+                continue
+
+            slot = free_slots.pop(0)
+            job['status'] = 'running'
+            job['cores'] = slots[slot]
+            running[i] = start_job(job, slots[slot]), slot, time.time()
+            print('Start job {} on cores {}'.format(job['name'], slots[slot]))
+        save_queue(queue)
+
+        if not running:
+            break
+
+        time.sleep(1.0)
+
+        for i, (process, slot, start_time) in list(running.items()):
+            if process.poll() is None:
+                continue
+
+            del running[i]
+            free_slots.append(slot)
+
+            job = queue[i]
+            # [NOTE] The job without a logging file (log to stderr) is checked by the exit status only.
+            succeeded = process.returncode == 0 and (not job['logging_file'] or is_finished(job['logging_file']))
+            job['status'] = 'done' if succeeded else 'failed'
+            stats = job_stats(job, time.time() - start_time)
+            with open(StatsFile, 'a') as f:
+                f.write(json.dumps(stats) + '\n')
+            print('Job {} {} in {:.1f}s'.format(job['name'], job['status'], stats['time']))
+        save_queue(queue)
+
+
+def show_status():
+    queue = load_queue()
+    for job in queue:
+        print('{:<10}{}'.format(job['status'], job['name']))
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='The local experiment scheduler.')
+    subparsers = parser.add_subparsers(dest='command')
+
+    parser_add = subparsers.add_parser('add', help='Add jobs from the job files (.bat)')
+    parser_add.add_argument('files', nargs='+', help='The job files')
+
+    parser_run = subparsers.add_parser('run', help='Run (or resume) the jobs in the queue')
+    parser_run.add_argument('-t', '--threads', type=int, default=4, help='The threads (cores) per job, default is 4')
+    parser_run.add_argument('-j', '--jobs', type=int, default=None, help='The max number of jobs at once')
+
+    subparsers.add_parser('status', help='Show the queue')
+
+    options = parser.parse_args(args)
+
+    if options.command == 'add':
+        add_jobs(options.files)
+    elif options.command == 'run':
+        run_jobs(options.threads, options.jobs)
+    else:
+        show_status()
+
+
+if __name__ == '__main__':
+    main()
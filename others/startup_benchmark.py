@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+
+"""Benchmark the startup time of `train.py`.
+
+Each case is run in a new Python process for several times, and the median wall time is reported:
+    help: `train.py -h` (only parse the configs)
+    import-{dataset}: import the train module of the dataset (as `train.py` does for the selected dataset)
+
+Usage:
+    python others/startup_benchmark.py [repeat] [dataset ...]
+"""
+
+from __future__ import print_function
+
+import os
+import subprocess
+import sys
+import time
+
+ProjectRootPath = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_case(command, repeat):
+    times = []
+    with open(os.devnull, 'w') as devnull:
+        for _ in range(repeat):
+            start_time = time.time()
+            subprocess.check_call(command, cwd=ProjectRootPath, stdout=devnull, stderr=devnull)
+            times.append(time.time() - start_time)
+    return sorted(times)[len(times) // 2]
+
+
+def main(args=None):
+    args = args or sys.argv[1:]
+
+    repeat = int(args[0]) if args else 5
+    datasets = args[1:] or ['MNIST', 'CIFAR10', 'IMDB']
+
+    cases = [('help', [sys.executable, 'train.py', '-h'])]
+    for dataset in datasets:
+        cases.append(('import-{}'.format(dataset),
+                      [sys.executable, '-c', 'import libs.train.{}'.format(dataset)]))
+
+    print('Median startup time of {} runs:'.format(repeat))
+    for name, command in cases:
+        print('    {:<20}{:.3f}s'.format(name, run_case(command, repeat)))
+
+
+if __name__ == '__main__':
+    main()
@@ -21,7 +21,8 @@ from utils import Curves, legend, average_list, move_avg, CFG, pick_interval
 Interval = 4
 
 
-def get_data_list(filename, dataset='mnist', interval=Interval, start_tags=('Test accuracy:', 'TeA:')):
+# 'TeA~:' is the test accuracy carried from the last tested validation point (in "test_on_improvement" mode).
+def get_data_list(filename, dataset='mnist', interval=Interval, start_tags=('Test accuracy:', 'TeA:', 'TeA~:')):
     if filename is None:
         return None
 
@@ -1,23 +1,40 @@
 # -*- coding: utf-8 -*-
 
-"""The main entry of training."""
+"""The main entry of training.
+
+Usage:
+    python train.py [options]               Run a job.
+    python train.py --daemon                Run the warm training daemon (see `libs/daemon.py`).
+    python train.py --submit [options]      Submit a job to the daemon ("--submit shutdown" to stop it).
+"""
 
 from __future__ import print_function
 
-from libs.train import *
-from libs.utility.utils import process_before_train
+import importlib
+import sys
 
+from libs.utility.utils import process_before_train
 
-def main():
-    # Just ref them, or they may be optimized out by PyCharm.
-    _ = CIFAR10
 
+def main(args=None):
     # Set the configs (include dataset specific config), and return the dataset attributes.
-    dataset_attr = process_before_train()
+    dataset_attr = process_before_train(args)
 
-    # Call the dataset main entry.
-    eval('{}()'.format(dataset_attr.main_entry))
+    # Import the train module of the selected dataset only (other datasets, models and Lasagne are not imported),
+    # then call the dataset main entry.
+    module_name, entry_name = dataset_attr.main_entry.rsplit('.', 1)
+    module = importlib.import_module('libs.train.{}'.format(module_name))
+    getattr(module, entry_name)()
 
 
 if __name__ == '__main__':
-    main()
+    if sys.argv[1:2] == ['--daemon']:
+        from libs.daemon import run_daemon
+        run_daemon(main)
+    elif sys.argv[1:2] == ['--submit']:
+        from libs.daemon import submit_job
+        reply = submit_job(sys.argv[2:])
+        print(reply)
+        sys.exit(0 if not reply.startswith('error') else 1)
+    else:
+        main()